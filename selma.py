@@ -10,26 +10,154 @@ by user defined 'event cards'. The event cards
 involves characters and has requirements of the world
 state to be picked.
 """
-import random
+from collections import Counter
 import operator
-from collections import defaultdict
+import random
+import selma_deck_cache
 import selma_file_reader
 import selma_parser as parser
+from selma_analysis import SelmaDeckAnalysis
+from selma_card_table import SelmaCardTable
+from selma_cast_index import SelmaCastIndex
+from selma_draw_deck import SelmaDrawDeck
+from selma_event_log import SelmaEvent, SelmaEventLog
+from selma_eligibility import SelmaCardEligibility, get_change_keys, OPERATORS_ON_ALL
+from selma_journal import SelmaJournal, SelmaSnapshot
+
+# How update_cast_variable() changes a number with each operator
+NUMBER_UPDATES = {
+    parser.OPERATOR['assign-value']: lambda value, number: number,
+    parser.OPERATOR['add-to']: operator.add,
+    parser.OPERATOR['subtract-from']: operator.sub,
+    parser.OPERATOR['multiply-numeric']: operator.mul,
+    parser.OPERATOR['divide-numeric']: operator.truediv,
+}
+
+class SelmaTokenList(list):
+    """
+    A list which also counts its items once it grows long, so that
+    testing if an item is in the list takes O(1) time. Used for
+    attributes and inventories.
+    """
+
+    __slots__ = ("counts",)
+
+    # Lists up to this long are simply searched, which is as fast and
+    # saves keeping a Counter for every small list
+    max_unindexed_length = 8
 
-class SelmaCharacter:
+    def __init__(self, items=()):
+        super().__init__(items)
+        self.counts = None
+
+    def __contains__(self, item):
+        if len(self) <= self.max_unindexed_length:
+            return super().__contains__(item)
+        if self.counts is None:
+            try:
+                self.counts = Counter(self)
+            except TypeError:
+                # Items which can't be hashed can't be counted
+                return super().__contains__(item)
+        try:
+            return item in self.counts
+        except TypeError:
+            return super().__contains__(item)
+
+    def change_count(self, item, change):
+        """Changes the count of 'item', if the items are counted. The counts
+        are dropped if 'item' can't be hashed"""
+        if self.counts is None:
+            return
+        try:
+            self.counts[item] += change
+            if not self.counts[item]:
+                del self.counts[item]
+        except TypeError:
+            self.counts = None
+
+    def append(self, item):
+        super().append(item)
+        self.change_count(item, 1)
+
+    def extend(self, items):
+        super().extend(items)
+        self.counts = None
+
+    def __iadd__(self, items):
+        self.extend(items)
+        return self
+
+    def insert(self, index, item):
+        super().insert(index, item)
+        self.change_count(item, 1)
+
+    def remove(self, item):
+        super().remove(item)
+        self.change_count(item, -1)
+
+    def pop(self, index=-1):
+        item = super().pop(index)
+        self.counts = None
+        return item
+
+    def clear(self):
+        super().clear()
+        self.counts = None
+
+    def __setitem__(self, index, value):
+        super().__setitem__(index, value)
+        self.counts = None
+
+    def __delitem__(self, index):
+        super().__delitem__(index)
+        self.counts = None
+
+    def __imul__(self, times):
+        super().__imul__(times)
+        self.counts = None
+        return self
+
+    def copy(self):
+        return SelmaTokenList(self)
+
+    def __reduce__(self):
+        return SelmaTokenList, (list(self),)
+
+
+class SelmaCharacter(parser.SelmaVarHolder):
     """
     A SelmaCharacter is a character which can be picked
     to play roles in the simulation.
+
+    Characters have __slots__ instead of a __dict__, to save memory in
+    large casts. Statements reach the slots through the SelmaVarHolder
+    protocol, so paths like 'attributes' and 'var.x' work as before.
     """
 
+    __slots__ = ("name",
+                 "gender",
+                 "age",
+                 "attributes",
+                 "personality",
+                 "inventory",
+                 "mood",
+                 "job",
+                 "happiness",
+                 "var",
+                 "world")
+
+    # Slots holding lists which are kept as SelmaTokenLists
+    token_lists = ("attributes", "personality", "inventory")
+
     def __init__(self):
         """This Initializes the SelmaCharacter"""
         self.name = "no name"
         self.gender = ""
         self.age = 0
-        self.attributes = []
-        self.personality = []
-        self.inventory = []
+        self.attributes = SelmaTokenList()
+        self.personality = SelmaTokenList()
+        self.inventory = SelmaTokenList()
         self.mood = "neutral"
         self.job = ""
         self.happiness = 0
@@ -55,6 +183,13 @@ class SelmaCharacter:
 
         return result
 
+    def __setitem__(self, name, value):
+        """Sets a slot, keeping lists like attributes as SelmaTokenLists"""
+        if (name in self.token_lists and isinstance(value, list) and
+                not isinstance(value, SelmaTokenList)):
+            value = SelmaTokenList(value)
+        super().__setitem__(name, value)
+
 
 class SelmaEventCard:
     """
@@ -109,6 +244,21 @@ class SelmaEventCard:
                 if role_name:
                     self.roles[role_name] = role_conditions
 
+        # Compile every statement on the card now, so that any errors
+        # are found when the card is loaded instead of when it's drawn
+        try:
+            self.compiled_conditions = tuple(
+                parser.compile_condition(line) for line in self.conditions)
+            self.compiled_effects = tuple(
+                parser.compile_effect(line) for line in self.effects)
+            self.compiled_roles = tuple(
+                (role, tuple(parser.compile_condition(line)
+                             for line in self.roles[role]))
+                for role in self.roles)
+        except parser.SelmaParseException as exception:
+            raise parser.SelmaParseException("Error in card '%s': %s"
+                                             % (name, exception))
+
     def fullfill_conditions(self, obj, _attributes, card_name):
         """
         Returns true if all the condtions on this card are met
@@ -123,46 +273,41 @@ class SelmaEventCard:
 
         # Pick a random character in the cast until
         # we find someone to fill the role
-        taken_characters = []
-
-        for role in self.roles:
+        taken_characters = set()
 
-            conditions = self.roles[role]
-            characters_to_try = list(obj.cast)
+        for role, conditions in self.compiled_roles:
 
-            # We don't test any characters that has already gotten a role
-            for taken_character in taken_characters:
-                if taken_character in characters_to_try:
-                    characters_to_try.remove(taken_character)
+            # Let the index rule out as many characters as possible,
+            # and test the rest of the conditions on each candidate
+            candidates, conditions_to_test = obj.cast_index.get_candidates(conditions)
 
-            # Loop until we find someone to fill the role or we
-            # run out of characters to try for it
-            while characters_to_try and not role in obj.roles:
+            # This is done because it is very important
+            # that the characters are tested in random order!
+            for candidate in random_items_from_list(candidates, obj.random):
 
-                # This is done because it is very important
-                # that the characters are tested in random order!
-                candidate = random_item_from_list(characters_to_try)
+                # We don't test any characters that has already gotten a role
+                if candidate.name in taken_characters:
+                    continue
 
                 passes_all_conditions = True
-                for condition in conditions:
+                for condition in conditions_to_test:
                     try:
-                        evaluation_result = parser.evaluate_condition(obj.cast[candidate],
-                                                                      condition)
+                        evaluation_result = condition.evaluate(candidate)
                     except Exception as exception:
                         print("Error while testing condition '%s' on card '%s'"
-                              % (condition, card_name))
+                              % (condition.line, card_name))
                         raise parser.SelmaParseException(exception)
 
                     # If this guy doesn't cut it, ignore him and try the next one
                     if not evaluation_result:
                         passes_all_conditions = False
-                        characters_to_try.remove(candidate)
                         break
 
                 # This person gets the role
                 if passes_all_conditions:
-                    obj.roles[role] = obj.cast[candidate]
-                    taken_characters.append(candidate)
+                    obj.roles[role] = candidate
+                    taken_characters.add(candidate.name)
+                    break
 
             # No one could fill the role, so return False
             if not role in obj.roles:
@@ -170,8 +315,8 @@ class SelmaEventCard:
                 return False
 
         # Test every condition on the card itself
-        for condition in self.conditions:
-            if not parser.evaluate_condition(obj, condition):
+        for condition in self.compiled_conditions:
+            if not condition.evaluate(obj):
                 return False
 
         return True
@@ -204,12 +349,18 @@ class SelmaStorySimulation:
 
     def __init__(self,
                  debug_mode=True,
-                 allow_output=True):
-        """This Initializes the object."""
-        self.draw_deck = []
+                 allow_output=True,
+                 seed=None,
+                 track_causes=True):
+        """This Initializes the object. A simulation with a 'seed' makes
+        the same choices every time it is run from the same file. If
+        'track_causes' is False, nothing is saved about what the events
+        required, and no event has any causes"""
+        self.draw_deck = SelmaDrawDeck()
         self.event_cards = {}
 
-        self.all_card_names = []
+        self.card_table = SelmaCardTable()
+        self.analysis = SelmaDeckAnalysis()
         self.all_character_names = []
 
         self.draw_deck_size = 5
@@ -217,27 +368,47 @@ class SelmaStorySimulation:
         self.attributes = []
         self.var = {}
         self.cast = {}
+        self.cast_index = SelmaCastIndex(self.cast)
         self.roles = {}
 
-        self.past_events = []
+        self.eligibility = SelmaCardEligibility(self)
 
         self.debug_mode = debug_mode
         self.allow_output = allow_output
         parser.allow_print_out = allow_output
 
-        self.past_events = []
+        self.random = SelmaRandom(seed)
+
+        self.past_events = SelmaEventLog()
+        self.track_causes = track_causes
         self.steps_count = 0
 
+        # The undo journal, which is only kept once a snapshot is taken
+        self.journal = None
+
         if self.allow_output:
             print("\n👵🏻---👵🏻--SELMA STORY SIMULATION--👵🏻---👵🏻\n")
 
-    def load_from_file(self, path):
-        """Loads cards and characters into this simulation from a .selma file"""
+    def load_from_file(self, path, use_cache=True):
+        """Loads cards and characters into this simulation from a .selma file.
+        If 'use_cache' is True and nothing has been loaded into the simulation
+        yet, the result is stored in a signed .selmac file in the cache
+        directory of the user and read from there the next time, as long as
+        no file it includes has changed"""
 
         if self.allow_output:
             print("<-Load file '%s'->\n" % path)
 
-        selma_file_reader.load_selma_file(self, path)
+        if use_cache and selma_deck_cache.can_use_cache(self):
+            if selma_deck_cache.load_cache(self, path):
+                if self.allow_output:
+                    print("Loaded compiled cache '%s'"
+                          % selma_deck_cache.get_cache_path(path))
+            else:
+                files_read = selma_file_reader.load_selma_file(self, path)
+                selma_deck_cache.save_cache(self, path, files_read)
+        else:
+            selma_file_reader.load_selma_file(self, path)
 
         if self.allow_output:
             print("")
@@ -260,12 +431,44 @@ class SelmaStorySimulation:
                                                 effects,
                                                 next_cards,
                                                 role_tuples)
+        self.card_table.add(name, amount)
+        self.eligibility.add_card(self.event_cards[name])
+        self.analysis.add_card(self.event_cards[name])
+
+    def set_goal(self, card_name=None, conditions=(), strength=2):
+        """
+        Makes the cards which can lead to a goal more likely to be drawn.
+        The goal is either the card named 'card_name', or the world state
+        where every condition in 'conditions' is true.
+
+        A card is 'strength' times as likely to be drawn for every step
+        closer to the goal it is, according to the static analysis of the
+        deck. Cards in the draw deck are not affected. 'strength' must be
+        a whole number of at least 1, since it becomes the bias of cards in
+        the SelmaCardTable.
+        """
+
+        if strength.__class__ is not int or strength < 1:
+            raise SelmaException("The strength of a goal must be a whole "
+                                 "number of at least 1, not %r" % (strength,))
+        if card_name is not None and not card_name in self.event_cards:
+            raise SelmaException("There is no card named '%s' to aim for"
+                                 % card_name)
+
+        distances = self.analysis.get_distances(card_name, conditions)
+        biases = self.analysis.get_biases(self.event_cards, distances, strength)
+        for name in biases:
+            self.card_table.set_bias(name, biases[name])
+
+    def clear_goal(self):
+        """Makes every card as likely to be drawn as its number of copies says"""
+        for name in self.event_cards:
+            self.card_table.set_bias(name, 1)
 
-        # Reset the list of all card names
-        self.all_card_names = []
-        for card_name in self.event_cards:
-            for _ in range(0, amount):
-                self.all_card_names.append(card_name)
+    @property
+    def all_card_names(self):
+        """A list with the name of every copy of every card in the deck"""
+        return self.card_table.get_all_names()
 
     def add_character_to_cast(self,
                               name,
@@ -280,16 +483,19 @@ class SelmaStorySimulation:
         self.cast[name] = SelmaCharacter()
         self.cast[name].name = name
         self.cast[name].world = self
-        self.cast[name].attributes = attributes.copy()
-        self.cast[name].inventory = inventory.copy()
+        self.cast[name].attributes = SelmaTokenList(attributes)
+        self.cast[name].inventory = SelmaTokenList(inventory)
 
         # Execute the init "script" to set variables etc.
         for effect in init_effects:
             try:
-                parser.execute_effect(self.cast[name], effect)
+                parser.compile_effect(effect).execute(self.cast[name])
             except Exception as exception:
                 raise parser.SelmaParseException(exception)
 
+        self.cast_index.add_character(self.cast[name])
+        self.eligibility.mark_all_dirty()
+
         # Recreate the character list
         self.all_character_names = list(self.cast.keys())
 
@@ -300,25 +506,10 @@ class SelmaStorySimulation:
         if self.debug_mode:
             print("<Simstep %s>" % self.steps_count)
 
-        # If there is a "start" card, execute it's effects before
-        # the simulation begins, and then remove it
-        start_card_name = "start"
-        if self.steps_count == 0 and start_card_name in self.all_card_names:
-            # Execute the effects of the start card
-            for effect in self.event_cards[start_card_name].effects:
-                try:
-                    parser.execute_effect(self, effect)
-                except Exception as exception:
-                    print("Error in start card")
-                    raise parser.SelmaParseException(exception)
-
-            # Add the start cards "next"s to the draw deck
-            for card_name in self.event_cards[start_card_name].next_cards:
-                self.add_card_to_draw_deck(card_name)
-
-            self.all_card_names.remove(start_card_name)
+        self.run_start_card()
 
         # Take a new card until we have found one that fulfill the condtions
+        failed_cards = set()
         have_found_card = False
         while not have_found_card:
 
@@ -326,10 +517,11 @@ class SelmaStorySimulation:
             while len(self.draw_deck) < self.draw_deck_size:
                 self.draw_deck.append("#")
 
-            # Take a new random card from the draw deck
-            picked_card_string = random_item_from_list(self.draw_deck)
-            if picked_card_string == "#":
-                picked_card_string = random_item_from_list(self.all_card_names)
+            picked_card_string = self.pick_from_draw_deck(failed_cards)
+            if picked_card_string is None:
+                raise SelmaException(
+                    "No card can be drawn at step %s, because no card "
+                    "fullfills its conditions" % self.steps_count)
             picked_card = self.event_cards[picked_card_string]
 
             # Test if the card can be chosen
@@ -337,47 +529,147 @@ class SelmaStorySimulation:
                                                self.attributes,
                                                picked_card.name):
                 have_found_card = True
+            else:
+                failed_cards.add(picked_card_string)
 
             # Discard any card we have tried
             if picked_card.name in self.draw_deck:
                 self.draw_deck.remove(picked_card_string)
 
+        self.execute_card(picked_card)
+
+    def pick_from_draw_deck(self, failed_cards):
+        """
+        Returns the name of a random card to try, which isn't in
+        'failed_cards', or None if no card can be picked.
+
+        A slot of the draw deck is picked as if slots were picked at random
+        until the card in one could be picked, and a wildcard slot was
+        filled with a random card from the whole deck every time. A slot
+        with a card which can be picked is then as likely as all the
+        copies in the deck put together, and a wildcard slot is as likely
+        as the copies which can be picked. A slot with a card which can't
+        be picked counts as a wildcard, and is discarded if it is chosen,
+        like it would have been once it was tried.
+        """
+
+        if not len(self.draw_deck):
+            raise SelmaException("Can't draw a card from an empty draw deck!")
+
+        self.eligibility.refresh()
+        total_weight = self.card_table.deck_total
+        eligible_weight = self.card_table.get_drawable_total(failed_cards)
+
+        named_slots = []
+        wildcard_slots = []
+        for index in range(len(self.draw_deck)):
+            card_name = self.draw_deck[index]
+            if card_name != "#" and not card_name in failed_cards and \
+                    self.eligibility.is_eligible(card_name):
+                named_slots.append(card_name)
+            else:
+                wildcard_slots.append(card_name)
+
+        named_total = len(named_slots) * total_weight
+        target = self.random.random() * (named_total +
+                                          len(wildcard_slots) * eligible_weight)
+        if target < named_total:
+            return named_slots[min(int(target // total_weight),
+                                   len(named_slots) - 1)]
+        if not eligible_weight:
+            return None
+
+        card_name = wildcard_slots[min(int((target - named_total) // eligible_weight),
+                                       len(wildcard_slots) - 1)]
+        if card_name != "#":
+            self.draw_deck.remove(card_name)
+        return self.eligibility.draw(failed_cards)
+
+    def play_card(self, card_name):
+        """
+        Does a step of the simulation where the card named 'card_name' is
+        picked, instead of a random one. Returns False if the card can't
+        be picked, because its conditions aren't met or its roles can't be
+        filled, in which case nothing but the start card has been executed.
+        """
+
+        if self.debug_mode:
+            print("<Simstep %s: %s>" % (self.steps_count, card_name))
+
+        self.run_start_card()
+
+        if not card_name in self.card_table or \
+                not self.eligibility.is_eligible(card_name):
+            return False
+
+        picked_card = self.event_cards[card_name]
+        if not picked_card.fullfill_conditions(self,
+                                               self.attributes,
+                                               picked_card.name):
+            return False
+
+        if card_name in self.draw_deck:
+            self.draw_deck.remove(card_name)
+
+        self.execute_card(picked_card)
+        return True
+
+    def run_start_card(self):
+        """If there is a "start" card, execute it's effects before
+        the simulation begins, and then remove it"""
+
+        start_card_name = "start"
+        if self.steps_count == 0 and start_card_name in self.card_table:
+            # Execute the effects of the start card
+            for effect in self.event_cards[start_card_name].compiled_effects:
+                try:
+                    self.execute_effect(effect)
+                except Exception as exception:
+                    print("Error in start card")
+                    raise parser.SelmaParseException(exception)
+
+            # Add the start cards "next"s to the draw deck
+            for card_name in self.event_cards[start_card_name].next_cards:
+                self.add_card_to_draw_deck(card_name)
+
+            if self.journal is not None:
+                self.journal.record_card_weight(
+                    start_card_name, self.card_table.get_weight(start_card_name))
+            self.card_table.remove(start_card_name)
+
+    def execute_card(self, picked_card):
+        """Executes a card whose roles have been filled, and logs it as an event"""
+
         # Add the next cards to the draw deck
         for next_card_name in picked_card.next_cards:
             self.add_card_to_draw_deck(next_card_name)
 
-        # Save all the requirements of this card in a list
-        # so we can use it to determine which cards caused event
+        # Save what the card required of the variables, so
+        # we can use it to determine which cards caused event
         requirements = []
-        for req in picked_card.conditions:
-            requirements.append(parser.SelmaStatement(self, req))
+        if self.track_causes:
+            get_requirement = self.past_events.get_requirement
+            for req in picked_card.compiled_conditions:
+                requirements.append(get_requirement(self, req))
 
-        for role in picked_card.roles:
-            for line in picked_card.roles[role]:
-                requirements.append(parser.SelmaStatement(self.roles[role], line))
+            for role, conditions in picked_card.compiled_roles:
+                for req in conditions:
+                    requirements.append(get_requirement(self.roles[role], req))
 
-        effect_statements = {}
+        values_modified = {}
 
         # Execute the effects of the card
-        for effect in picked_card.effects:
+        for effect in picked_card.compiled_effects:
             try:
-                statement = parser.SelmaStatement(self, effect)
-                val_before = statement.var_holder[statement.var_name]
-                parser.execute_statement(statement)
-                val_after = statement.var_holder[statement.var_name]
-
-                if statement.var_type == "float":
-                    delta = val_after - val_before
-                elif val_before == val_after:
-                    delta = 0.0
-                else:
-                    delta = 1.0
+                statement, delta = self.apply_effect(effect)
 
-                effect_statements[statement] = delta
+                full_var_name = statement.full_var_name
+                if not full_var_name in values_modified:
+                    values_modified[full_var_name] = delta
 
             except Exception as exception:
                 print("Error while executing effect '%s' on card '%s'"
-                      % (effect, picked_card_string))
+                      % (effect.line, picked_card.name))
                 raise parser.SelmaParseException(exception)
 
         if self.debug_mode:
@@ -386,23 +678,26 @@ class SelmaStorySimulation:
             print("Cast: %s" % list(self.cast.keys()))
             print("Draw deck: %s\n" % self.draw_deck)
 
-        # Log this event
-        event = SelmaEvent(event_name=picked_card.name,
-                           roles=self.roles,
-                           effects=effect_statements,
-                           requirements=requirements,
-                           previous_events=self.past_events,
-                           event_id=len(self.past_events))
-
-        self.past_events.append(event)
+        # Log this event, along with what it required, so that
+        # the events which caused it can be found later
+        roles = {}
+        for role in self.roles:
+            roles[role] = self.roles[role].name
+
+        event_id = self.past_events.append(picked_card.name,
+                                           roles,
+                                           values_modified,
+                                           requirements)
+        if self.journal is not None:
+            self.journal.record_event(event_id)
         self.steps_count += 1
 
     def add_card_to_draw_deck(self, card_name):
         """Adds the card named "card_name" to the deck of possible cards"""
 
-        if card_name == "#" or card_name in self.all_card_names:
+        if card_name == "#" or card_name in self.card_table:
             self.draw_deck.append(card_name)
-            del self.draw_deck[0] # Discard the oldest card in the deck
+            self.draw_deck.remove_oldest() # Discard the oldest card in the deck
         else:
             raise SelmaException(
                 """Cannot add card name '%s to the draw deck /
@@ -411,147 +706,198 @@ class SelmaStorySimulation:
 
     def execute_effect(self, effect):
         """Execute an effect on this scope"""
-        parser.execute_effect(self, effect)
+        statement = parser.SelmaStatement(self, effect)
+        if self.journal is not None:
+            self.journal.record_effect(statement)
+        parser.execute_statement(statement)
+        self.register_change(statement)
+
+    def apply_effect(self, effect):
+        """Executes an effect on this scope, which is a line or a compiled
+        statement, and returns the bound statement and how much it
+        changed the variable"""
+        statement = parser.SelmaStatement(self, effect)
+        if self.journal is not None:
+            self.journal.record_effect(statement)
+        delta = parser.execute_statement_with_delta(statement)
+        self.register_change(statement)
+        return statement, delta
+
+    def register_change(self, statement):
+        """Tells the cast index and the card eligibility tracker
+        what an executed statement may have changed"""
+
+        self.eligibility.variables_changed(get_change_keys(statement))
+
+        if statement.operator in OPERATORS_ON_ALL:
+            if statement.get_var_value() is self.cast:
+                self.cast_index.add_variable_to_all(statement.argument)
+            else:
+                self.cast_index.mark_all_dirty()
+            return
+
+        character = statement.compiled.variable_path.get_character(statement.scope)
+        if character is not None:
+            self.cast_index.mark_dirty(character)
+
+    def update_cast_variable(self,
+                             var_name,
+                             update_operator,
+                             number,
+                             character_names=None):
+        """
+        Changes the number 'var_name' of every character in the cast, or
+        of the characters named in 'character_names', in one batch. The
+        'update_operator' is one of '=', '+=', '-=', '*=' and '/=', which
+        work like they do in effects.
+
+        Every character must have a number named 'var_name', or nothing is
+        changed. The cast index and the cards reading the variable are
+        told about the change once, instead of once for every character.
+        """
+
+        update = NUMBER_UPDATES.get(update_operator)
+        if update is None:
+            raise SelmaException("'%s' can't be used to update numbers"
+                                 % update_operator)
+        if not parser.is_number(number):
+            raise SelmaException("Can't update numbers with '%s'" % (number,))
+        if update is operator.truediv and not number:
+            raise SelmaException("Can't divide '%s' by 0" % var_name)
+
+        if character_names is None:
+            characters = list(self.cast.values())
+        else:
+            characters = [self.cast[name] for name in character_names]
+
+        old_values = []
+        for character in characters:
+            value = character.var.get(var_name)
+            if not parser.is_number(value):
+                raise SelmaException("%s has no number named '%s'"
+                                     % (character.name, var_name))
+            old_values.append(value)
+
+        if self.journal is not None:
+            self.journal.record_cast_variable(var_name, characters, old_values)
+
+        for character, value in zip(characters, old_values):
+            character.var[var_name] = update(value, number)
+
+        self.cast_index.update_variable(var_name, characters, old_values)
+        self.eligibility.variables_changed(("cast:var.%s" % var_name,))
 
     def evaluate_condition(self, condition):
         """Evaluates a condition on this scope, returns True/False"""
         return parser.evaluate_condition(self, condition)
 
+    def snapshot(self):
+        """
+        Returns a snapshot of the state of the simulation, which it can be
+        rolled back to with restore() to try another continuation.
 
-class SelmaException(Exception):
-    """A class for general Exceptions within selma"""
-    pass
+        Every change made by a step or an effect after the first snapshot
+        is kept in an undo journal, so restoring costs as much as the
+        changes made since the snapshot. Cards and characters added
+        after a snapshot are not rolled back.
+        """
+        if self.journal is None:
+            self.journal = SelmaJournal()
+        return SelmaSnapshot(self, self.journal)
+
+    def restore(self, snapshot):
+        """Rolls the simulation back to 'snapshot'. Snapshots taken after
+        it can't be restored anymore, but 'snapshot' itself can be
+        restored any number of times"""
 
+        if not snapshot.is_valid(self.journal):
+            raise SelmaException(
+                "Can't restore a snapshot whose changes have been "
+                "rolled back or forgotten")
 
-class SelmaEvent:
-    """This class contains information about an event which has occured"""
+        self.journal.undo(self, snapshot.position)
 
-    def __init__(self,
-                 event_name,
-                 effects,
-                 requirements,
-                 roles,
-                 previous_events,
-                 event_id=-1):
-
-        self.event_name = event_name
-        self.event_id = event_id
-        self.subject = 0
-        self.object = 0
-        self.causing_events = []
-        self.values_affecting = []
-        self.importance = 0
-
-        # We save a record of who played what role in this event
-        self.roles = {}
-        for role in roles:
-            self.roles[role] = roles[role].name
+        self.steps_count = snapshot.steps_count
+        self.random.setstate(snapshot.random_state)
+        self.draw_deck = snapshot.draw_deck.copy()
+        self.roles = snapshot.roles.copy()
 
-        if self.roles:
-            self.subject = self.roles[list(self.roles.keys())[0]]
-        if len(self.roles) > 1:
-            self.object = self.roles[list(self.roles.keys())[1]]
-
-        # Go through every conditional statement which allowed
-        # this event to be executed and all values it depended on.
-        # Then find any previous events, which also edited that value.
-        # Those events may be considered causing events.
-        causing_events_raw = defaultdict(lambda: 0)
-        for requirement in requirements:
-            if not requirement.full_var_name in self.values_affecting:
-                self.values_affecting.append(requirement.full_var_name)
-
-                # When it comes to lists and strings, OR numbers which
-                # must have a precise value, only the latest edit
-                # of the value is considered to be causing this event
-                if (requirement.argument_type == parser.TYPE_STRING or
-                        requirement.argument_type == parser.TYPE_LIST or
-                        requirement.operator == parser.EQUAL or
-                        requirement.operator == parser.NOT_EQUAL):
-
-                    # Note: we reverse the list here so that newest
-                    # items comes first, because we are looking for
-                    # NEWEST event
-                    for event in reversed(previous_events):
-                        if requirement.full_var_name in event.values_modified:
-                            causing_events_raw[event] = 1
-                            break
-
-                # When it comes to numbers, we treat cards that have to be as
-                # large as possible or
-                else:
-                    for event in previous_events:
-                        if requirement.full_var_name in event.values_modified:
-
-                            delta = event.values_modified[requirement.full_var_name]
-
-                            if (requirement.operator == parser.GREATER_EQUAL or
-                                    requirement.operator == parser.GREATER):
-                                if delta >= 0:
-                                    causing_events_raw[event] += delta
-                            elif (requirement.operator == parser.LESS_EQUAL or
-                                  requirement.operator == parser.LESS):
-                                if delta <= 0:
-                                    causing_events_raw[event] += delta
-
-        # We weight the causation by how big the differnce was.
-        # Example: if one event added 50 to happiness and  another one only 5,
-        # the weight of the first event will be  10x as big
-        change_sum = {}
-        causing_events_weighted = defaultdict(lambda:0)
-        for requirement in requirements:
-            req_name = requirement.full_var_name
-            change_sum[req_name] = 0
-
-            # First we calculate the value of all changes
-            # made to the value we are examining
-            for event in causing_events_raw:
-                strength = causing_events_raw[event]
-                if requirement.full_var_name in event.values_modified:
-                    change_sum[req_name] += abs(strength)
-
-            # Then we divide the strength of each causing event
-            # with the total of all changes to produce a value from 0 to 1.
-            for event in causing_events_raw:
-                strength = causing_events_raw[event]
-                if (requirement.full_var_name in event.values_modified and
-                        change_sum[req_name] and
-                        strength):
-                    weighted_strength = abs(strength) / change_sum[req_name]
-                    weighted_strength /= len(requirements)
-                    causing_events_weighted[event] = weighted_strength
-
-        # Finally we set the causing events to be the weighted version and
-        # sort them by descending size so it becomes easy for users to remove
-        # the least important events
-        self.causing_events += causing_events_weighted.items()
-        self.causing_events.sort(key=operator.itemgetter(1))
-        self.causing_events.reverse()
-
-
-        self.values_modified = {}
-        for effect in effects:
-            if not effect.full_var_name in self.values_modified:
-                self.values_modified[effect.full_var_name] = effects[effect]
+    def forget_snapshots(self):
+        """Stops keeping the undo journal. No snapshot taken
+        so far can be restored after this"""
+        self.journal = None
 
-    def __str__(self):
-        return "EVENT %s: '%s'" % (self.event_id, self.as_sentence())
 
-    def as_sentence(self):
-        """Returns a sentence which describes the event"""
+class SelmaException(Exception):
+    """A class for general Exceptions within selma"""
+    pass
+
 
-        if self.subject and self.object:
-            name = "%s %s %s" % (self.subject, self.event_name, self.object)
-            return name
-        elif self.subject:
-            name = "%s %s" % (self.subject, self.event_name)
-            return name
+class SelmaRandom(random.Random):
+    """
+    A random number generator which belongs to a single simulation, so
+    that a simulation can be replayed from its seed no matter what else
+    is going on in the same process.
 
-        return self.event_name
+    Random numbers used for picking indices are drawn in blocks, which
+    makes each pick cheaper than calling randint().
+    """
 
-def random_item_from_list(list_in):
-    """Returns a random item from any list"""
+    block_size = 256
+
+    def __init__(self, seed=None):
+        """Initializes the generator with 'seed'"""
+        self.block = []
+        super().__init__(seed)
+
+    def seed(self, a=None, version=2):
+        """Seeds the generator, and throws away any numbers drawn in advance"""
+        super().seed(a, version)
+        self.block = []
+
+    def index(self, length):
+        """Returns a random index of a list of 'length' items"""
+        if not self.block:
+            random_float = self.random
+            self.block = [random_float() for _ in range(self.block_size)]
+        return int(self.block.pop() * length)
+
+    def getstate(self):
+        """Returns the state of the generator, including numbers drawn in advance"""
+        return super().getstate(), tuple(self.block)
+
+    def setstate(self, state):
+        """Restores a state returned by getstate()"""
+        generator_state, block = state
+        super().setstate(generator_state)
+        self.block = list(block)
+
+
+def random_items_from_list(list_in, rng=None):
+    """Yields every item of a list once, in random order. Items are picked
+    one at a time, so stopping early doesn't cost anything extra.
+    'rng' is the SelmaRandom to use, the random module is used if it's None"""
+
+    # This is a Fisher-Yates shuffle which only remembers the swaps
+    swapped = {}
+    remaining = len(list_in)
+    while remaining:
+        if rng is None:
+            index = random.randint(0, remaining - 1)
+        else:
+            index = rng.index(remaining)
+        remaining -= 1
+        item_index = swapped.get(index, index)
+        swapped[index] = swapped.get(remaining, remaining)
+        yield list_in[item_index]
+
+def random_item_from_list(list_in, rng=None):
+    """Returns a random item from any list. 'rng' is the
+    SelmaRandom to use, the random module is used if it's None"""
     if not list_in:
         raise SelmaException("Can't grab random item from an empty list!")
-    index = random.randint(0, len(list_in)-1)
+    if rng is None:
+        index = random.randint(0, len(list_in)-1)
+    else:
+        index = rng.index(len(list_in))
     return list_in[index]
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python
+
+"""
+This is a module of 'Selma'
+by Oskar Lundqvist / Abrovinsch (c) 2017
+
+This module works out which cards can lead to which, without running
+the simulation, so that the cards which can lead to a goal can be
+drawn more often
+"""
+
+from collections import defaultdict, deque
+import selma_parser as parser
+from selma_eligibility import OPERATORS_DEFINING_VARIABLES, OPERATORS_ON_ALL, \
+    get_condition_keys
+
+# Cards are only biased by how close they are to a goal up to this many
+# steps away, so that the biased weights don't grow out of bounds
+MAX_BIAS_STEPS = 16
+
+def get_read_keys(card):
+    """Returns the dependency keys of every variable the conditions of
+    'card' read, like SelmaCardEligibility names them"""
+
+    keys = set()
+    for condition in card.compiled_conditions:
+        keys.update(get_condition_keys(condition, False))
+
+    for _, conditions in card.compiled_roles:
+        for condition in conditions:
+            keys.update(get_condition_keys(condition, True))
+    return keys
+
+def get_written_keys(card):
+    """Returns the dependency keys of every variable the effects
+    of 'card' may change, like get_change_keys() names them"""
+
+    keys = set()
+    for effect in card.compiled_effects:
+        if effect.operator in OPERATORS_ON_ALL:
+            keys.add("cast:var.%s" % effect.argument)
+            continue
+
+        key = effect.variable_path.global_key
+        keys.add(key)
+        if effect.operator in OPERATORS_DEFINING_VARIABLES:
+            keys.add("%s.%s" % (key, effect.argument))
+    return keys
+
+class SelmaDeckAnalysis:
+    """
+    A static analysis of the cards in a deck.
+
+    A card can lead to another card if it changes a variable which the
+    other card reads, or if it puts the other card in the draw deck.
+    This makes a graph of the cards, which is kept as which cards read
+    and write each variable, and which cards come next after each card.
+
+    The distance from a card to a goal is how many steps away from the
+    goal it is. The goal card itself is at 0, the cards which write what
+    the goal reads or put the goal card in the draw deck are at 1, and so
+    on. It only says that the goal might be reached that way, since the
+    values of the variables are not known.
+    """
+
+    def __init__(self):
+        """Initializes the analysis of an empty deck"""
+
+        # card name -> the keys it reads, and key -> the cards writing it
+        self.reads = {}
+        self.writers = defaultdict(set)
+
+        # card name -> the cards which put it in the draw deck
+        self.previous_cards = defaultdict(set)
+
+        # goal -> card name -> distance, forgotten when a card is added
+        self.distances = {}
+
+    def add_card(self, card):
+        """Adds 'card' to the analysis"""
+
+        # A card which is replaced may read and write other things now
+        if card.name in self.reads:
+            for card_names in self.writers.values():
+                card_names.discard(card.name)
+            for card_names in self.previous_cards.values():
+                card_names.discard(card.name)
+
+        self.reads[card.name] = get_read_keys(card)
+        for key in get_written_keys(card):
+            self.writers[key].add(card.name)
+        for next_card_name in card.next_cards:
+            if next_card_name != "#":
+                self.previous_cards[next_card_name].add(card.name)
+
+        self.distances = {}
+
+    def get_distances(self, card_name=None, conditions=()):
+        """
+        Returns a dict of the distance from every card which can lead to a
+        goal to the goal. The goal is either the card named 'card_name',
+        which is at distance 0, or the world state where every condition
+        in 'conditions' is true. Cards which can't lead to the goal are
+        left out.
+        """
+
+        if card_name is not None:
+            goal = card_name
+        else:
+            goal = tuple(parser.compile_condition(condition).line
+                         for condition in conditions)
+        if goal in self.distances:
+            return self.distances[goal]
+
+        queue = deque()
+        if card_name is not None:
+            distances = {card_name: 0}
+            goal_reads = self.reads.get(card_name, ())
+        else:
+            distances = {}
+            goal_reads = set()
+            for line in goal:
+                goal_reads.update(
+                    get_condition_keys(parser.compile_condition(line), False))
+
+        # Search backwards from the goal, through the cards which
+        # write what it reads and the cards which come before it
+        visited_keys = set()
+        node_reads, node_name, node_distance = goal_reads, card_name, 0
+        while True:
+            for key in node_reads:
+                if key in visited_keys:
+                    continue
+                visited_keys.add(key)
+                for writer in self.writers.get(key, ()):
+                    if not writer in distances:
+                        distances[writer] = node_distance + 1
+                        queue.append(writer)
+
+            if node_name is not None:
+                for previous_card in self.previous_cards.get(node_name, ()):
+                    if not previous_card in distances:
+                        distances[previous_card] = node_distance + 1
+                        queue.append(previous_card)
+
+            if not queue:
+                break
+            node_name = queue.popleft()
+            node_reads = self.reads.get(node_name, ())
+            node_distance = distances[node_name]
+
+        self.distances[goal] = distances
+        return distances
+
+    def get_biases(self, card_names, distances, strength):
+        """Returns the bias of every card in 'card_names', which is
+        'strength' times as big for every step closer it is to the goal.
+        Cards which can't lead to the goal get a bias of 1"""
+
+        biases = {}
+        for card_name in card_names:
+            distance = distances.get(card_name, MAX_BIAS_STEPS + 1)
+            biases[card_name] = strength ** max(0, MAX_BIAS_STEPS + 1 - distance)
+        return biases
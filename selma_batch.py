@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python
+
+"""
+This is a module of 'Selma'
+by Oskar Lundqvist / Abrovinsch (c) 2017
+
+This module runs many independent simulations of the same
+.selma file at once, spread out over several processes
+"""
+
+import hashlib
+import multiprocessing
+import pickle
+import selma
+
+# The simulation every run in a worker process starts from,
+# and the function which turns a finished run into a result
+worker_state = {}
+
+def get_story(simulation):
+    """Returns every event of a simulation as a sentence.
+    This is the default result of a run"""
+    return [event.as_sentence() for event in simulation.past_events]
+
+def get_run_seed(seed, run_index):
+    """Returns the seed of run number 'run_index' in a batch seeded with 'seed'"""
+    digest = hashlib.sha256(("%s:%s" % (seed, run_index)).encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big")
+
+def load_template(path):
+    """Loads and compiles a .selma file into a simulation which
+    hasn't been run yet, which all runs are copied from"""
+    template = selma.SelmaStorySimulation(debug_mode=False, allow_output=False)
+    template.load_from_file(path)
+    return template
+
+def init_worker(template_data, result_function):
+    """Sets up a worker process with the pickled template simulation"""
+    worker_state["template"] = template_data
+    worker_state["result_function"] = result_function
+
+def run_simulation(run_index, run_seed, steps):
+    """Runs a copy of the template in this worker process and
+    returns the run index, its seed and the result of the run"""
+
+    simulation = pickle.loads(worker_state["template"])
+    simulation.random.seed(run_seed)
+
+    for _ in range(steps):
+        simulation.sim_step()
+
+    return run_index, run_seed, worker_state["result_function"](simulation)
+
+def run_simulation_from_tuple(arguments):
+    """Calls run_simulation with a tuple of arguments"""
+    return run_simulation(*arguments)
+
+def run_batch(path,
+              runs,
+              steps,
+              seed=0,
+              processes=None,
+              result_function=get_story):
+    """
+    Runs 'runs' simulations of 'steps' steps each from the .selma file at
+    'path', using a pool of 'processes' processes (one per CPU by default).
+
+    The file is loaded and compiled once, and every worker gets a copy of
+    it once. Every run gets its own seed derived from 'seed', so a batch
+    gives the same results every time no matter how the runs are spread
+    over the workers.
+
+    A run can be replayed by loading the file into a simulation
+    seeded with its run_seed and doing the same number of steps.
+
+    Yields a (run_index, run_seed, result) tuple as soon as each run is
+    done, where result is what 'result_function' returned for the finished
+    simulation. 'result_function' must be defined at the top level of a
+    module, so that it can be sent to the workers.
+    """
+
+    template_data = pickle.dumps(load_template(path), pickle.HIGHEST_PROTOCOL)
+    tasks = ((run_index, get_run_seed(seed, run_index), steps)
+             for run_index in range(runs))
+
+    pool = multiprocessing.Pool(processes,
+                                initializer=init_worker,
+                                initargs=(template_data, result_function))
+    try:
+        for result in pool.imap_unordered(run_simulation_from_tuple, tasks):
+            yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
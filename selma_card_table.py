@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python
+
+"""
+This is a module of 'Selma'
+by Oskar Lundqvist / Abrovinsch (c) 2017
+
+This module keeps track of how many copies of each card there are
+in the deck, so that a random card can be drawn by its weight
+"""
+
+class SelmaCardTable:
+    """
+    A table of every card in the deck and its weight, which is the
+    number of copies of it there are. Only enabled cards can be drawn.
+
+    Every card also has a bias, a whole number which its weight is
+    multiplied by when it is drawn, so that some cards can be made more
+    likely to be drawn without changing how many copies there are.
+    Keeping it whole keeps the sums in the tree exact.
+
+    The enabled weights are kept in a Fenwick tree, so adding a card,
+    changing its weight and drawing a card all take O(log n) time.
+    """
+
+    def __init__(self):
+        """Initializes an empty table"""
+
+        # card name -> id, and id -> card name
+        self.ids = {}
+        self.names = []
+
+        # id -> number of copies, whether it can be drawn, and its bias
+        self.weights = []
+        self.enabled = []
+        self.biases = []
+
+        # Fenwick tree of the enabled, biased weights, which starts at index 1
+        self.tree = [0]
+        self.total = 0
+
+        # The sum of the biased weights of every card, enabled or not
+        self.deck_total = 0
+
+    def add(self, card_name, amount=1):
+        """Adds a card with 'amount' copies. If the card is
+        already in the table, its number of copies is replaced"""
+
+        card_id = self.ids.get(card_name)
+        if card_id is None:
+            card_id = len(self.names)
+            self.ids[card_name] = card_id
+            self.names.append(card_name)
+            self.weights.append(0)
+            self.enabled.append(False)
+            self.biases.append(1)
+
+            # The new node covers the range of cards below it which its
+            # index has room for, and the card itself has no weight yet
+            index = len(self.tree)
+            self.tree.append(self.get_prefix_sum(index - 1) -
+                             self.get_prefix_sum(index - (index & -index)))
+
+        self.set_weight(card_id, amount)
+
+    def remove(self, card_name):
+        """Removes one copy of a card"""
+        card_id = self.ids.get(card_name)
+        if card_id is None or not self.weights[card_id]:
+            raise ValueError("There is no copy of '%s' in the deck" % card_name)
+        self.set_weight(card_id, self.weights[card_id] - 1)
+
+    def set_weight(self, card_id, weight):
+        """Sets the number of copies of the card with id 'card_id'"""
+        self.deck_total += (weight - self.weights[card_id]) * self.biases[card_id]
+        if self.enabled[card_id]:
+            self.update(card_id,
+                        (weight - self.weights[card_id]) * self.biases[card_id])
+        self.weights[card_id] = weight
+
+    def set_enabled(self, card_name, enabled):
+        """Sets whether a card can be drawn"""
+        card_id = self.ids[card_name]
+        if self.enabled[card_id] != enabled:
+            self.enabled[card_id] = enabled
+            if enabled:
+                self.update(card_id, self.weights[card_id] * self.biases[card_id])
+            else:
+                self.update(card_id, -self.weights[card_id] * self.biases[card_id])
+
+    def set_bias(self, card_name, bias):
+        """Sets the whole number which the weight of a card is
+        multiplied by when it is drawn"""
+        card_id = self.ids[card_name]
+        self.deck_total += self.weights[card_id] * (bias - self.biases[card_id])
+        if self.enabled[card_id]:
+            self.update(card_id,
+                        self.weights[card_id] * (bias - self.biases[card_id]))
+        self.biases[card_id] = bias
+
+    def get_weight(self, card_name):
+        """Returns the number of copies of a card"""
+        card_id = self.ids.get(card_name)
+        if card_id is None:
+            return 0
+        return self.weights[card_id]
+
+    def get_drawable_total(self, excluded=()):
+        """Returns the sum of the biased weights of the enabled
+        cards which aren't in 'excluded'"""
+        total = self.total
+        for card_name in excluded:
+            card_id = self.ids.get(card_name)
+            if card_id is not None and self.enabled[card_id]:
+                total -= self.weights[card_id] * self.biases[card_id]
+        return total
+
+    def update(self, card_id, delta):
+        """Adds 'delta' to the enabled, biased weight of a card"""
+        index = card_id + 1
+        tree = self.tree
+        while index < len(tree):
+            tree[index] += delta
+            index += index & -index
+        self.total += delta
+
+    def get_prefix_sum(self, index):
+        """Returns the sum of the enabled, biased weights of the first 'index' cards"""
+        total = 0
+        tree = self.tree
+        while index:
+            total += tree[index]
+            index -= index & -index
+        return total
+
+    def find(self, target):
+        """Returns the id of the first card where the sum of the enabled,
+        biased weights up to and including it is above 'target'"""
+        tree = self.tree
+        size = len(tree) - 1
+        position = 0
+        step = 1 << (size.bit_length() - 1) if size else 0
+        while step:
+            next_position = position + step
+            if next_position <= size and tree[next_position] <= target:
+                position = next_position
+                target -= tree[position]
+            step >>= 1
+        return position
+
+    def draw(self, random_float, excluded=()):
+        """Returns the name of a random enabled card which isn't in
+        'excluded', picked with 'random_float' from [0, 1) and weighted
+        by the number of copies and the bias. Returns None if there is
+        no such card"""
+
+        # The excluded cards are taken out of the tree while drawing
+        removed = []
+        for card_name in excluded:
+            card_id = self.ids.get(card_name)
+            if card_id is not None and self.enabled[card_id] and self.weights[card_id]:
+                self.update(card_id, -self.weights[card_id] * self.biases[card_id])
+                removed.append(card_id)
+
+        try:
+            if self.total <= 0:
+                return None
+            return self.names[self.find(random_float * self.total)]
+        finally:
+            for card_id in removed:
+                self.update(card_id, self.weights[card_id] * self.biases[card_id])
+
+    def get_all_names(self):
+        """Returns a list with the name of every copy of every card"""
+        all_names = []
+        for card_name, weight in zip(self.names, self.weights):
+            all_names.extend([card_name] * weight)
+        return all_names
+
+    def __contains__(self, card_name):
+        return self.get_weight(card_name) > 0
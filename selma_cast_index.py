@@ -0,0 +1,370 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python
+
+"""
+This is a module of 'Selma'
+by Oskar Lundqvist / Abrovinsch (c) 2017
+
+This module keeps an index of the attributes, inventory and
+variables of every character in the cast, so that the characters
+which can play a role can be found without testing every one of them
+"""
+
+from collections import defaultdict
+import selma_parser as parser
+from selma_cast_store import HAS_NUMPY, SelmaCastStore
+
+# The lists on a character which are indexed
+INDEXED_LISTS = ("attributes", "inventory")
+
+# Argument types which are compared as they are written in the statement
+INDEXED_ARGUMENT_TYPES = (parser.TYPE_STRING, parser.TYPE_FLOAT)
+
+# Values which can be put in the value index
+INDEXED_VALUE_TYPES = (str, float, int, bool)
+
+class SelmaCastIndex:
+    """
+    An index over the cast of a simulation.
+
+    Every character gets a position, which is the order it was added
+    to the cast in. The index maps list items and variable values to the
+    set of positions of the characters which have them.
+
+    Any change to a character must be reported with mark_dirty(), the
+    simulation does this for every effect it executes. Dirty characters
+    are indexed again the next time the index is used.
+
+    If NumPy is installed, the cast is also kept in a SelmaCastStore,
+    which tests comparisons like 'var.happiness > 5' on the whole cast
+    at once. The candidates are then narrowed down further than without
+    it, so a seeded simulation may make different choices depending on
+    whether NumPy is installed.
+    """
+
+    def __init__(self, cast, use_numpy=HAS_NUMPY):
+        """Initializes the index of 'cast', a dict of SelmaCharacters"""
+        self.cast = cast
+        self.use_numpy = use_numpy
+        self.clear()
+
+    def clear(self):
+        """Empties the index"""
+        self.characters = []
+        self.positions = {}
+
+        # item -> positions, for each of the indexed lists
+        self.lists = {}
+        for list_name in INDEXED_LISTS:
+            self.lists[list_name] = defaultdict(set)
+
+        # Positions of characters whose list is not a list at all
+        self.irregular = defaultdict(set)
+
+        # variable name -> positions, and (name, value) -> positions
+        self.variables = defaultdict(set)
+        self.values = defaultdict(set)
+
+        # The keys each position is currently indexed under
+        self.entries = {}
+        self.dirty = set()
+
+        self.store = None
+        if self.use_numpy:
+            self.store = SelmaCastStore()
+
+    def add_character(self, character):
+        """Adds a new character to the index, or replaces the
+        character with the same name"""
+
+        if character.name in self.positions:
+            position = self.positions[character.name]
+            self.characters[position] = character
+        else:
+            position = len(self.characters)
+            self.positions[character.name] = position
+            self.characters.append(character)
+            self.entries[position] = []
+
+        self.dirty.add(position)
+
+    def mark_dirty(self, character):
+        """Report that 'character' has changed"""
+        position = self.positions.get(character.name)
+        if position is not None:
+            self.dirty.add(position)
+
+    def mark_all_dirty(self):
+        """Report that any character may have changed"""
+        self.dirty.update(range(len(self.characters)))
+
+    def add_variable_to_all(self, var_name):
+        """Report that the variable 'var_name' has just been created on
+        every character. The new variable is added to the index as a
+        whole, instead of indexing every character again"""
+
+        # A variable which existed before may have changed any entry
+        if len(self.cast) != len(self.characters) or var_name in self.variables:
+            self.mark_all_dirty()
+            return
+
+        positions = set()
+        values = defaultdict(set)
+        for position, character in enumerate(self.characters):
+            # Dirty characters are indexed with the variable later on
+            if position in self.dirty:
+                continue
+            positions.add(position)
+            entries = self.entries[position]
+            entries.append((self.variables, var_name))
+
+            value = character.var[var_name]
+            if isinstance(value, INDEXED_VALUE_TYPES):
+                values[value].add(position)
+                entries.append((self.values, (var_name, value)))
+
+        if positions:
+            self.variables[var_name] = positions
+        for value in values:
+            self.values[(var_name, value)] = values[value]
+
+        # Every character was given the same value
+        if self.store and self.characters:
+            self.store.add_column(var_name,
+                                  self.characters[0].var[var_name],
+                                  len(self.characters),
+                                  self.dirty)
+
+    def update_variable(self, var_name, characters, old_values):
+        """Report that the variable 'var_name' of 'characters' has changed
+        from 'old_values'. Only the entries of that variable are moved,
+        instead of indexing the characters again"""
+
+        if len(self.cast) != len(self.characters):
+            return
+
+        positions = []
+        values = []
+        for character, old_value in zip(characters, old_values):
+            position = self.positions.get(character.name)
+
+            # Dirty characters are indexed with the new value later on
+            if position is None or position in self.dirty or \
+                    self.characters[position] is not character:
+                continue
+
+            value = character.var[var_name]
+            positions.append(position)
+            values.append(value)
+            if value == old_value:
+                continue
+
+            old_key = (var_name, old_value)
+            old_positions = self.values[old_key]
+            old_positions.discard(position)
+            if not old_positions:
+                del self.values[old_key]
+            self.values[(var_name, value)].add(position)
+
+            entries = self.entries[position]
+            for index, (table, key) in enumerate(entries):
+                if table is self.values and key == old_key:
+                    entries[index] = (table, (var_name, value))
+                    break
+
+        if self.store and positions:
+            if not self.store.set_values(var_name, positions, values):
+                self.dirty.update(positions)
+
+    def rebuild(self):
+        """Indexes the whole cast from scratch"""
+        self.clear()
+        for name in self.cast:
+            self.add_character(self.cast[name])
+        self.refresh()
+
+    def refresh(self):
+        """Index every character which has changed"""
+
+        # The cast was changed without our knowledge
+        if len(self.cast) != len(self.characters):
+            self.rebuild()
+            return
+
+        for position in self.dirty:
+            self.unindex(position)
+            self.index(position)
+        self.dirty.clear()
+
+    def index(self, position):
+        """Adds every list item and variable of a character to the index"""
+
+        character = self.characters[position]
+        entries = self.entries[position]
+
+        for list_name in INDEXED_LISTS:
+            items = getattr(character, list_name, None)
+            if isinstance(items, list):
+                table = self.lists[list_name]
+                for item in items:
+                    try:
+                        table[item].add(position)
+                    except TypeError:
+                        continue
+                    entries.append((table, item))
+            else:
+                self.irregular[list_name].add(position)
+                entries.append((self.irregular, list_name))
+
+        variables = getattr(character, "var", None)
+        if isinstance(variables, dict):
+            for var_name in variables:
+                value = variables[var_name]
+                self.variables[var_name].add(position)
+                entries.append((self.variables, var_name))
+                if isinstance(value, INDEXED_VALUE_TYPES):
+                    self.values[(var_name, value)].add(position)
+                    entries.append((self.values, (var_name, value)))
+
+        if self.store:
+            self.store.set_row(position, character)
+
+    def unindex(self, position):
+        """Removes a character from the index"""
+        entries = self.entries[position]
+        for table, key in entries:
+            positions = table[key]
+            positions.discard(position)
+            if not positions:
+                del table[key]
+        del entries[:]
+
+    def get_candidates(self, conditions):
+        """
+        Narrows down which characters can fullfill 'conditions'.
+
+        Returns a list of characters, in the order of the cast, and the
+        conditions which still have to be tested on each of them.
+        """
+
+        self.refresh()
+
+        if self.store:
+            return self.get_candidates_from_store(conditions)
+
+        candidates = None
+        remaining_conditions = []
+        for condition in conditions:
+            positions, exclude = self.get_positions(condition)
+            if positions is None:
+                remaining_conditions.append(condition)
+            elif exclude:
+                if candidates is None:
+                    candidates = set(range(len(self.characters)))
+                candidates.difference_update(positions)
+            elif candidates is None:
+                candidates = set(positions)
+            else:
+                candidates.intersection_update(positions)
+
+        if candidates is None:
+            return self.characters, remaining_conditions
+
+        characters = self.characters
+        return ([characters[position] for position in sorted(candidates)],
+                remaining_conditions)
+
+    def get_candidates_from_store(self, conditions):
+        """Does the same as get_candidates(), but combines the conditions
+        as masks over the whole cast in the SelmaCastStore"""
+
+        mask = None
+        remaining_conditions = []
+        for condition in conditions:
+            condition_mask = self.store.get_mask(condition)
+
+            if condition_mask is None:
+                positions, exclude = self.get_positions(condition)
+                if positions is None:
+                    remaining_conditions.append(condition)
+                    continue
+                condition_mask = self.store.get_position_mask(positions, exclude)
+
+            if mask is None:
+                mask = condition_mask
+            else:
+                mask &= condition_mask
+
+        if mask is None:
+            return self.characters, remaining_conditions
+
+        return (SelmaCandidates(self.characters, self.store.get_positions(mask)),
+                remaining_conditions)
+
+    def get_positions(self, condition):
+        """
+        Returns the positions which the index has for 'condition', and
+        whether the condition is true for those positions or for every
+        position except them. Returns None if the index can't be used.
+        """
+
+        if not condition.argument_type in INDEXED_ARGUMENT_TYPES:
+            return None, False
+
+        path = condition.variable_path
+        operator = condition.operator
+        if not parser.CONDITIONS.is_built_in(operator):
+            return None, False
+
+        if not path.steps and path.var_name in self.lists:
+            if self.irregular[path.var_name]:
+                return None, False
+
+            table = self.lists[path.var_name]
+            if operator == parser.OPERATOR["list-contains"]:
+                return table.get(condition.argument, ()), False
+            if operator == parser.OPERATOR["list-doesnt-contain"]:
+                return table.get(condition.argument, ()), True
+
+        elif path.steps == ("var",):
+
+            # Every character must have the variable, or testing it
+            # is an error which the index should not hide
+            var_name = path.var_name
+            if len(self.variables.get(var_name, ())) != len(self.characters):
+                return None, False
+
+            value = condition.argument
+            if condition.number is not None:
+                value = condition.number
+
+            if operator == parser.EQUAL:
+                return self.values.get((var_name, value), ()), False
+            if operator == parser.NOT_EQUAL:
+                return self.values.get((var_name, value), ()), True
+
+        return None, False
+
+
+class SelmaCandidates:
+    """
+    The characters at some positions in the cast index. It works like
+    a list of characters, but characters are only looked up when they
+    are asked for, so a role can be cast without building a list of
+    every candidate.
+    """
+
+    def __init__(self, characters, positions):
+        self.characters = characters
+        self.positions = positions
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __getitem__(self, index):
+        return self.characters[self.positions[index]]
+
+    def __iter__(self):
+        characters = self.characters
+        for position in self.positions:
+            yield characters[position]
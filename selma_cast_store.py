@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python
+
+"""
+This is a module of 'Selma'
+by Oskar Lundqvist / Abrovinsch (c) 2017
+
+This module stores the numeric variables, attributes and inventory of
+the cast as NumPy arrays, so that role conditions can be tested on
+every character at once. NumPy is optional, without it the cast
+index tests the conditions one character at a time instead
+"""
+
+import selma_parser as parser
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+HAS_NUMPY = numpy is not None
+
+# The lists on a character which are stored as membership matrices
+STORED_LISTS = ("attributes", "inventory")
+
+# The NumPy function used for each comparison operator
+COMPARISONS = {
+    parser.GREATER: "greater",
+    parser.GREATER_EQUAL: "greater_equal",
+    parser.LESS: "less",
+    parser.LESS_EQUAL: "less_equal",
+    parser.EQUAL: "equal",
+    parser.NOT_EQUAL: "not_equal",
+}
+
+# How many rows and tokens are allocated at first
+INITIAL_CAPACITY = 16
+
+class SelmaCastStore:
+    """
+    The cast stored as columns instead of as objects.
+
+    Every character has a row, at the same position as in the cast
+    index. Every numeric variable in 'var' is a column of floats, where
+    NaN means that the character doesn't have a number there. Every
+    item in the attributes and inventory lists is interned as a token,
+    and each list is a boolean matrix of which rows have which tokens,
+    stored column by column so that each token is a contiguous array.
+
+    get_mask() turns a condition into a boolean array with a value
+    for each row, or returns None if the condition can't be tested
+    that way, in which case it must be tested on each character.
+    """
+
+    def __init__(self):
+        """Initializes an empty store. NumPy must be available"""
+        self.size = 0
+        self.capacity = INITIAL_CAPACITY
+
+        # var name -> column of values
+        self.columns = {}
+
+        # list name -> token -> column of its membership matrix
+        self.tokens = {}
+        self.memberships = {}
+
+        # list name -> rows where the list can't be stored as tokens
+        self.irregular = {}
+
+        for list_name in STORED_LISTS:
+            self.tokens[list_name] = {}
+            self.memberships[list_name] = numpy.zeros(
+                (self.capacity, INITIAL_CAPACITY), dtype=bool, order="F")
+            self.irregular[list_name] = set()
+
+    def grow_rows(self, size):
+        """Makes sure there is room for 'size' rows"""
+        if size <= self.capacity:
+            return
+
+        capacity = self.capacity
+        while capacity < size:
+            capacity *= 2
+
+        for var_name in self.columns:
+            column = numpy.full(capacity, numpy.nan)
+            column[:self.capacity] = self.columns[var_name]
+            self.columns[var_name] = column
+
+        for list_name in STORED_LISTS:
+            matrix = self.memberships[list_name]
+            grown = numpy.zeros((capacity, matrix.shape[1]), dtype=bool, order="F")
+            grown[:self.capacity] = matrix
+            self.memberships[list_name] = grown
+
+        self.capacity = capacity
+
+    def get_token(self, list_name, item):
+        """Returns the column of 'item' in the matrix of 'list_name'"""
+        tokens = self.tokens[list_name]
+        token = tokens.get(item)
+        if token is None:
+            token = len(tokens)
+            tokens[item] = token
+
+            matrix = self.memberships[list_name]
+            if token >= matrix.shape[1]:
+                grown = numpy.zeros((self.capacity, matrix.shape[1] * 2),
+                                    dtype=bool, order="F")
+                grown[:, :matrix.shape[1]] = matrix
+                self.memberships[list_name] = grown
+        return token
+
+    def set_row(self, position, character):
+        """Stores the variables and lists of 'character' in row 'position'"""
+
+        self.grow_rows(position + 1)
+        self.size = max(self.size, position + 1)
+
+        for list_name in STORED_LISTS:
+            self.memberships[list_name][position] = False
+            self.irregular[list_name].discard(position)
+
+            items = getattr(character, list_name, None)
+            if not isinstance(items, list):
+                self.irregular[list_name].add(position)
+                continue
+            for item in items:
+                try:
+                    token = self.get_token(list_name, item)
+                except TypeError:
+                    self.irregular[list_name].add(position)
+                    break
+                self.memberships[list_name][position, token] = True
+
+        for var_name in self.columns:
+            self.columns[var_name][position] = numpy.nan
+
+        variables = getattr(character, "var", None)
+        if isinstance(variables, dict):
+            for var_name in variables:
+                value = variables[var_name]
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                if not var_name in self.columns:
+                    self.columns[var_name] = numpy.full(self.capacity, numpy.nan)
+                self.columns[var_name][position] = value
+
+    def add_column(self, var_name, value, size, skipped_rows=()):
+        """Adds the column of a variable which has just been created with
+        'value' on the first 'size' characters, except for the rows in
+        'skipped_rows'"""
+
+        # Only numbers are stored, like in set_row()
+        if value.__class__ not in (int, float) or not size:
+            return
+
+        self.grow_rows(size)
+        column = numpy.full(self.capacity, numpy.nan)
+        column[:size] = value
+        self.columns[var_name] = column
+
+        for position in skipped_rows:
+            column[position] = numpy.nan
+
+    def set_values(self, var_name, positions, values):
+        """Sets the numbers of a variable in the rows 'positions' at once.
+        Returns False if the variable has no column"""
+        column = self.columns.get(var_name)
+        if column is None:
+            return False
+        column[numpy.fromiter(positions, dtype=numpy.intp, count=len(positions))] = \
+            numpy.fromiter(values, dtype=float, count=len(values))
+        return True
+
+    def get_position_mask(self, positions, exclude=False):
+        """Returns an array which is True for the rows in 'positions',
+        or for every other row if 'exclude' is True"""
+        mask = numpy.zeros(self.size, dtype=bool)
+        if positions:
+            mask[numpy.fromiter(positions, dtype=numpy.intp, count=len(positions))] = True
+        if exclude:
+            mask = ~mask
+        return mask
+
+    def get_positions(self, mask):
+        """Returns the rows where 'mask' is True, in order"""
+        return numpy.flatnonzero(mask)
+
+    def get_mask(self, condition):
+        """Returns an array of which rows fullfill 'condition',
+        or None if it can't be tested on every row at once"""
+
+        path = condition.variable_path
+        operator = condition.operator
+        if not parser.CONDITIONS.is_built_in(operator):
+            return None
+
+        if not path.steps and path.var_name in self.memberships:
+            if condition.argument_type != parser.TYPE_STRING:
+                return None
+            if self.irregular[path.var_name]:
+                return None
+
+            token = self.tokens[path.var_name].get(condition.argument)
+            if token is None:
+                mask = numpy.zeros(self.size, dtype=bool)
+            else:
+                mask = self.memberships[path.var_name][:self.size, token].copy()
+
+            if operator == parser.OPERATOR["list-contains"]:
+                return mask
+            if operator == parser.OPERATOR["list-doesnt-contain"]:
+                return ~mask
+
+        elif path.steps == ("var",):
+            if condition.number is None or not operator in COMPARISONS:
+                return None
+
+            # Every character must have a number, or testing it is
+            # an error which shouldn't be hidden
+            column = self.columns.get(path.var_name)
+            if column is None:
+                return None
+            column = column[:self.size]
+            if numpy.isnan(column).any():
+                return None
+
+            return getattr(numpy, COMPARISONS[operator])(column, condition.number)
+
+        return None
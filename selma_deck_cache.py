@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python
+
+"""
+This is a module of 'Selma'
+by Oskar Lundqvist / Abrovinsch (c) 2017
+
+This module stores a simulation which has just loaded a .selma file
+in a .selmac file in the cache directory of the user, so that the next
+time the file is loaded the compiled cards and the initial cast can be
+read back directly
+"""
+
+import hashlib
+import hmac
+import io
+import os
+import pickle
+
+# Is increased whenever the contents of a cache file change,
+# so that older cache files are not used
+CACHE_FORMAT_VERSION = 10
+
+CACHE_EXTENSION = ".selmac"
+
+# The file in the cache directory holding the key cache files are signed
+# with, and how many random bytes it has
+KEY_NAME = "key"
+KEY_SIZE = 32
+
+# Cache files start with the HMAC-SHA256 of the rest of the file
+DIGEST_SIZE = hashlib.sha256().digest_size
+
+# Attributes of a simulation which loading a file sets up. Nothing else
+# is cached, so that what the caller has set is kept on a cached load
+LOADED_STATE = ("event_cards", "card_table", "analysis", "eligibility",
+                "cast", "cast_index", "all_character_names", "var")
+
+# Stands in for the simulation itself in a cache file
+SIMULATION_ID = "simulation"
+
+def get_cache_directory():
+    """Returns the directory of the cache files of this user, which is
+    $SELMA_CACHE_DIR, or else 'selma' in $XDG_CACHE_HOME or ~/.cache"""
+    directory = os.environ.get("SELMA_CACHE_DIR")
+    if directory:
+        return directory
+    cache_home = (os.environ.get("XDG_CACHE_HOME") or
+                  os.path.join(os.path.expanduser("~"), ".cache"))
+    return os.path.join(cache_home, "selma")
+
+def get_cache_path(path):
+    """Returns the path of the cache file of the .selma file at 'path',
+    which is named after the hash of its absolute path"""
+    path_hash = hashlib.sha256(os.path.abspath(path).encode("utf-8"))
+    return os.path.join(get_cache_directory(),
+                        path_hash.hexdigest() + CACHE_EXTENSION)
+
+def get_key():
+    """
+    Returns the secret key which cache files are signed with, which is
+    created in the cache directory the first time it is needed, where only
+    the user can read it. Returns None if there is no usable key.
+    """
+
+    directory = get_cache_directory()
+    key_path = os.path.join(directory, KEY_NAME)
+    try:
+        with open(key_path, "rb") as key_file:
+            key = key_file.read()
+        return key if len(key) == KEY_SIZE else None
+    except FileNotFoundError:
+        pass
+
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    try:
+        key_descriptor = os.open(key_path,
+                                 os.O_WRONLY | os.O_CREAT | os.O_EXCL,
+                                 0o600)
+    except FileExistsError:
+        # Another process created it first, and may not have written it yet
+        return None
+
+    key = os.urandom(KEY_SIZE)
+    with os.fdopen(key_descriptor, "wb") as key_file:
+        key_file.write(key)
+    return key
+
+def get_digest(key, contents):
+    """Returns the signature of the contents of a cache file"""
+    return hmac.new(key, contents, hashlib.sha256).digest()
+
+def get_file_hash(path):
+    """Returns the sha256 hash of the contents of a file"""
+    file_hash = hashlib.sha256()
+    with open(path, "rb") as source_file:
+        for block in iter(lambda: source_file.read(1 << 20), b""):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+def get_source_info(path, mtime, size):
+    """Returns what is needed to tell if the file at 'path' has changed
+    since it had 'mtime' and 'size', as a tuple of (path, mtime, size, hash).
+    Returns None if it has already changed"""
+    file_hash = get_file_hash(path)
+    stat = os.stat(path)
+    if stat.st_mtime_ns != mtime or stat.st_size != size:
+        return None
+    return path, mtime, size, file_hash
+
+def is_source_unchanged(source_info):
+    """Returns True if a file still looks like 'source_info' says.
+    The contents are only hashed if the mtime or size differ"""
+    path, mtime, size, file_hash = source_info
+    try:
+        stat = os.stat(path)
+        if stat.st_size != size:
+            return False
+        if stat.st_mtime_ns == mtime:
+            return True
+        return get_file_hash(path) == file_hash
+    except OSError:
+        return False
+
+def can_use_cache(simulation):
+    """Returns True if nothing has been loaded into or happened in
+    'simulation', which is the only time a cache can be used"""
+    return (not simulation.event_cards and
+            not simulation.cast and
+            not simulation.var and
+            not simulation.draw_deck and
+            not simulation.steps_count)
+
+
+class SelmaCachePickler(pickle.Pickler):
+    """Pickles the state of a simulation, with every reference
+    to the simulation itself replaced by SIMULATION_ID"""
+
+    def __init__(self, cache_file, simulation):
+        super().__init__(cache_file, pickle.HIGHEST_PROTOCOL)
+        self.simulation = simulation
+
+    def persistent_id(self, obj):
+        if obj is self.simulation:
+            return SIMULATION_ID
+        return None
+
+
+class SelmaCacheUnpickler(pickle.Unpickler):
+    """Unpickles the state of a simulation, pointing every
+    reference to the simulation at 'simulation'"""
+
+    def __init__(self, cache_file, simulation):
+        super().__init__(cache_file)
+        self.simulation = simulation
+
+    def persistent_load(self, pid):
+        if pid == SIMULATION_ID:
+            return self.simulation
+        raise pickle.UnpicklingError("Unknown persistent id '%s'" % pid)
+
+
+def save_cache(simulation, path, files_read):
+    """
+    Stores the state of 'simulation', which has just loaded the .selma
+    file at 'path', in its cache file. 'files_read' lists the
+    (path, mtime, size) of every file which was read, as they were when
+    it was read. Returns False if the cache file couldn't be written,
+    or if any of the files have changed since they were read.
+    """
+
+    sources = []
+    try:
+        for file_path, mtime, size in files_read:
+            sources.append(get_source_info(file_path, mtime, size))
+    except OSError:
+        return False
+    if None in sources:
+        return False
+
+    state = {}
+    for name in LOADED_STATE:
+        state[name] = simulation.__dict__[name]
+
+    contents = io.BytesIO()
+    pickle.dump((CACHE_FORMAT_VERSION, sources),
+                contents,
+                pickle.HIGHEST_PROTOCOL)
+    SelmaCachePickler(contents, simulation).dump(state)
+    contents = contents.getvalue()
+
+    try:
+        key = get_key()
+    except OSError:
+        return False
+    if key is None:
+        return False
+
+    cache_path = get_cache_path(path)
+    temporary_path = "%s.%d.tmp" % (cache_path, os.getpid())
+    try:
+        with open(temporary_path, "wb") as cache_file:
+            cache_file.write(get_digest(key, contents))
+            cache_file.write(contents)
+
+        # Replacing the file makes sure no other process reads half of it
+        os.replace(temporary_path, cache_path)
+    except OSError:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        return False
+    return True
+
+def load_cache(simulation, path):
+    """
+    Loads the cached state of the .selma file at 'path' into 'simulation'.
+    Returns False if there is no cache file, or if it is outdated or broken.
+
+    Cache files are pickles, which can run any code when they are loaded,
+    so a cache file is only loaded if it is signed with the key of the
+    user, which means that it was written by this module.
+    """
+
+    try:
+        key = get_key()
+        if key is None:
+            return False
+        with open(get_cache_path(path), "rb") as cache_file:
+            digest = cache_file.read(DIGEST_SIZE)
+            contents = cache_file.read()
+    except OSError:
+        return False
+    if not hmac.compare_digest(digest, get_digest(key, contents)):
+        return False
+
+    try:
+        cache_file = io.BytesIO(contents)
+        version, sources = pickle.load(cache_file)
+        if version != CACHE_FORMAT_VERSION:
+            return False
+        for source_info in sources:
+            if not is_source_unchanged(source_info):
+                return False
+        state = SelmaCacheUnpickler(cache_file, simulation).load()
+    except Exception:
+        # A missing or broken cache file is simply written again
+        return False
+
+    simulation.__dict__.update(state)
+    return True
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python
+
+"""
+This is a module of 'Selma'
+by Oskar Lundqvist / Abrovinsch (c) 2017
+
+This module holds the draw deck, the small set of cards which
+the next event of a simulation is most likely picked from
+"""
+
+from collections import Counter, deque
+
+# Index of the slot of an entry in SelmaDrawDeck.slots,
+# which is REMOVED once the entry has left the deck
+NAME = 0
+SLOT = 1
+REMOVED = -1
+
+class SelmaDrawDeck:
+    """
+    A draw deck works like a list of card names, where '#' is a wildcard
+    slot, but where every operation used by the simulation is O(1):
+
+    - appending a card,
+    - removing the oldest card,
+    - removing the oldest copy of a card with a given name,
+    - picking a card at random by index,
+    - testing if there is a copy of a card.
+
+    The cards are kept in 'slots' in no particular order, so any card
+    can be removed by moving the last card into its place. The order in
+    which the cards were added is kept in separate queues.
+    """
+
+    def __init__(self):
+        """Initializes an empty draw deck"""
+
+        # Every card in the deck as a [name, slot] entry
+        self.slots = []
+
+        # Entries in the order they were added, for the whole deck and
+        # for each card name. Entries which have been removed are
+        # skipped and thrown away when they reach the front
+        self.order = deque()
+        self.order_by_name = {}
+
+        self.counts = Counter()
+
+    def append(self, card_name):
+        """Adds a card to the deck"""
+        entry = [card_name, len(self.slots)]
+        self.slots.append(entry)
+        self.order.append(entry)
+        self.order_by_name.setdefault(card_name, deque()).append(entry)
+        self.counts[card_name] += 1
+
+        # Don't let removed entries pile up in the middle of the queue
+        if len(self.order) > 2 * len(self.slots) + 16:
+            self.order = deque(entry for entry in self.order
+                               if entry[SLOT] != REMOVED)
+
+    def remove(self, card_name):
+        """Removes the oldest copy of a card, like list.remove()"""
+        if not self.counts[card_name]:
+            raise ValueError("'%s' is not in the draw deck" % card_name)
+
+        # Older copies of the same card have always been removed first
+        entries = self.order_by_name[card_name]
+        while entries[0][SLOT] == REMOVED:
+            entries.popleft()
+        self.remove_entry(entries.popleft())
+
+    def remove_oldest(self):
+        """Removes the card which was added first, like del deck[0]"""
+        while self.order[0][SLOT] == REMOVED:
+            self.order.popleft()
+        entry = self.order.popleft()
+
+        # It is also the oldest copy of its own card
+        entries = self.order_by_name[entry[NAME]]
+        while entries[0] is not entry:
+            entries.popleft()
+        entries.popleft()
+        self.remove_entry(entry)
+
+    def remove_entry(self, entry):
+        """Takes an entry out of its slot by moving the last entry there"""
+        last_entry = self.slots.pop()
+        if last_entry is not entry:
+            self.slots[entry[SLOT]] = last_entry
+            last_entry[SLOT] = entry[SLOT]
+        entry[SLOT] = REMOVED
+
+        card_name = entry[NAME]
+        self.counts[card_name] -= 1
+        if not self.counts[card_name]:
+            del self.counts[card_name]
+            del self.order_by_name[card_name]
+
+    def copy(self):
+        """Returns a copy of the deck, with the cards in the same slots"""
+        deck = SelmaDrawDeck()
+        deck.slots = [[card_name, slot] for card_name, slot in self.slots]
+        for entry in self.order:
+            if entry[SLOT] != REMOVED:
+                copied_entry = deck.slots[entry[SLOT]]
+                deck.order.append(copied_entry)
+                deck.order_by_name.setdefault(copied_entry[NAME],
+                                              deque()).append(copied_entry)
+        deck.counts = self.counts.copy()
+        return deck
+
+    def __len__(self):
+        return len(self.slots)
+
+    def __getitem__(self, index):
+        """Returns the name of the card in slot 'index'"""
+        return self.slots[index][NAME]
+
+    def __contains__(self, card_name):
+        return card_name in self.counts
+
+    def __iter__(self):
+        """Yields the name of every card, in the order they were added"""
+        for entry in self.order:
+            if entry[SLOT] != REMOVED:
+                yield entry[NAME]
+
+    def __str__(self):
+        return str(list(self))
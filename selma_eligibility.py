@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python
+
+"""
+This is a module of 'Selma'
+by Oskar Lundqvist / Abrovinsch (c) 2017
+
+This module keeps track of which cards could be drawn, so that the
+simulation only tests cards again when something they depend on changes
+"""
+
+from collections import defaultdict
+import selma_parser as parser
+
+# Operators which create a variable named by their argument
+OPERATORS_DEFINING_VARIABLES = (parser.OPERATOR['define-numeric-variable'],
+                                parser.OPERATOR['define-string-variable'],
+                                parser.OPERATOR['define-list-variable'])
+
+# Operators which create a variable on every member of the cast
+OPERATORS_ON_ALL = (parser.OPERATOR['define-number-on-all'],
+                    parser.OPERATOR['define-string-on-all'],
+                    parser.OPERATOR['define-list-on-all'])
+
+def get_change_keys(statement):
+    """Returns the dependency keys of the variables that
+    an executed effect statement may have changed"""
+
+    if statement.operator in OPERATORS_ON_ALL:
+        return ("cast:var.%s" % statement.argument,)
+
+    key = statement.compiled.variable_path.get_dependency_key(statement.scope)
+    if statement.operator in OPERATORS_DEFINING_VARIABLES:
+        return (key, "%s.%s" % (key, statement.argument))
+    return (key,)
+
+def get_condition_keys(condition, on_character):
+    """Returns the dependency keys of the variables which 'condition'
+    reads, when it is tested on a character or else on the simulation"""
+
+    paths = [condition.variable_path]
+    if condition.argument_path:
+        paths.append(condition.argument_path)
+    if on_character:
+        return [path.character_key for path in paths]
+    return [path.global_key for path in paths]
+
+class SelmaCardEligibility:
+    """
+    Keeps track of which cards in a simulation could be drawn.
+
+    A card is eligible if all of its conditions are true and every one of
+    its roles could be played by some character. Whether all roles can be
+    filled at the same time, and conditions on the roles themselves, are
+    only known once the card is drawn, so an eligible card may still fail.
+
+    Every card remembers which variables its conditions read. When an
+    effect changes a variable, only the cards reading it are tested again.
+    """
+
+    def __init__(self, simulation):
+        """Initializes the tracker of 'simulation'"""
+        self.simulation = simulation
+
+        # card name -> whether it is eligible
+        self.eligible = {}
+
+        # card name -> the conditions on the card which can be tested
+        # without knowing who plays the roles
+        self.static_conditions = {}
+
+        # dependency key -> names of the cards reading it
+        self.readers = defaultdict(set)
+        self.dirty = set()
+
+    def add_card(self, card):
+        """Starts tracking 'card'"""
+
+        static_conditions = []
+        for condition in card.compiled_conditions:
+            if condition.variable_path.role_name:
+                continue
+            if condition.argument_path and condition.argument_path.role_name:
+                continue
+            static_conditions.append(condition)
+            for key in get_condition_keys(condition, False):
+                self.add_reader(card.name, key)
+
+        for _, conditions in card.compiled_roles:
+            for condition in conditions:
+                for key in get_condition_keys(condition, True):
+                    self.add_reader(card.name, key)
+
+        self.static_conditions[card.name] = tuple(static_conditions)
+        self.dirty.add(card.name)
+
+    def add_reader(self, card_name, key):
+        """Remembers that the card named 'card_name' reads 'key'"""
+        self.readers[key].add(card_name)
+
+    def variables_changed(self, keys):
+        """Call when the variables with the dependency keys 'keys' have changed"""
+        for key in keys:
+            if key in self.readers:
+                self.dirty.update(self.readers[key])
+
+    def mark_all_dirty(self):
+        """Call when anything may have changed"""
+        self.dirty.update(self.static_conditions)
+
+    def refresh(self):
+        """Tests every card which may have changed"""
+
+        for card_name in self.dirty:
+            eligible = self.test_card(card_name)
+            if self.eligible.get(card_name) != eligible:
+                self.eligible[card_name] = eligible
+                self.simulation.card_table.set_enabled(card_name, eligible)
+        self.dirty.clear()
+
+    def test_card(self, card_name):
+        """Returns False if 'card_name' certainly can't be drawn"""
+
+        simulation = self.simulation
+        card = simulation.event_cards[card_name]
+
+        # Any errors are left to be reported when the card is drawn
+        try:
+            for condition in self.static_conditions[card_name]:
+                if not condition.evaluate(simulation):
+                    return False
+
+            for _, conditions in card.compiled_roles:
+                candidates, conditions_to_test = \
+                    simulation.cast_index.get_candidates(conditions)
+                for candidate in candidates:
+                    if all(condition.evaluate(candidate)
+                           for condition in conditions_to_test):
+                        break
+                else:
+                    return False
+
+        except Exception:
+            return True
+
+        return True
+
+    def is_eligible(self, card_name):
+        """Returns whether the card named 'card_name' could be drawn"""
+        self.refresh()
+        return self.eligible.get(card_name, False)
+
+    def draw(self, excluded=()):
+        """Returns the name of a random eligible card, which is not
+        in 'excluded', or None if there is no such card. Every card is
+        weighted by the number of copies of it there are in the deck"""
+
+        self.refresh()
+        return self.simulation.card_table.draw(self.simulation.random.random(),
+                                               excluded)
@@ -0,0 +1,549 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python
+
+"""
+This is a module of 'Selma'
+by Oskar Lundqvist / Abrovinsch (c) 2017
+
+This module is responsible for storing the events which have
+occured in a simulation, and for finding out which events caused them
+"""
+
+from array import array
+import math
+import operator
+import selma_parser as parser
+
+# Array type codes used for ids/offsets and for numeric values
+ID_TYPE = 'l'
+VALUE_TYPE = 'd'
+
+NAN = float("nan")
+
+class SelmaNameTable:
+    """Gives every name a small integer id, so that a name
+    only has to be stored once"""
+
+    def __init__(self):
+        self.names = []
+        self.ids = {}
+
+    def get_id(self, name):
+        """Returns the id of 'name', which is added if it is new"""
+        name_id = self.ids.get(name)
+        if name_id is None:
+            name_id = len(self.names)
+            self.ids[name] = name_id
+            self.names.append(name)
+        return name_id
+
+    def find_id(self, name):
+        """Returns the id of 'name', or None if it has no id"""
+        return self.ids.get(name)
+
+    def __len__(self):
+        return len(self.names)
+
+
+class SelmaEventLog:
+    """
+    An append-only log of the events of a simulation.
+
+    The events are stored in columns of arrays rather than as objects.
+    Card, role, character and variable names are stored as ids. Lists
+    belonging to each event, like the values it modified or the events
+    which caused it, are stored in one shared array each, where the
+    entries of event n are found between offsets[n] and offsets[n + 1].
+
+    Only the requirements of an event are stored when it is added. Which
+    events caused it is found the first time it is asked for, together
+    with the causes of every event before it that aren't known yet, so
+    a simulation which never asks doesn't pay for it.
+
+    The log works like a list of SelmaEvent objects, which are
+    created when they are asked for.
+    """
+
+    def __init__(self):
+        """Initializes an empty log"""
+        self.card_names = SelmaNameTable()
+        self.role_names = SelmaNameTable()
+        self.character_names = SelmaNameTable()
+        self.var_names = SelmaNameTable()
+
+        self.cards = array(ID_TYPE)
+        self.importance = array(VALUE_TYPE)
+
+        self.role_offsets = array(ID_TYPE, [0])
+        self.roles = array(ID_TYPE)
+        self.role_characters = array(ID_TYPE)
+
+        self.modified_offsets = array(ID_TYPE, [0])
+        self.modified_vars = array(ID_TYPE)
+        self.modified_deltas = array(VALUE_TYPE)
+
+        # The requirements of each event, where the operator and the
+        # argument type of a requirement are stored as one id
+        self.requirement_kinds = SelmaNameTable()
+        self.requirement_offsets = array(ID_TYPE, [0])
+        self.requirement_vars = array(ID_TYPE)
+        self.requirement_kind_ids = array(ID_TYPE)
+
+        # The values affecting and the causes of an event are only found
+        # when they are asked for. They are known for the events before
+        # 'causes_found', which are the events in the modification index
+        self.causes_found = 0
+        self.modification_index = SelmaModificationIndex()
+
+        self.affecting_offsets = array(ID_TYPE, [0])
+        self.affecting_vars = array(ID_TYPE)
+
+        self.cause_offsets = array(ID_TYPE, [0])
+        self.cause_events = array(ID_TYPE)
+        self.cause_weights = array(VALUE_TYPE)
+
+        # What each modification of the events in the index replaced
+        # there, next to it in 'modified_vars', so that it can be undone.
+        # -1 and NaN mean that nothing was replaced
+        self.replaced_writers = array(ID_TYPE)
+        self.replaced_totals = array(VALUE_TYPE)
+
+    def append(self,
+               event_name,
+               roles,
+               values_modified,
+               requirements=()):
+        """
+        Adds an event to the log and returns its id.
+
+        'roles' maps role names to character names, 'values_modified' maps
+        variable names to how much they changed, and 'requirements' are the
+        records returned by get_requirement() for the conditions the event
+        depended on. Which events caused it is found from the requirements
+        once it is asked for.
+        """
+
+        event_id = len(self.cards)
+        self.cards.append(self.card_names.get_id(event_name))
+        self.importance.append(0.0)
+
+        for role in roles:
+            self.roles.append(self.role_names.get_id(role))
+            self.role_characters.append(self.character_names.get_id(roles[role]))
+        self.role_offsets.append(len(self.roles))
+
+        for var_name in values_modified:
+            self.modified_vars.append(self.var_names.get_id(var_name))
+            self.modified_deltas.append(values_modified[var_name])
+        self.modified_offsets.append(len(self.modified_vars))
+
+        for var_id, requirement_operator, argument_type in requirements:
+            self.requirement_vars.append(var_id)
+            self.requirement_kind_ids.append(self.requirement_kinds.get_id(
+                (requirement_operator, argument_type)))
+        self.requirement_offsets.append(len(self.requirement_vars))
+
+        return event_id
+
+    def get_requirement(self, scope, condition):
+        """Returns the (var id, operator, argument type) record of a
+        condition which was true on 'scope' when an event happened"""
+        full_var_name, operator, argument_type = condition.get_requirement(scope)
+        return self.var_names.get_id(full_var_name), operator, argument_type
+
+    def get_requirements(self, event_id):
+        """Returns the requirement records of an event"""
+        kinds = self.requirement_kinds.names
+        requirements = []
+        for index in range(self.requirement_offsets[event_id],
+                           self.requirement_offsets[event_id + 1]):
+            requirements.append((self.requirement_vars[index],) +
+                                kinds[self.requirement_kind_ids[index]])
+        return requirements
+
+    def find_causes(self, length=None):
+        """
+        Finds the values affecting and the causes of the first 'length'
+        events, or of every event, unless they are known already.
+
+        The events are added to the modification index one at a time,
+        so the causes of each event are found among the events before
+        it, just like if they had been found when it happened.
+        """
+
+        if length is None:
+            length = len(self)
+
+        index = self.modification_index
+        for event_id in range(self.causes_found, length):
+            values_affecting, causing_events = \
+                index.get_causing_events(self.get_requirements(event_id))
+
+            self.affecting_vars.extend(values_affecting)
+            self.affecting_offsets.append(len(self.affecting_vars))
+
+            for cause_id, weight in causing_events:
+                self.cause_events.append(cause_id)
+                self.cause_weights.append(weight)
+            self.cause_offsets.append(len(self.cause_events))
+
+            for position in range(self.modified_offsets[event_id],
+                                  self.modified_offsets[event_id + 1]):
+                last_writer, total = index.add_modification(
+                    event_id,
+                    self.modified_vars[position],
+                    self.modified_deltas[position])
+                self.replaced_writers.append(
+                    -1 if last_writer is None else last_writer)
+                self.replaced_totals.append(
+                    NAN if total is None else total)
+
+            self.causes_found = event_id + 1
+
+    def truncate(self, length):
+        """Removes every event after the first 'length' events"""
+        if length >= len(self):
+            return
+
+        # Take the removed events out of the modification index, newest first
+        if length < self.causes_found:
+            index = self.modification_index
+            for position in reversed(range(self.modified_offsets[length],
+                                           len(self.replaced_writers))):
+                last_writer = self.replaced_writers[position]
+                total = self.replaced_totals[position]
+                index.remove_modification(
+                    self.modified_vars[position],
+                    self.modified_deltas[position],
+                    None if last_writer == -1 else last_writer,
+                    None if math.isnan(total) else total)
+            del self.replaced_writers[self.modified_offsets[length]:]
+            del self.replaced_totals[self.modified_offsets[length]:]
+            self.causes_found = length
+
+        del self.cards[length:]
+        del self.importance[length:]
+
+        for offsets, columns in ((self.role_offsets,
+                                  (self.roles, self.role_characters)),
+                                 (self.modified_offsets,
+                                  (self.modified_vars, self.modified_deltas)),
+                                 (self.requirement_offsets,
+                                  (self.requirement_vars,
+                                   self.requirement_kind_ids)),
+                                 (self.affecting_offsets,
+                                  (self.affecting_vars,)),
+                                 (self.cause_offsets,
+                                  (self.cause_events, self.cause_weights))):
+            if len(offsets) <= length + 1:
+                continue
+            end = offsets[length]
+            del offsets[length + 1:]
+            for column in columns:
+                del column[end:]
+
+    def get_event_name(self, event_id):
+        """Returns the name of the card of an event"""
+        return self.card_names.names[self.cards[event_id]]
+
+    def get_roles(self, event_id):
+        """Returns a dict of which character played which role in an event"""
+        role_names = self.role_names.names
+        character_names = self.character_names.names
+        roles = {}
+        for index in range(self.role_offsets[event_id],
+                           self.role_offsets[event_id + 1]):
+            roles[role_names[self.roles[index]]] = \
+                character_names[self.role_characters[index]]
+        return roles
+
+    def get_values_modified(self, event_id):
+        """Returns a dict of how much an event changed each value"""
+        var_names = self.var_names.names
+        values_modified = {}
+        for index in range(self.modified_offsets[event_id],
+                           self.modified_offsets[event_id + 1]):
+            values_modified[var_names[self.modified_vars[index]]] = \
+                self.modified_deltas[index]
+        return values_modified
+
+    def get_values_affecting(self, event_id):
+        """Returns the names of the values an event depended on"""
+        self.find_causes(event_id + 1)
+        var_names = self.var_names.names
+        start = self.affecting_offsets[event_id]
+        end = self.affecting_offsets[event_id + 1]
+        return [var_names[var_id] for var_id in self.affecting_vars[start:end]]
+
+    def get_causes(self, event_id):
+        """Returns the (event id, weight) of every event causing an event"""
+        self.find_causes(event_id + 1)
+        start = self.cause_offsets[event_id]
+        end = self.cause_offsets[event_id + 1]
+        return list(zip(self.cause_events[start:end],
+                        self.cause_weights[start:end]))
+
+    def __len__(self):
+        return len(self.cards)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [SelmaEvent(self, event_id)
+                    for event_id in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("event id out of range")
+        return SelmaEvent(self, index)
+
+    def __iter__(self):
+        for event_id in range(len(self)):
+            yield SelmaEvent(self, event_id)
+
+    def __reversed__(self):
+        for event_id in reversed(range(len(self))):
+            yield SelmaEvent(self, event_id)
+
+
+class SelmaEvent:
+    """
+    This class contains information about an event which has occured.
+
+    The information is stored in a SelmaEventLog, and is read from
+    the log when it is asked for.
+    """
+
+    def __init__(self, log, event_id):
+        self.log = log
+        self.event_id = event_id
+
+    @property
+    def event_name(self):
+        """The name of the card of this event"""
+        return self.log.get_event_name(self.event_id)
+
+    @property
+    def roles(self):
+        """A record of who played what role in this event"""
+        return self.log.get_roles(self.event_id)
+
+    @property
+    def subject(self):
+        """The character playing the first role, or 0"""
+        roles = list(self.roles.values())
+        if roles:
+            return roles[0]
+        return 0
+
+    @property
+    def object(self):
+        """The character playing the second role, or 0"""
+        roles = list(self.roles.values())
+        if len(roles) > 1:
+            return roles[1]
+        return 0
+
+    @property
+    def values_modified(self):
+        """How much this event changed each value"""
+        return self.log.get_values_modified(self.event_id)
+
+    @property
+    def values_affecting(self):
+        """The values this event depended on"""
+        return self.log.get_values_affecting(self.event_id)
+
+    @property
+    def causing_events(self):
+        """The events which caused this event, as (event, weight) tuples
+        sorted by descending weight"""
+        return [(SelmaEvent(self.log, cause_id), weight)
+                for cause_id, weight in self.log.get_causes(self.event_id)]
+
+    @property
+    def importance(self):
+        """How important the event is to the story"""
+        return self.log.importance[self.event_id]
+
+    @importance.setter
+    def importance(self, value):
+        self.log.importance[self.event_id] = value
+
+    def __eq__(self, other):
+        return (isinstance(other, SelmaEvent) and
+                self.log is other.log and
+                self.event_id == other.event_id)
+
+    def __hash__(self):
+        return hash((id(self.log), self.event_id))
+
+    def __str__(self):
+        return "EVENT %s: '%s'" % (self.event_id, self.as_sentence())
+
+    def as_sentence(self):
+        """Returns a sentence which describes the event"""
+
+        subject = self.subject
+        obj = self.object
+
+        if subject and obj:
+            name = "%s %s %s" % (subject, self.event_name, obj)
+            return name
+        elif subject:
+            name = "%s %s" % (subject, self.event_name)
+            return name
+
+        return self.event_name
+
+
+class SelmaModificationIndex:
+    """
+    Keeps track of which events modified each value, so that the events
+    causing a new event can be found without going through every
+    previous event. Values are named by their ids in the event log.
+    """
+
+    def __init__(self):
+        """Initializes an empty index"""
+
+        # The newest event to modify each value
+        self.last_writer = {}
+
+        # Every event which increased or decreased each value, in the
+        # order they happened, and the sum of all of those changes
+        self.positive_writers = {}
+        self.negative_writers = {}
+        self.positive_totals = {}
+        self.negative_totals = {}
+
+    def add_modification(self, event_id, var_id, delta):
+        """Adds that the newest event changed a value by 'delta'. Returns the
+        (last writer, total) it replaced, which remove_modification() needs
+        to undo it"""
+
+        if delta > 0:
+            writers, totals = self.positive_writers, self.positive_totals
+        elif delta < 0:
+            writers, totals = self.negative_writers, self.negative_totals
+            delta = -delta
+        else:
+            writers, totals = None, None
+
+        replaced_writer = self.last_writer.get(var_id)
+        self.last_writer[var_id] = event_id
+        if writers is None:
+            return replaced_writer, None
+
+        replaced_total = totals.get(var_id)
+        if replaced_total is None:
+            writers[var_id] = (array(ID_TYPE), array(VALUE_TYPE))
+            totals[var_id] = 0.0
+        event_ids, deltas = writers[var_id]
+        event_ids.append(event_id)
+        deltas.append(delta)
+        totals[var_id] += delta
+
+        return replaced_writer, replaced_total
+
+    def remove_modification(self, var_id, delta, last_writer, total):
+        """Removes the newest modification added to the index. 'last_writer'
+        and 'total' are what add_modification() returned for it"""
+
+        if last_writer is None:
+            del self.last_writer[var_id]
+        else:
+            self.last_writer[var_id] = last_writer
+
+        if delta > 0:
+            writers, totals = self.positive_writers, self.positive_totals
+        elif delta < 0:
+            writers, totals = self.negative_writers, self.negative_totals
+        else:
+            return
+
+        # The totals are put back as they were, rather than subtracted
+        # from, so that rounding doesn't make them drift
+        event_ids, deltas = writers[var_id]
+        event_ids.pop()
+        deltas.pop()
+        if total is None:
+            del writers[var_id]
+            del totals[var_id]
+        else:
+            totals[var_id] = total
+
+    def get_causes(self, requirement):
+        """
+        Returns the ids of the events which may have caused 'requirement'
+        to be true, their strength, and the total strength.
+        """
+
+        var_id, requirement_operator, argument_type = requirement
+
+        # When it comes to lists and strings, OR numbers which
+        # must have a precise value, only the latest edit
+        # of the value is considered to be causing this event
+        if (argument_type == parser.TYPE_STRING or
+                argument_type == parser.TYPE_LIST or
+                requirement_operator == parser.EQUAL or
+                requirement_operator == parser.NOT_EQUAL):
+            if var_id in self.last_writer:
+                return (self.last_writer[var_id],), (1,), 1
+            return (), (), 0
+
+        # When it comes to numbers, we treat every event which moved
+        # the value in the direction it was required to go as a cause
+        if (requirement_operator == parser.GREATER_EQUAL or
+                requirement_operator == parser.GREATER):
+            writers, totals = self.positive_writers, self.positive_totals
+        elif (requirement_operator == parser.LESS_EQUAL or
+              requirement_operator == parser.LESS):
+            writers, totals = self.negative_writers, self.negative_totals
+        else:
+            return (), (), 0
+
+        if not var_id in writers:
+            return (), (), 0
+        event_ids, deltas = writers[var_id]
+        return event_ids, deltas, totals[var_id]
+
+    def get_causing_events(self, requirements):
+        """
+        Returns the ids of the values that 'requirements' depend on, and
+        the (event id, weight) of every event which caused them to be true,
+        sorted by descending weight. The requirements are records returned
+        by SelmaEventLog.get_requirement().
+        """
+
+        # Go through every conditional statement which allowed
+        # this event to be executed and all values it depended on.
+        # Then find any previous events, which also edited that value.
+        # Those events may be considered causing events.
+        causes = {}
+        for requirement in requirements:
+            if not requirement[0] in causes:
+                causes[requirement[0]] = self.get_causes(requirement)
+
+        # We weight the causation by how big the differnce was.
+        # Example: if one event added 50 to happiness and  another one only 5,
+        # the weight of the first event will be  10x as big
+        causing_events_weighted = {}
+        for requirement in requirements:
+            event_ids, strengths, change_sum = causes[requirement[0]]
+            if not change_sum:
+                continue
+
+            # We divide the strength of each causing event with the total
+            # of all changes to the value to produce a value from 0 to 1.
+            for event_id, strength in zip(event_ids, strengths):
+                weighted_strength = strength / change_sum
+                weighted_strength /= len(requirements)
+                causing_events_weighted[event_id] = weighted_strength
+
+        # Finally we sort them by descending size so it becomes
+        # easy for users to remove the least important events
+        causing_events = list(causing_events_weighted.items())
+        causing_events.sort(key=operator.itemgetter(1))
+        causing_events.reverse()
+
+        return list(causes), causing_events
@@ -9,175 +9,425 @@ This module is responsible reading a .selma
 file and add it's contents to the simulation
 """
 
+import os
 import re
 from selma_parser import SelmaParseException
 
+# The kinds of definitions in a .selma file
+CARD = "card"
+CHARACTER = "char"
+
+# Directive which loads another .selma file, relative to the current one
+INCLUDE = "include"
+
+# The sections each kind of definition can contain
+ROLE = "role"
+CARD_SECTIONS = ("conditions", "effects", "next")
+CHARACTER_SECTIONS = ("init", "attributes", "inventory")
+
+# Whitespace and comments between words
+SKIP_REGEX = re.compile(r'(?:\s+|//[^\n]*|/\*.*?\*/)*', re.DOTALL)
+WORD_REGEX = re.compile(r'[A-Za-z_][\w-]*')
+
+# Characters which may start something other than a line inside ()
+GROUP_SPECIAL_REGEX = re.compile(r'[)"/]')
+
+# Double spaces which aren't inside a string literal
+DOUBLE_SPACE_REGEX = re.compile(r'("[^"]*")| {2,}')
+
+# How many characters are read from a file at a time
+CHUNK_SIZE = 1 << 20
+
+# The definitions of every included file which has been parsed in
+# this process, by path, along with the mtime and size of the file
+parsed_files = {}
+
 def load_selma_file(selma_sim_object, path):
-    """Loads a .selma file and adds all it's data"""
-    # Extract the name of the file and the directory from the path
-    search_object = re.search(r'/([^/]+\.selma)', path, flags=0)
-    file_name = search_object.group(1)
+    """Loads a .selma file and adds all it's data. Returns the
+    (path, mtime, size) of the file and of every file it included"""
 
+    files_read = []
+    load_file(selma_sim_object, os.path.abspath(path), files_read, [], False)
+    return files_read
+
+def check_extension(path):
+    """Raises an exception if 'path' isn't a .selma file"""
     # Ignore files that does not have a .selma extension
-    if not file_name.endswith(".selma"):
+    if not path.endswith(".selma"):
         raise SelmaParseException("Cannot only read files with a .selma extension (%s)" % path)
 
-    # This is where we find other files to load
-    #TODO: dictionary_directory = path.replace(file_name, "")
-
-    # Load the contents of the original file
-    source_file = open(path)
-    file_content = source_file.read()
-    source_file.close()
-
-    # Insert any referenced files
-    #TODO: file_content = insert_external_files(file_content, dictionary_directory)
-
-    # Remove double spaces
-    file_content = re.sub(r'  *', ' ', file_content)
-    # Remove whitespace in beginning of lines
-    file_content = re.sub(r'\n\s*', '\n', file_content)
-    # Remove empty lines
-    file_content = re.sub(r'\n+', '\n', file_content)
-    # Remove inline comments
-    file_content = re.sub(r'//.*', '\n', file_content)
-    # Remove multiline comments
-    file_content = re.sub(r'/\*[\S|\s]*\*/', '', file_content)
-
-    # Replace string literals
-    find_string_literals_regex = r'\"[^\"]*\"'
-    all_string_literals = re.findall(find_string_literals_regex,
-                                     file_content,
-                                     flags=0)
-    literal_dictionary = {}
-
-    index = 0
-    for literal in all_string_literals:
-        if not literal in literal_dictionary.values():
-            literal_name = "_LITERAL_%s" % index
-            literal_dictionary[literal_name] = literal
-            file_content = file_content.replace(literal, literal_name)
-            index += 1
-
-    # Separate each card into different strings
-    cards = get_definitions_of_type_in_text("card",
-                                            file_content,
-                                            literal_dictionary)
-
-    for card_tuple in cards:
-        card_name, card_text = card_tuple
-        name, conditions, effects, next_cards, roles = text_to_card_contents(card_name, card_text, literal_dictionary)
-        selma_sim_object.add_to_deck(name, effects, conditions, next_cards, roles)
+def load_file(selma_sim_object, path, files_read, including_files, included):
+    """
+    Adds the definitions of the file at 'path' to the simulation, and
+    loads every file it includes. 'files_read' lists every file loaded
+    so far and 'including_files' the files which are including this one.
 
-    # Separate each character into different strings
-    characters = get_definitions_of_type_in_text("char",
-                                                 file_content,
-                                                 literal_dictionary)
-
-    for character_tuple in characters:
-        character_name, character_text = character_tuple
-        init_effects, attributes, inventory = text_to_char_contents(character_text, literal_dictionary)
-        selma_sim_object.add_character_to_cast(character_name, init_effects, attributes, inventory)
-
-
-
-def text_to_card_contents(name, card_text, literal_dictionary):
-    """Parses a string for a event card"""
-    conditions = get_strings_inside_parentheses("conditions",
-                                                card_text,
-                                                literal_dictionary)
-    effects = get_strings_inside_parentheses("effects",
-                                             card_text,
-                                             literal_dictionary)
-    next_cards = get_strings_inside_parentheses("next",
-                                                card_text,
-                                                literal_dictionary)
-
-    # Find all roles
-    roles = list() # list of tuples of type name:string, lines:list(string)
-    find_roles_regex = r'role\s*(_LITERAL_\d+)\s*(\([^\)]*\))'
-    role_strings = re.findall(find_roles_regex, card_text, flags=0)
-
-    for role_string in role_strings:
-        role_name, role_content = role_string
-        role_name = literal_dictionary[role_name][1:-1]
-        role_lines = get_strings_inside_parentheses("", role_content, literal_dictionary)
-        role_tuple = role_name, role_lines
-        roles.append(role_tuple)
-
-    # Remove the quotes from the next card strings
-    cleaned_next_cards = list()
-    for card in next_cards:
-        cleaned_next_cards.append(card[1:-1])
-
-    return name, conditions, effects, cleaned_next_cards, roles
-
-
-def text_to_char_contents(character_text, literal_dictionary):
-    """Parses a string for a event card"""
-
-    init_effects = get_strings_inside_parentheses("init",
-                                                  character_text,
-                                                  literal_dictionary)
-    attributes = get_strings_inside_parentheses("attributes",
-                                                character_text,
-                                                literal_dictionary)
-    inventory = get_strings_inside_parentheses("inventory",
-                                               character_text,
-                                               literal_dictionary)
-
-    return init_effects, attributes, inventory
-
-
-def get_strings_inside_parentheses(group_name,
-                                   card_text,
-                                   literal_dictionary,
-                                   use_string=False):
-    """Returns every line from inside a () statement"""
-    results = list()
-
-    find_group_regex = r'%s\s*\(([^\)]*)\)' % group_name
-    search_object = re.search(find_group_regex, card_text, flags=0)
-
-    whole_group_string = ""
-    if search_object:
-        if use_string:
-            whole_group_string = search_object.group(2)
-        else:
-            whole_group_string = search_object.group(1)
+    Included files are parsed once per process, while the file which
+    is loaded directly is read a chunk at a time.
+    """
 
-        for line in whole_group_string.split("\n"):
-            if line:   #Ignore empty lines
-                line = line.strip()
-                find_literal_regex = r'(_LITERAL_\d+)'
-
-                # Replace every literal on the line
-                match_literal_object = re.search(find_literal_regex, line, flags=0)
-                while match_literal_object:
-                    literal = match_literal_object.group(1)
-                    line = line.replace(literal, literal_dictionary[literal])
-                    match_literal_object = re.search(find_literal_regex, line, flags=0)
-                results.append(line)
-        return results
+    check_extension(path)
+
+    including_files.append(path)
+    if included:
+        definitions, mtime, size = get_parsed_file(path)
+        files_read.append((path, mtime, size))
+        add_definitions(selma_sim_object, path, definitions, files_read, including_files)
+    else:
+        with open(path) as source_file:
+            stat = os.fstat(source_file.fileno())
+            files_read.append((path, stat.st_mtime_ns, stat.st_size))
+            definitions = SelmaFileParser(source_file, path).definitions()
+            add_definitions(selma_sim_object, path, definitions, files_read, including_files)
+    including_files.pop()
+
+def add_definitions(selma_sim_object, path, definitions, files_read, including_files):
+    """Adds every definition of the file at 'path' to the simulation
+    as soon as it has been read, and loads the files it includes"""
+
+    for definition in definitions:
+        if definition[0] != INCLUDE:
+            add_definition(selma_sim_object, definition)
+            continue
+
+        _, include_name, location = definition
+        include_path = os.path.normpath(
+            os.path.join(os.path.dirname(path), include_name))
+
+        if include_path in including_files:
+            raise SelmaParseException("%s: Circular include of '%s'"
+                                      % (location, include_name))
+
+        # A file is only added once, no matter how often it's included
+        if any(include_path == file_read[0] for file_read in files_read):
+            continue
+
+        try:
+            load_file(selma_sim_object, include_path, files_read, including_files, True)
+        except OSError as error:
+            raise SelmaParseException("%s: Can't include '%s': %s"
+                                      % (location, include_name, error.strerror))
+
+def get_parsed_file(path):
+    """Returns every definition in the file at 'path' and the mtime and
+    size of the file. The file is only parsed again if it has changed"""
+
+    stat = os.stat(path)
+    if path in parsed_files:
+        definitions, mtime, size = parsed_files[path]
+        if mtime == stat.st_mtime_ns and size == stat.st_size:
+            return parsed_files[path]
+
+    with open(path) as source_file:
+        definitions = list(SelmaFileParser(source_file, path).definitions())
+    parsed_files[path] = definitions, stat.st_mtime_ns, stat.st_size
+    return parsed_files[path]
+
+def add_definition(selma_sim_object, definition):
+    """Adds a definition returned by SelmaFileParser to the simulation"""
+    if definition[0] == CARD:
+        _, name, conditions, effects, next_cards, roles = definition
+        selma_sim_object.add_to_deck(name, effects, conditions, next_cards, roles)
     else:
-        return list()
+        _, name, init_effects, attributes, inventory = definition
+        selma_sim_object.add_character_to_cast(name, init_effects, attributes, inventory)
+
 
-def get_definitions_of_type_in_text(type_string, text, literal_dictionary):
-    """Returns every definition{} in the text as a list of tuples,
-    each containing the name of the definition and it's text"""
+class SelmaEndOfChunk(Exception):
+    """Raised by SelmaFileParser when it reaches the end of the text
+    it has read, before the end of the file"""
+    pass
 
-    all_instances = list()
-    find_defintions_regex = r'%s\s*(_LITERAL_\d+)\s*\{([^\}]*)\}' % type_string
 
-    all_definitions = re.findall(find_defintions_regex, text, flags=0)
+class SelmaFileParser:
+    """
+    Reads the definitions of a .selma file in a single pass.
 
-    # Parse each definition into a tuple containing name and it's text
-    index = 0
-    while index < len(all_definitions):
-        def_name, def_text = all_definitions[index]
-        def_name = literal_dictionary[def_name][1:-1]
-        _tuple = def_name, def_text
-        all_instances.append(_tuple)
-        index += 1
+    A file is a list of definitions and includes, which look like this:
 
-    return all_instances
+        include "path/to/other.selma"
+
+        card "name" {
+            conditions ( ... )
+            role "name" ( ... )
+            effects ( ... )
+            next ( ... )
+        }
+
+        char "name" {
+            init ( ... )
+            attributes ( ... )
+            inventory ( ... )
+        }
+
+    Every non-empty line inside () becomes a string, with comments
+    and surrounding whitespace removed.
+
+    The file is read a chunk at a time. Only the text of the definition
+    being read is kept in memory, along with the rest of the last chunk.
+    """
+
+    def __init__(self, source_file, path="<string>", chunk_size=CHUNK_SIZE):
+        """Initializes a parser of 'source_file', which was opened from 'path'"""
+        self.source_file = source_file
+        self.path = path
+        self.chunk_size = chunk_size
+
+        # The text which has been read but not parsed yet
+        self.text = ""
+        self.position = 0
+        self.complete = False
+
+        # Where in the file self.text starts
+        self.line = 1
+        self.column = 1
+
+    def read_chunk(self):
+        """Throws away the text before the current position and reads
+        another chunk, which is at least as big as the text kept"""
+
+        dropped = self.text[:self.position]
+        newlines = dropped.count("\n")
+        if newlines:
+            self.line += newlines
+            self.column = len(dropped) - dropped.rfind("\n")
+        else:
+            self.column += len(dropped)
+
+        self.text = self.text[self.position:]
+        self.position = 0
+
+        chunk = self.source_file.read(max(self.chunk_size, len(self.text)))
+        if chunk:
+            self.text += chunk
+        else:
+            self.complete = True
+
+    def get_location(self, position):
+        """Returns the path, line and column of 'position' as a string"""
+        newlines = self.text.count("\n", 0, position)
+        line = self.line + newlines
+        if newlines:
+            column = position - self.text.rfind("\n", 0, position)
+        else:
+            column = self.column + position
+        return "%s, line %d, column %d" % (self.path, line, column)
+
+    def error(self, message, position=None):
+        """Returns an exception telling where in the file 'message' happened"""
+        if position is None:
+            position = self.position
+        return SelmaParseException("%s: %s" % (self.get_location(position), message))
+
+    def end_of_text_error(self, message, position=None):
+        """Returns the exception to raise when the text ended too early,
+        which means that another chunk must be read if there is one"""
+        if not self.complete:
+            return SelmaEndOfChunk()
+        return self.error(message, position)
+
+    def skip(self):
+        """Skips any whitespace and comments"""
+        self.position = SKIP_REGEX.match(self.text, self.position).end()
+        if self.text.startswith("/*", self.position):
+            raise self.end_of_text_error("Unterminated comment")
+
+        # The last character may be the start of a comment
+        if self.position == len(self.text) - 1 and self.text[-1] == "/":
+            raise self.end_of_text_error("Unexpected '/'")
+
+    def at_end(self):
+        """Returns True if there is nothing but whitespace left"""
+        self.skip()
+        return self.position >= len(self.text)
+
+    def peek(self, char):
+        """Returns True if the next character is 'char'"""
+        self.skip()
+        return self.text.startswith(char, self.position)
+
+    def expect(self, char, description):
+        """Skips past 'char', which must be the next character"""
+        if not self.peek(char):
+            if self.position >= len(self.text):
+                raise self.end_of_text_error("Expected %s" % description)
+            raise self.error("Expected %s" % description)
+        self.position += len(char)
+
+    def read_word(self, description):
+        """Returns the next word, like 'card' or 'effects'"""
+        self.skip()
+        match = WORD_REGEX.match(self.text, self.position)
+        if not match:
+            if self.position >= len(self.text):
+                raise self.end_of_text_error("Expected %s" % description)
+            raise self.error("Expected %s" % description)
+
+        # The word may continue in the next chunk
+        if match.end() == len(self.text) and not self.complete:
+            raise SelmaEndOfChunk()
+        self.position = match.end()
+        return match.group()
+
+    def read_string(self, description):
+        """Returns the contents of the next string literal"""
+        self.skip()
+        if not self.text.startswith('"', self.position):
+            if self.position >= len(self.text):
+                raise self.end_of_text_error("Expected %s" % description)
+            raise self.error("Expected %s" % description)
+        end = self.text.find('"', self.position + 1)
+        if end < 0:
+            raise self.end_of_text_error("Unterminated string")
+        string = self.text[self.position + 1:end]
+        self.position = end + 1
+        return string
+
+    def read_group(self):
+        """Returns every line from inside a () statement"""
+        self.expect("(", "'('")
+
+        text = self.text
+        start = self.position
+        position = start
+        pieces = []
+
+        # Find the closing parenthesis, skipping over strings
+        # and leaving out comments
+        while True:
+            match = GROUP_SPECIAL_REGEX.search(text, position)
+            if not match:
+                raise self.end_of_text_error("Unterminated '('", start - 1)
+            position = match.start()
+            char = match.group()
+
+            if char == ")":
+                break
+            elif char == '"':
+                end = text.find('"', position + 1)
+                if end < 0:
+                    raise self.end_of_text_error("Unterminated string", position)
+                position = end + 1
+            elif text.startswith("//", position):
+                pieces.append(text[start:position])
+                end = text.find("\n", position)
+                if end < 0:
+                    end = len(text)
+                position = start = end
+            elif text.startswith("/*", position):
+                pieces.append(text[start:position])
+                end = text.find("*/", position + 2)
+                if end < 0:
+                    raise self.end_of_text_error("Unterminated comment", position)
+                position = start = end + 2
+            else:
+                position += 1
+
+        pieces.append(text[start:position])
+        self.position = position + 1
+
+        lines = []
+        for line in "".join(pieces).split("\n"):
+            line = line.strip()
+            if line:   #Ignore empty lines
+                if "  " in line:
+                    line = DOUBLE_SPACE_REGEX.sub(lambda match: match.group(1) or " ", line)
+                lines.append(line)
+        return lines
+
+    def definitions(self):
+        """
+        Yields every definition in the file as a tuple, either
+        ("card", name, conditions, effects, next_cards, roles),
+        ("char", name, init_effects, attributes, inventory) or
+        ("include", path, location of the include)
+        """
+
+        while True:
+            start = self.position
+            try:
+                if self.at_end():
+                    if self.complete:
+                        return
+                    raise SelmaEndOfChunk()
+                definition = self.read_definition()
+            except SelmaEndOfChunk:
+                # Read the whole definition again when more text has been read
+                self.position = start
+                self.read_chunk()
+                continue
+            yield definition
+
+    def read_definition(self):
+        """Reads the next card, character or include"""
+        start = self.position
+        kind = self.read_word("'card', 'char' or 'include'")
+        if kind == CARD:
+            return self.read_card()
+        elif kind == CHARACTER:
+            return self.read_character()
+        elif kind == INCLUDE:
+            include_path = self.read_string("the path of the file to include")
+            return INCLUDE, include_path, self.get_location(start)
+        raise self.error("Expected 'card', 'char' or 'include', found '%s'"
+                         % kind, start)
+
+    def read_sections(self, allowed_sections, definition):
+        """Reads the sections of a {} definition into a dict of lines,
+        and a list of roles if 'role' is one of 'allowed_sections'"""
+
+        self.expect("{", "'{' after the name of the %s" % definition)
+
+        sections = {}
+        roles = [] # list of tuples of type name:string, lines:list(string)
+        while not self.peek("}"):
+            if self.position >= len(self.text):
+                raise self.end_of_text_error("Expected '}' at the end of the %s"
+                                             % definition)
+
+            start = self.position
+            section = self.read_word("a section or '}'")
+            if section == ROLE and ROLE in allowed_sections:
+                role_name = self.read_string("the name of the role")
+                roles.append((role_name, self.read_group()))
+            elif section in allowed_sections:
+                if section in sections:
+                    raise self.error("'%s' is defined twice in the %s"
+                                     % (section, definition), start)
+                sections[section] = self.read_group()
+            else:
+                raise self.error("Unknown section '%s' in the %s"
+                                 % (section, definition), start)
+        self.position += 1
+
+        return sections, roles
+
+    def read_card(self):
+        """Reads the name and the contents of a card"""
+
+        name = self.read_string("the name of the card")
+        definition = "card '%s'" % name
+        sections, roles = self.read_sections(CARD_SECTIONS + (ROLE,), definition)
+
+        # Remove the quotes from the next card strings
+        next_cards = [card[1:-1] for card in sections.get("next", [])]
+
+        return (CARD,
+                name,
+                sections.get("conditions", []),
+                sections.get("effects", []),
+                next_cards,
+                roles)
+
+    def read_character(self):
+        """Reads the name and the contents of a character"""
+
+        name = self.read_string("the name of the character")
+        definition = "character '%s'" % name
+        sections, _ = self.read_sections(CHARACTER_SECTIONS, definition)
+
+        return (CHARACTER,
+                name,
+                sections.get("init", []),
+                sections.get("attributes", []),
+                sections.get("inventory", []))
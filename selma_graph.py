@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python
+
+"""
+This is a module of 'Selma'
+by Oskar Lundqvist / Abrovinsch (c) 2017
+
+This module treats the events of a simulation as a graph of which
+events caused which, so that the whole story can be ranked by how
+important each event is, cut down to its most important events and
+exported as a list of edges
+"""
+
+from array import array
+import heapq
+from selma_event_log import ID_TYPE, VALUE_TYPE
+
+class SelmaCausalGraph:
+    """
+    The graph of which events in a SelmaEventLog caused which.
+
+    An edge goes from a causing event to the event it caused, with the
+    weight the log gives it. The edges are read straight from the arrays
+    of the log rather than copied, so the graph itself takes no memory
+    besides what pruning it needs. Since an event can only be caused by
+    events before it, the order of the log is already an order where
+    every event comes after its causes.
+
+    The importance of an event is 1 for the event itself, plus the
+    importance of every event it caused times the weight with which it
+    caused it. An event which leads to a long chain of other events is
+    thus more important than one which leads nowhere. It is stored as
+    the importance of each event in the log.
+    """
+
+    def __init__(self, log):
+        """Builds the graph of the events in 'log', like update() does"""
+        self.log = log
+        self.update()
+
+    def update(self):
+        """
+        Finds the causes of any events which have been added to the log
+        since the graph was built, and computes the importance of every
+        event again, since new events make the events causing them more
+        important.
+        """
+
+        log = self.log
+        log.find_causes()
+
+        # Every event has all the events it caused after it, so going
+        # backwards, an event is done before any of its causes are
+        importance = log.importance
+        cause_offsets = log.cause_offsets
+        cause_events = log.cause_events
+        cause_weights = log.cause_weights
+
+        importance[:] = array(VALUE_TYPE, [1.0]) * len(log)
+        for event_id in reversed(range(len(log))):
+            event_importance = importance[event_id]
+            for index in range(cause_offsets[event_id], cause_offsets[event_id + 1]):
+                importance[cause_events[index]] += \
+                    cause_weights[index] * event_importance
+
+    def __len__(self):
+        return len(self.log)
+
+    def prune(self, count=None, threshold=None):
+        """
+        Returns the ids of the events which are kept when the graph is cut
+        down to the 'count' most important events, and/or to the events
+        with an importance of at least 'threshold', in the order they
+        happened. Events which are equally important are kept in the
+        order they happened.
+        """
+
+        importance = self.log.importance
+        event_ids = range(len(self.log))
+        if threshold is not None:
+            event_ids = (event_id for event_id in event_ids
+                         if importance[event_id] >= threshold)
+        if count is not None:
+            event_ids = heapq.nlargest(count, event_ids,
+                                       key=importance.__getitem__)
+        return array(ID_TYPE, sorted(event_ids))
+
+    def get_edges(self, kept=None):
+        """
+        Yields every edge of the graph as a (cause id, event id, weight)
+        tuple, in the order the events happened. If 'kept' is a list of
+        event ids, like prune() returns, only edges between those
+        events are yielded.
+        """
+
+        log = self.log
+        cause_offsets = log.cause_offsets
+        cause_events = log.cause_events
+        cause_weights = log.cause_weights
+
+        if kept is None:
+            is_kept = None
+            event_ids = range(len(log))
+        else:
+            is_kept = bytearray(len(log))
+            for event_id in kept:
+                is_kept[event_id] = 1
+            event_ids = kept
+
+        for event_id in event_ids:
+            for index in range(cause_offsets[event_id], cause_offsets[event_id + 1]):
+                cause_id = cause_events[index]
+                if is_kept is None or is_kept[cause_id]:
+                    yield cause_id, event_id, cause_weights[index]
+
+    def export_edges(self, path, kept=None):
+        """
+        Writes the edges of the graph to the file at 'path', one edge per
+        line as 'cause_id event_id weight'. 'kept' is used like in
+        get_edges(). The edges are written as they are found, so the whole
+        list is never held in memory. Returns how many edges were written.
+        """
+
+        edge_count = 0
+        with open(path, "w") as edge_file:
+            for cause_id, event_id, weight in self.get_edges(kept):
+                edge_file.write("%d %d %.6g\n" % (cause_id, event_id, weight))
+                edge_count += 1
+        return edge_count
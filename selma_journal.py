@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python
+
+"""
+This is a module of 'Selma'
+by Oskar Lundqvist / Abrovinsch (c) 2017
+
+This module keeps an undo journal of everything the steps of a
+simulation change, so that a simulation can be rolled back to a
+snapshot and continued differently from there
+"""
+
+import selma_parser as parser
+from selma_eligibility import get_change_keys, OPERATORS_ON_ALL
+
+# The kinds of entries in the journal
+EFFECT = 0
+CARD_WEIGHT = 1
+EVENT = 2
+CAST_VARIABLE = 3
+
+class SelmaMissingValue:
+    """Stands in for the old value of a variable which didn't exist"""
+
+MISSING = SelmaMissingValue()
+
+class SelmaSnapshot:
+    """
+    The state of a simulation at some point, which it can be restored to.
+
+    Only what is small is stored in the snapshot itself. Everything else
+    is rolled back with the undo journal, so taking a snapshot and
+    restoring it costs as much as the changes made since it was taken.
+    """
+
+    def __init__(self, simulation, journal):
+        """Takes a snapshot of 'simulation', which keeps its changes in 'journal'"""
+        self.journal = journal
+        self.position = len(journal.entries)
+        self.last_entry = journal.entries[-1] if journal.entries else None
+
+        self.steps_count = simulation.steps_count
+        self.random_state = simulation.random.getstate()
+        self.draw_deck = simulation.draw_deck.copy()
+        self.roles = simulation.roles.copy()
+
+    def is_valid(self, journal):
+        """Returns False if the changes leading up to this snapshot
+        have been rolled back, or if 'journal' isn't the one it was taken with"""
+        if journal is not self.journal or len(journal.entries) < self.position:
+            return False
+        if not self.position:
+            return True
+        return journal.entries[self.position - 1] is self.last_entry
+
+
+class SelmaJournal:
+    """
+    A list of every change made to a simulation, in the order they were
+    made, where each entry has what is needed to undo the change:
+
+    - (EFFECT, statement, character, [(holder, name, old value, old
+      contents)]) for an executed effect, where 'character' is the one
+      whose variable it changed, if any. Lists and dicts are changed in
+      place, so the contents they had are also kept, as a copy.
+    - (CARD_WEIGHT, card name, old weight) for a card which was removed
+      from the deck.
+    - (EVENT, event id) for an event which was logged.
+    - (CAST_VARIABLE, var name, characters, old values) for a number
+      which was updated on many characters at once.
+    """
+
+    def __init__(self):
+        """Initializes an empty journal"""
+        self.entries = []
+
+    def record_effect(self, statement):
+        """Remembers every value that 'statement' may change, before it
+        is executed"""
+
+        values = []
+        character = None
+        if statement.operator in OPERATORS_ON_ALL:
+            members = statement.get_var_value()
+            if members.__class__ is dict:
+                members = members.values()
+            for member in members:
+                holder = parser.get_var_holder(member)
+                if "var" in holder:
+                    values.append(get_old_value(holder, "var"))
+        else:
+            values.append(get_old_value(statement.var_holder, statement.var_name))
+
+            # The roles will be played by others once the effect is undone
+            character = statement.compiled.variable_path.get_character(
+                statement.scope)
+
+        self.entries.append((EFFECT, statement, character, values))
+
+    def record_card_weight(self, card_name, weight):
+        """Remembers that a card had 'weight' copies before it was changed"""
+        self.entries.append((CARD_WEIGHT, card_name, weight))
+
+    def record_event(self, event_id):
+        """Remembers that an event was logged"""
+        self.entries.append((EVENT, event_id))
+
+    def record_cast_variable(self, var_name, characters, old_values):
+        """Remembers the numbers named 'var_name' that 'characters' had
+        before SelmaStorySimulation.update_cast_variable() changed them"""
+        self.entries.append((CAST_VARIABLE, var_name, characters, old_values))
+
+    def undo(self, simulation, position):
+        """Undoes every change after the first 'position' entries"""
+
+        entries = self.entries
+        while len(entries) > position:
+            entry = entries.pop()
+            kind = entry[0]
+
+            if kind == EFFECT:
+                _, statement, character, values = entry
+                for holder, name, value, contents in reversed(values):
+                    set_old_value(holder, name, value, contents)
+
+                simulation.eligibility.variables_changed(
+                    get_change_keys(statement))
+                if statement.operator in OPERATORS_ON_ALL:
+                    simulation.cast_index.mark_all_dirty()
+                elif character is not None:
+                    simulation.cast_index.mark_dirty(character)
+
+            elif kind == CARD_WEIGHT:
+                _, card_name, weight = entry
+                simulation.card_table.add(card_name, weight)
+
+            elif kind == EVENT:
+                # The log takes the event out of its own index
+                simulation.past_events.truncate(entry[1])
+
+            elif kind == CAST_VARIABLE:
+                _, var_name, characters, old_values = entry
+                new_values = []
+                for character, value in zip(characters, old_values):
+                    new_values.append(character.var[var_name])
+                    character.var[var_name] = value
+
+                simulation.cast_index.update_variable(var_name,
+                                                      characters,
+                                                      new_values)
+                simulation.eligibility.variables_changed(
+                    ("cast:var.%s" % var_name,))
+
+
+def get_old_value(holder, name):
+    """Returns the (holder, name, value, contents) of a variable,
+    where contents is a copy of the value if it is a list or a dict"""
+    if not name in holder:
+        return holder, name, MISSING, None
+
+    value = holder[name]
+    if isinstance(value, list):
+        return holder, name, value, list(value)
+    if isinstance(value, dict):
+        return holder, name, value, value.copy()
+    return holder, name, value, None
+
+def set_old_value(holder, name, value, contents):
+    """Puts back a value returned by get_old_value(). Lists and dicts
+    get their old contents back in place, since other objects may be
+    referring to them"""
+    if value is MISSING:
+        if name in holder:
+            del holder[name]
+        return
+
+    if isinstance(value, list):
+        value[:] = contents
+    elif isinstance(value, dict):
+        value.clear()
+        value.update(contents)
+    holder[name] = value
@@ -10,6 +10,7 @@ selma statements
 """
 
 import ast
+import functools
 import re
 
 #This defines the operators
@@ -67,25 +68,263 @@ TYPE_LITERAL_LIST = 'literal-list'
 ERROR_NO_SUCH_VARIABLE = 'There is no variable named "%s" on object %s'
 ALLOW_PRINT_OUT = True
 
-class SelmaStatement:
-    """A selma statement"""
-
-    def __init__(self, calling_object, line):
-        """Initializes a new SelmaStatement object by parsing"
-        a line and grabbing references from the parent object"""
+# The maximum number of compiled statements kept in the statement cache
+STATEMENT_CACHE_SIZE = 4096
+
+STATEMENT_REGEX = re.compile(r'(\S+)\s+(\S+)\s+(.+)')
+
+class SelmaOperatorRegistry:
+    """
+    A registry which maps operators to the functions handling them.
+
+    A handler is registered for an operator and optionally for a
+    specific type of variable and/or argument. When a statement is
+    executed, the most specific handler is used. Handlers registered
+    for a specific argument type take precedence over handlers
+    registered for a specific variable type.
+    """
+
+    # Is increased whenever any registry changes, so that compiled
+    # statements know when their resolved handlers are outdated
+    generation = 0
+
+    def __init__(self, usage):
+        """Initializes an empty registry. 'usage' describes what
+        the operators are used for, and is used in error messages"""
+        self.usage = usage
+        self.handlers = {}
+        self.operators = set()
+
+        # The handlers which were registered by Selma itself, and the
+        # operators which are still only handled by them
+        self.built_in_handlers = {}
+        self.built_in_operators = set()
+        self.built_in_generation = -1
+
+    def register(self, operator, handler, var_type=None, argument_type=None):
+        """Registers 'handler' to handle 'operator'. The handler will be
+        called with the bound SelmaStatement as its only argument"""
+
+        if not operator or re.search(r'\s', operator):
+            raise SelmaParseException("Invalid operator '%s'" % operator)
+
+        self.handlers[(operator, var_type, argument_type)] = handler
+        self.operators.add(operator)
+        SelmaOperatorRegistry.generation += 1
+
+    def resolve(self, statement, var_type, argument_type):
+        """Returns the handler to use for 'statement' when it's
+        variable and argument is of the given types"""
+
+        operator = statement.operator
+        for key in ((operator, var_type, argument_type),
+                    (operator, None, argument_type),
+                    (operator, var_type, None),
+                    (operator, None, None)):
+            if key in self.handlers:
+                return self.handlers[key]
+
+        # The operator exists but has not defintion for these types
+        if operator in self.operators:
+            parse_error_wrong_type(operator, var_type, statement.path)
+
+        raise SelmaParseException("Operator '%s' can't be used to %s"
+                                  % (operator, self.usage))
+
+    def mark_built_in(self):
+        """Remembers the handlers registered so far as the built in ones"""
+        self.built_in_handlers = self.handlers.copy()
+        self.built_in_generation = -1
+
+    def is_built_in(self, operator):
+        """Returns whether 'operator' is still only handled by the built
+        in handlers, so that code which knows what the built in operators
+        mean may test them without calling the handlers"""
+
+        if self.built_in_generation != SelmaOperatorRegistry.generation:
+            built_in_handlers = self.built_in_handlers
+            self.built_in_operators = set(key[0] for key in built_in_handlers)
+            for key, handler in self.handlers.items():
+                if built_in_handlers.get(key) is not handler:
+                    self.built_in_operators.discard(key[0])
+            self.built_in_generation = SelmaOperatorRegistry.generation
+        return operator in self.built_in_operators
+
+EFFECTS = SelmaOperatorRegistry("execute an effect")
+CONDITIONS = SelmaOperatorRegistry("evaluate a condition")
+
+def register_effect_operator(operator, handler, var_type=None, argument_type=None):
+    """Registers a handler for an operator which can be used in effects"""
+    EFFECTS.register(operator, handler, var_type, argument_type)
+
+def register_condition_operator(operator, handler, var_type=None, argument_type=None):
+    """Registers a handler for an operator which can be used in conditions.
+    The handler must return True or False"""
+    CONDITIONS.register(operator, handler, var_type, argument_type)
+
+class SelmaCompiledStatement:
+    """A selma statement which has been parsed, but which is
+    not yet bound to any scope object"""
+
+    def __init__(self, line):
+        """Parses a line once, so that it can be bound
+        to any number of scope objects later on"""
 
         line = line.strip()
 
         # Search for a statement pattern
-        match_object = re.match(r'(\S+)\s+(\S+)\s+(.+)', line, flags=0)
+        match_object = STATEMENT_REGEX.match(line)
         if not match_object:
             raise SelmaParseException("invalid syntax '%s'" % line)
-        matches = match_object.groups()
+
+        self.line = line
+        self.path, self.operator, self.argument = match_object.groups()
+        self.variable_path = compile_path(self.path)
+        self.argument_path = None
+
+        # Make sure the operator is defined
+        if (not self.operator in EFFECTS.operators and
+                not self.operator in CONDITIONS.operators):
+            raise SelmaParseException("Undefined operator '%s' in line '%s'"
+                                      % (self.operator, line))
+
+        # Get the type of the argument and convert it in advance
+        self.argument_type = get_type_from_literal(self.argument)
+        self.number = None
+        self.list_value = None
+
+        if self.argument_type == TYPE_FLOAT:
+            self.number = parse_as_number(self.operator, self.argument)
+        elif self.argument_type == TYPE_LITERAL_LIST:
+            # Anything which isn't a proper list is left to fail
+            # when (and if) it is actually used as a list
+            try:
+                list_value = ast.literal_eval(self.argument)
+            except (ValueError, SyntaxError):
+                list_value = None
+            if isinstance(list_value, list):
+                self.list_value = list_value
+
+        # If the argument is a string, we need to remove the quotes
+        elif self.argument_type == TYPE_STRING:
+            self.argument = self.argument[1:-1]
+
+        elif self.argument_type == TYPE_REF:
+            self.argument_path = compile_path(self.argument)
+
+        self.handler_cache = {}
+        self.generation = SelmaOperatorRegistry.generation
+
+    def __getstate__(self):
+        """Handlers are looked up again after unpickling, since the
+        operators may have been registered differently"""
+        state = self.__dict__.copy()
+        state["handler_cache"] = {}
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.generation = SelmaOperatorRegistry.generation
+
+    def get_handler(self, registry, var_type, argument_type):
+        """Returns the handler of 'registry' to use for this statement.
+        The handler is only resolved the first time it's asked for."""
+
+        if self.generation != SelmaOperatorRegistry.generation:
+            self.handler_cache = {}
+            self.generation = SelmaOperatorRegistry.generation
+
+        key = (registry.usage, var_type, argument_type)
+        try:
+            return self.handler_cache[key]
+        except KeyError:
+            handler = registry.resolve(self, var_type, argument_type)
+            self.handler_cache[key] = handler
+            return handler
+
+    def bind(self, calling_object):
+        """Returns a SelmaStatement of this statement bound to 'calling_object'"""
+        return SelmaStatement(calling_object, self)
+
+    def evaluate(self, calling_object):
+        """Return true if this statement is true on 'calling_object'"""
+        return evaluate_condition(calling_object, self)
+
+    def execute(self, calling_object):
+        """Execute this statement as an effect on 'calling_object'"""
+        return execute_effect(calling_object, self)
+
+    def execute_with_delta(self, calling_object):
+        """Execute this statement as an effect on 'calling_object', and
+        return the bound statement and how much it changed the variable"""
+        statement = SelmaStatement(calling_object, self)
+        return statement, execute_statement_with_delta(statement)
+
+    def get_requirement(self, calling_object):
+        """Returns the global name of the variable, the operator and the
+        type of the argument of this statement on 'calling_object', which
+        is all that is needed to find the events which made it true"""
+
+        var_holder, var_name = self.variable_path.resolve(calling_object)
+
+        argument = self.argument
+        argument_type = self.argument_type
+        if argument_type == TYPE_REF:
+            argument = self.argument_path.get_value(calling_object)
+            argument_type = get_type_name(argument)
+
+        full_var_name = self.variable_path.get_full_name(calling_object)
+        if get_type_name(var_holder[var_name]) == TYPE_LIST:
+            full_var_name += ".%s" % argument
+        return full_var_name, self.operator, argument_type
+
+    def __repr__(self):
+        return "SelmaCompiledStatement(%r)" % self.line
+
+
+@functools.lru_cache(maxsize=STATEMENT_CACHE_SIZE)
+def compile_statement(line):
+    """Returns the compiled version of a line. The result is cached,
+    so any line is only parsed once as long as it is used often"""
+    return SelmaCompiledStatement(line)
+
+def compile_condition(line):
+    """Compiles a line which is going to be used as a condition"""
+    statement = compile_statement(line)
+    if not statement.operator in CONDITIONS.operators:
+        raise SelmaParseException(
+            "Operator '%s' can't be used to evaluate a condition"
+            % statement.operator)
+    return statement
+
+def compile_effect(line):
+    """Compiles a line which is going to be used as an effect"""
+    statement = compile_statement(line)
+    if not statement.operator in EFFECTS.operators:
+        raise SelmaParseException(
+            "Operator '%s' can't be used to execute an effect"
+            % statement.operator)
+    return statement
+
+
+class SelmaStatement:
+    """A selma statement"""
+
+    def __init__(self, calling_object, line):
+        """Initializes a new SelmaStatement object by binding a
+        compiled statement (or a line, which is then compiled)
+        to the references of the parent object"""
+
+        if isinstance(line, SelmaCompiledStatement):
+            compiled = line
+        else:
+            compiled = compile_statement(line)
+        self.compiled = compiled
 
         # Get the variable name and variable holder object
-        parent_object, self.var_name = get_variable_reference(calling_object,
-                                                              matches[0])
-        self.var_holder = get_var_holder(parent_object)
+        self.scope = calling_object
+        self.var_holder, self.var_name = compiled.variable_path.resolve(
+            calling_object)
 
         # Check that the variable actually exists
         if not self.var_name in self.var_holder:
@@ -93,44 +332,37 @@ class SelmaStatement:
                 ERROR_NO_SUCH_VARIABLE % (self.var_name,
                                           self.var_holder.__class__.__name__))
 
-        self.var_type = self.var_holder[self.var_name].__class__.__name__
+        self.var_type = get_type_name(self.var_holder[self.var_name])
 
-        # Get the operator and make sure it is defined
-        self.operator = matches[1]
-        if not self.operator in OPERATOR.values():
-            raise SelmaParseException("Undefined operator '%s' in line '%s'"
-                                      % (self.operator, line))
-        # Get the argument and it's type
-        self.argument = matches[2]
-        self.argument_type = get_type_from_literal(self.argument)
+        self.operator = compiled.operator
+        self.argument = compiled.argument
+        self.argument_type = compiled.argument_type
+        self.number = compiled.number
 
+        # References can only be resolved once we know the scope
         if self.argument_type == TYPE_REF:
-            self.argument = get_value_from_reference(calling_object, self.argument)
-            self.argument_type = self.argument.__class__.__name__
+            self.argument = compiled.argument_path.get_value(calling_object)
+            self.argument_type = get_type_name(self.argument)
 
-        # If the argument is a string, we need to remove the quotes
-        elif self.argument_type == TYPE_STRING:
-            self.argument = self.argument[1:-1]
-
-        # Save the global reference name of the variable
-        self.full_var_name = matches[0]
-        if calling_object.__class__.__name__ == 'SelmaCharacter':
-            self.full_var_name = 'cast.%s.%s' % (calling_object.name,
-                                                 self.full_var_name)
-        elif calling_object.__class__.__name__ == "SelmaStorySimulation":
-            if self.full_var_name.startswith("roles"):
-
-                role_name = self.full_var_name[6:]
-                role_name = role_name[:role_name.index(".")]
+    @property
+    def full_var_name(self):
+        """The global reference name of the variable"""
+        full_var_name = self.compiled.variable_path.get_full_name(self.scope)
+        if self.var_type == TYPE_LIST:
+            full_var_name += ".%s" % self.argument
+        return full_var_name
 
-                character_name = calling_object.roles[role_name].name
-                var_name = self.var_name
-                if "var." in self.full_var_name:
-                    var_name = "var." + var_name
-                self.full_var_name = "cast.%s.%s" % (character_name, var_name)
+    def get_number(self):
+        """Returns the argument as a number"""
+        if self.number is not None:
+            return self.number
+        return parse_as_number(self.operator, self.argument)
 
-        if self.var_type == TYPE_LIST:
-            self.full_var_name += ".%s" % self.argument
+    def get_list(self):
+        """Returns the argument as a new list"""
+        if self.compiled.list_value is not None:
+            return list(self.compiled.list_value)
+        return parse_as_list(self.argument)
 
     def get_var_value(self):
         """Returns the value of the variable"""
@@ -160,272 +392,413 @@ def execute_effect(scope_object, line_string):
 
 def execute_statement(statement):
     """Execute the statement"""
-    # Do a diffent thing depending on the operator
-    if statement.operator == OPERATOR["assign-value"]:
-        if (statement.argument_type == TYPE_FLOAT or
-                statement.argument_type == TYPE_INT):
-
-            statement.set_var_to(parse_as_number(statement.operator,
-                                                 statement.argument))
-        elif (statement.var_type == TYPE_LIST and
-              statement.argument_type == TYPE_LITERAL_LIST):
-            statement.set_var_to(parse_as_list(statement.argument))
-        else:
-            statement.set_var_to(statement.argument)
-
-    elif statement.operator == OPERATOR["append"]:
-        if statement.var_type == TYPE_LIST:
-            statement.append(statement.argument)
-        else:
-            raise parse_error_wrong_type(statement.operator,
-                                         statement.var_type,
-                                         statement.var_name)
-
-    elif statement.operator == OPERATOR["append-list"]:
-        if statement.argument_type == TYPE_LITERAL_LIST:
-            list_to_append = parse_as_list(statement.argument)
-            for item in list_to_append:
-                statement.append(item)
-        elif statement.argument_type == TYPE_LIST:
-            list_to_append = statement.argument
-            for item in list_to_append:
-                statement.append(item)
-        else:
-            raise parse_error_wrong_type(statement.operator,
-                                         statement.argument,
-                                         statement.var_name)
-
-    elif statement.operator == OPERATOR["remove-from-list"]:
-        if statement.var_type == TYPE_LIST:
-            if statement.argument in statement.get_var_value():
-                statement.remove(statement.argument)
-        else:
-            raise parse_error_wrong_type(statement.operator,
-                                         statement.argument,
-                                         statement.var_name)
-
-    elif statement.operator == OPERATOR["remove-from-list-many"]:
-        if statement.var_type == TYPE_LIST:
-            list_to_remove = parse_as_list(statement.argument)
-            for item in list_to_remove:
-                if item in statement.get_var_value():
-                    statement.remove(item)
-        else:
-            raise parse_error_wrong_type(statement.operator,
-                                         statement.argument,
-                                         statement.var_name)
-
-    elif statement.operator == OPERATOR["add-to"]:
-        if statement.var_type == TYPE_STRING:
-            statement.var_holder[statement.var_name] += statement.argument
-        else:
-            statement.add(parse_as_number(statement.operator,
-                                          statement.argument))
-
-    elif statement.operator == OPERATOR["subtract-from"]:
-        statement.var_holder[statement.var_name] -= parse_as_number(statement.operator,
-                                                                    statement.argument)
-
-    elif statement.operator == OPERATOR["divide-numeric"]:
-        statement.var_holder[statement.var_name] /= parse_as_number(statement.operator,
-                                                                    statement.argument)
-
-    elif statement.operator == OPERATOR["multiply-numeric"]:
-        statement.var_holder[statement.var_name] *= parse_as_number(statement.operator,
-                                                                    statement.argument)
-    elif statement.operator == OPERATOR["print-value"]:
-        if statement.argument == "":
-            statement.argument = "$"
-        if ALLOW_PRINT_OUT:
-            print(statement.argument.replace("$", str(statement.get_var_value())))
-
-    elif statement.operator == OPERATOR["define-numeric-variable"]:
-        add_variable_to_dict(statement.get_var_value(),
-                             statement.var_name,
-                             statement.argument,
-                             default_value=0)
-
-    elif statement.operator == OPERATOR["define-list-variable"]:
-        add_variable_to_dict(statement.get_var_value(),
-                             statement.var_name,
-                             statement.argument,
-                             default_value=[])
-
-    elif statement.operator == OPERATOR["define-string-variable"]:
-        add_variable_to_dict(statement.get_var_value(),
-                             statement.var_name,
-                             statement.argument,
-                             default_value="")
-
-    elif (statement.operator == OPERATOR["define-number-on-all"] or
-          statement.operator == OPERATOR["define-string-on-all"] or
-          statement.operator == OPERATOR["define-list-on-all"]):
-
-        if statement.operator == OPERATOR["define-string-on-all"]:
-            default_value = ""
-        elif statement.operator == OPERATOR["define-list-on-all"]:
-            default_value = []
-        else:
-            default_value = 0
-
-        if statement.var_type == TYPE_LIST:
-            for item in statement.get_var_value():
-                if "var" in item.__dict__:
-                    add_variable_to_dict(item.var,
-                                         "var",
-                                         statement.argument,
-                                         default_value=default_value)
-                else:
-                    raise SelmaParseException(
-                        """Cannot create variables on %s becuase
-                        it's members has no variable field"""
-                        % statement.get_var_value())
-
-        elif statement.var_type == "dict":
-            for item_name in statement.get_var_value():
-                item = statement.get_var_value()[item_name]
-                if "var" in item.__dict__:
-                    add_variable_to_dict(item.var,
-                                         "var",
-                                         statement.argument,
-                                         default_value=default_value)
-                else:
-                    raise SelmaParseException(
-                        """Cannot create variables on %s
-                        becuase it's members has no variable field"""
-                        % statement.get_var_value())
-
-        else:
-            raise parse_error_wrong_type(statement.operator,
-                                         statement.argument,
-                                         statement.var_name)
-
-    # The operator exists but has not defintion here
-    elif statement.operator in OPERATOR.values():
-        raise SelmaParseException(
-            "Operator '%s' can't be used to execute an effect"
-            % statement.operator)
-
-    else:
-        raise SelmaParseException("Undefined operator '%s'"
-                                  % statement.operator)
+    handler = statement.compiled.get_handler(EFFECTS,
+                                             statement.var_type,
+                                             statement.argument_type)
+    handler(statement)
+
+def execute_statement_with_delta(statement):
+    """Execute the statement, and return how much it changed the variable"""
+    handler = statement.compiled.get_handler(EFFECTS,
+                                             statement.var_type,
+                                             statement.argument_type)
+    if getattr(handler, "reports_delta", False):
+        return handler(statement)
+
+    value_before = statement.var_holder[statement.var_name]
+    handler(statement)
+    return get_delta(statement, value_before)
+
+def get_delta(statement, value_before):
+    """Returns how much the variable of an executed statement changed.
+    A number which is still a number changes by the difference, and any
+    other value by 1.0 if it is no longer equal to what it was, or else
+    by 0.0"""
+    value_after = statement.var_holder[statement.var_name]
+    if statement.var_type == TYPE_FLOAT and is_number(value_after):
+        return value_after - value_before
+    if value_before == value_after:
+        return 0.0
+    return 1.0
+
+def is_number(value):
+    """Returns True if 'value' is an int or a float"""
+    return value.__class__ in (int, float)
+
+def reports_delta(handler):
+    """Marks an effect handler which returns how much it changed the
+    variable itself, so that it isn't compared before and after"""
+    handler.reports_delta = True
+    return handler
 
 def evaluate_condition(obj, line):
     """Return true if the statement in 'line' is true on object 'obj'"""
 
     statement = SelmaStatement(obj, line)
+    handler = statement.compiled.get_handler(CONDITIONS,
+                                             statement.var_type,
+                                             statement.argument_type)
+    return handler(statement)
+
+
+def effect_assign_number(statement):
+    """var = 5"""
+    statement.set_var_to(statement.get_number())
+
+def effect_assign_list(statement):
+    """var = ["a", "b"]"""
+    statement.set_var_to(statement.get_list())
+
+def effect_assign(statement):
+    """var = value"""
+    statement.set_var_to(statement.argument)
+
+# The handlers which change nothing, or only change a list or a dict in
+# place, report no change, since the variable is the same object as before
+
+@reports_delta
+def effect_append(statement):
+    """var add value"""
+    statement.append(statement.argument)
+    return 0.0
+
+@reports_delta
+def effect_append_literal_list(statement):
+    """var add-these ["a", "b"]"""
+    for item in statement.get_list():
+        statement.append(item)
+    return 0.0
+
+@reports_delta
+def effect_append_list(statement):
+    """var add-these other_list"""
+    for item in statement.argument:
+        statement.append(item)
+    return 0.0
+
+@reports_delta
+def effect_remove(statement):
+    """var remove value"""
+    if statement.argument in statement.get_var_value():
+        statement.remove(statement.argument)
+    return 0.0
+
+@reports_delta
+def effect_remove_many(statement):
+    """var remove-these ["a", "b"]"""
+    for item in statement.get_list():
+        if item in statement.get_var_value():
+            statement.remove(item)
+    return 0.0
+
+def effect_add_string(statement):
+    """var += "text" """
+    statement.var_holder[statement.var_name] += statement.argument
+
+def effect_add(statement):
+    """var += 5"""
+    statement.add(statement.get_number())
+
+def effect_subtract(statement):
+    """var -= 5"""
+    statement.var_holder[statement.var_name] -= statement.get_number()
+
+def effect_divide(statement):
+    """var /= 5"""
+    statement.var_holder[statement.var_name] /= statement.get_number()
+
+def effect_multiply(statement):
+    """var *= 5"""
+    statement.var_holder[statement.var_name] *= statement.get_number()
+
+@reports_delta
+def effect_print(statement):
+    """var print "The value is $" """
+    if statement.argument == "":
+        statement.argument = "$"
+    if ALLOW_PRINT_OUT:
+        print(statement.argument.replace("$", str(statement.get_var_value())))
+    return 0.0
+
+@reports_delta
+def effect_define_number(statement):
+    """var create-num "name" """
+    add_variable_to_dict(statement.get_var_value(),
+                         statement.var_name,
+                         statement.argument,
+                         default_value=0)
+    return 0.0
+
+@reports_delta
+def effect_define_list(statement):
+    """var create-list "name" """
+    add_variable_to_dict(statement.get_var_value(),
+                         statement.var_name,
+                         statement.argument,
+                         default_value=[])
+    return 0.0
+
+@reports_delta
+def effect_define_string(statement):
+    """var create-string "name" """
+    add_variable_to_dict(statement.get_var_value(),
+                         statement.var_name,
+                         statement.argument,
+                         default_value="")
+    return 0.0
+
+@reports_delta
+def effect_define_on_all(statement):
+    """cast create-num-all "name" """
+
+    variable_name = statement.argument
+    check_variable_name(variable_name)
+
+    if statement.var_type == TYPE_LIST:
+        items = statement.get_var_value()
+    else:
+        items = statement.get_var_value().values()
 
-    if statement.operator == OPERATOR["value-equals"]:
-        if not statement.var_name in statement.var_holder:
-            return False
-        if (statement.argument_type == TYPE_INT or
-                statement.argument_type == TYPE_FLOAT):
-            return statement.get_var_value() == parse_as_number(statement.operator,
-                                                                statement.argument)
-        if statement.var_type == TYPE_LIST:
-            return statement.get_var_value() == parse_as_list(statement.argument)
-
-        return statement.get_var_value() == statement.argument
-
-    if statement.operator == OPERATOR["value-not-equals"]:
-        if not statement.var_name in statement.var_holder:
-            return True
-        if (statement.argument_type == TYPE_INT
-                or statement.argument_type == TYPE_FLOAT):
-            return statement.get_var_value() != parse_as_number(statement.operator,
-                                                                statement.argument)
-        if statement.var_type == TYPE_LIST:
-            return statement.get_var_value() != parse_as_list(statement.argument)
-
-        return statement.get_var_value() != statement.argument
-
-    if statement.operator == OPERATOR["greater-than"]:
-        return statement.get_var_value() > parse_as_number(statement.operator,
-                                                           statement.argument)
-
-    if statement.operator == OPERATOR["lesser-than"]:
-        return statement.get_var_value() < parse_as_number(statement.operator,
-                                                           statement.argument)
-
-    if statement.operator == OPERATOR["greater-than-or-equal"]:
-        if statement.var_type == TYPE_INT or statement.var_type == TYPE_FLOAT:
-            return statement.get_var_value() >= parse_as_number(statement.operator,
-                                                                statement.argument)
-
-        parse_error_wrong_type(statement.operator,
-                               statement.argument,
-                               statement.var_name)
-
-    if statement.operator == OPERATOR["lesser-than-or-equal"]:
-        return statement.get_var_value() <= parse_as_number(statement.operator,
-                                                            statement.argument)
-
-    if statement.operator == OPERATOR["list-doesnt-contain"]:
-        if statement.var_type == TYPE_LIST:
-            return not statement.argument in statement.get_var_value()
+    # Find every 'var' dict before changing any of them
+    dictionaries = []
+    for item in items:
+        holder = get_var_holder(item)
+        if not "var" in holder:
+            raise SelmaParseException(
+                """Cannot create variables on %s becuase
+                it's members has no variable field"""
+                % statement.get_var_value())
+        check_variable_dict(holder["var"], variable_name)
+        dictionaries.append(holder["var"])
+
+    # Every member gets a list of its own
+    if statement.operator == OPERATOR["define-list-on-all"]:
+        for dictionary in dictionaries:
+            dictionary[variable_name] = []
+        return 0.0
+
+    if statement.operator == OPERATOR["define-string-on-all"]:
+        default_value = ""
+    else:
+        default_value = 0
+    for dictionary in dictionaries:
+        dictionary[variable_name] = default_value
+    return 0.0
+
+def condition_equals_number(statement):
+    """var = 5"""
+    return statement.get_var_value() == statement.get_number()
+
+def condition_equals_list(statement):
+    """var = ["a", "b"]"""
+    return statement.get_var_value() == statement.get_list()
+
+def condition_equals(statement):
+    """var = value"""
+    return statement.get_var_value() == statement.argument
+
+def condition_not_equals_number(statement):
+    """var != 5"""
+    return statement.get_var_value() != statement.get_number()
+
+def condition_not_equals_list(statement):
+    """var != ["a", "b"]"""
+    return statement.get_var_value() != statement.get_list()
+
+def condition_not_equals(statement):
+    """var != value"""
+    return statement.get_var_value() != statement.argument
+
+def condition_greater(statement):
+    """var > 5"""
+    return statement.get_var_value() > statement.get_number()
+
+def condition_less(statement):
+    """var < 5"""
+    return statement.get_var_value() < statement.get_number()
+
+def condition_greater_equal(statement):
+    """var >= 5"""
+    return statement.get_var_value() >= statement.get_number()
+
+def condition_less_equal(statement):
+    """var <= 5"""
+    return statement.get_var_value() <= statement.get_number()
+
+def condition_contains(statement):
+    """var has value"""
+    return statement.argument in statement.get_var_value()
+
+def condition_doesnt_contain(statement):
+    """var has-not value"""
+    return not statement.argument in statement.get_var_value()
+
+# Register all of the built in operators
+for number_type in (TYPE_FLOAT, TYPE_INT):
+    register_effect_operator(OPERATOR['assign-value'], effect_assign_number,
+                             argument_type=number_type)
+    register_condition_operator(EQUAL, condition_equals_number,
+                                argument_type=number_type)
+    register_condition_operator(NOT_EQUAL, condition_not_equals_number,
+                                argument_type=number_type)
+    register_condition_operator(GREATER_EQUAL, condition_greater_equal,
+                                var_type=number_type)
+
+register_effect_operator(OPERATOR['assign-value'], effect_assign_list,
+                         TYPE_LIST, TYPE_LITERAL_LIST)
+register_effect_operator(OPERATOR['assign-value'], effect_assign)
+register_effect_operator(OPERATOR['append'], effect_append, TYPE_LIST)
+register_effect_operator(OPERATOR['append-list'], effect_append_literal_list,
+                         argument_type=TYPE_LITERAL_LIST)
+register_effect_operator(OPERATOR['append-list'], effect_append_list,
+                         argument_type=TYPE_LIST)
+register_effect_operator(OPERATOR['remove-from-list'], effect_remove, TYPE_LIST)
+register_effect_operator(OPERATOR['remove-from-list-many'], effect_remove_many,
+                         TYPE_LIST)
+register_effect_operator(OPERATOR['add-to'], effect_add_string, TYPE_STRING)
+register_effect_operator(OPERATOR['add-to'], effect_add)
+register_effect_operator(OPERATOR['subtract-from'], effect_subtract)
+register_effect_operator(OPERATOR['divide-numeric'], effect_divide)
+register_effect_operator(OPERATOR['multiply-numeric'], effect_multiply)
+register_effect_operator(OPERATOR['print-value'], effect_print)
+register_effect_operator(OPERATOR['define-numeric-variable'], effect_define_number)
+register_effect_operator(OPERATOR['define-list-variable'], effect_define_list)
+register_effect_operator(OPERATOR['define-string-variable'], effect_define_string)
+
+for operator_name in ('define-number-on-all',
+                      'define-string-on-all',
+                      'define-list-on-all'):
+    for container_type in (TYPE_LIST, 'dict'):
+        register_effect_operator(OPERATOR[operator_name], effect_define_on_all,
+                                 container_type)
+
+register_condition_operator(EQUAL, condition_equals_list, TYPE_LIST)
+register_condition_operator(EQUAL, condition_equals)
+register_condition_operator(NOT_EQUAL, condition_not_equals_list, TYPE_LIST)
+register_condition_operator(NOT_EQUAL, condition_not_equals)
+register_condition_operator(GREATER, condition_greater)
+register_condition_operator(LESS, condition_less)
+register_condition_operator(LESS_EQUAL, condition_less_equal)
+register_condition_operator(OPERATOR['list-contains'], condition_contains,
+                            TYPE_LIST)
+register_condition_operator(OPERATOR['list-doesnt-contain'],
+                            condition_doesnt_contain, TYPE_LIST)
+
+EFFECTS.mark_built_in()
+CONDITIONS.mark_built_in()
+
+
+class SelmaVariablePath:
+    """A dotted reference to a variable, like 'roles.hero.var.happiness',
+    which has been split once into the steps needed to reach the variable"""
+
+    def __init__(self, path):
+        """Splits the path into steps"""
+        self.path = path
+        parts = path.split(".")
+        self.steps = tuple(parts[:-1])
+        self.var_name = parts[-1]
+
+        # Paths relative to a role are named after the character who plays
+        # the role, so that we can tell which events affected that character
+        self.role_name = None
+        self.role_var_name = None
+        if len(parts) > 2 and parts[0] == "roles":
+            self.role_name = parts[1]
+            self.role_var_name = self.var_name
+            if "var." in path:
+                self.role_var_name = "var." + self.var_name
+
+        # The keys used to tell which cards depend on this variable. The same
+        # variable on different characters share a key, since a role may be
+        # played by any character
+        self.character_key = "cast:" + path
+        if len(parts) > 2 and parts[0] in ("roles", "cast"):
+            self.global_key = "cast:" + ".".join(parts[2:])
         else:
-            parse_error_wrong_type(statement.operator,
-                                   statement.argument,
-                                   statement.var_name)
+            self.global_key = path
+
+        # A character reaches the variables of the simulation through
+        # 'world', so those paths share the keys of the simulation
+        if len(parts) > 1 and parts[0] == "world":
+            self.character_key = compile_path(".".join(parts[1:])).global_key
+
+    def get_parent(self, scope):
+        """Returns the object which holds the variable"""
+        obj = scope
+        for step in self.steps:
+            if obj.__class__ is dict:
+                holder = obj
+            else:
+                holder = get_var_holder(obj)
+            try:
+                obj = holder[step]
+            except KeyError:
+                raise SelmaParseException(
+                    ERROR_NO_SUCH_VARIABLE % (step, holder.__class__.__name__))
+        return obj
 
-    if statement.operator == OPERATOR["list-contains"]:
-        if statement.var_type == TYPE_LIST:
-            return statement.argument in statement.get_var_value()
-        else:
-            parse_error_wrong_type(statement.operator,
-                                   statement.argument,
-                                   statement.var_name)
+    def resolve(self, scope):
+        """Returns the variable holder and the name of the variable"""
+        parent = self.get_parent(scope)
+        if parent.__class__ is dict:
+            return parent, self.var_name
+        return get_var_holder(parent), self.var_name
 
-    # The operator exists but has not defintion here
-    if statement.operator in OPERATOR.values():
+    def get_value(self, scope):
+        """Returns the value of the variable"""
+        var_holder, var_name = self.resolve(scope)
+        if var_name in var_holder:
+            return var_holder[var_name]
         raise SelmaParseException(
-            "Operator '%s' can't be used to evaluate a condition"
-            % statement.operator)
-
-    raise SelmaParseException("Undefined operator '%s'" % statement.operator)
-
+            ERROR_NO_SUCH_VARIABLE % (var_name, var_holder.__class__.__name__))
+
+    def get_character(self, scope):
+        """Returns the character which holds the variable, or None if
+        the variable doesn't belong to any character"""
+        scope_type = scope.__class__.__name__
+        if scope_type == "SelmaCharacter":
+            return scope
+        if scope_type == "SelmaStorySimulation":
+            if self.role_name:
+                return scope.roles[self.role_name]
+            if len(self.steps) > 1 and self.steps[0] == "cast":
+                return scope.cast[self.steps[1]]
+        return None
+
+    def get_dependency_key(self, scope):
+        """Returns the key which identifies the variable when
+        cards are tracking what they depend on"""
+        if scope.__class__.__name__ == "SelmaCharacter":
+            return self.character_key
+        return self.global_key
+
+    def get_full_name(self, scope):
+        """Returns the global name of the variable, as seen from 'scope'"""
+        scope_type = scope.__class__.__name__
+        if scope_type == "SelmaCharacter":
+            return "cast.%s.%s" % (scope.name, self.path)
+        if scope_type == "SelmaStorySimulation" and self.role_name:
+            character_name = scope.roles[self.role_name].name
+            return "cast.%s.%s" % (character_name, self.role_var_name)
+        return self.path
+
+    def __repr__(self):
+        return "SelmaVariablePath(%r)" % self.path
+
+@functools.lru_cache(maxsize=STATEMENT_CACHE_SIZE)
+def compile_path(path):
+    """Returns the split version of a variable path"""
+    return SelmaVariablePath(path)
 
 def get_variable_reference(parent_object, string):
     """Returns a reference to the variable which a string is refering to"""
-
-    rest_string = ""
-    var_name = string
-
-    if "." in string:
-        var_name = string[:string.index(".")]
-        type_name = parent_object.__class__.__name__
-
-        var_holder = get_var_holder(parent_object)
-
-        if var_name in var_holder:
-            parent_object = var_holder[var_name]
-            var_name = string[string.index(".")+1:]
-        else:
-            raise SelmaParseException(
-                ERROR_NO_SUCH_VARIABLE % (var_name,
-                                          var_holder.__class__.__name__))
-
-        rest_string = string[string.index(".")+1:]
-
-    if "." in rest_string:
-        parent_object, var_name = get_variable_reference(parent_object,
-                                                         rest_string)
-
-    return parent_object, var_name
+    path = compile_path(string)
+    return path.get_parent(parent_object), path.var_name
 
 def get_value_from_reference(parent_object, string):
     """Returns the value from a string reference to a variable"""
-
-    parent_object, v_name = get_variable_reference(parent_object, string)
-
-    var_holder = get_var_holder(parent_object)
-
-    if v_name in var_holder:
-        return var_holder[v_name]
-    else:
-        raise SelmaParseException(
-            ERROR_NO_SUCH_VARIABLE % (v_name,
-                                      var_holder.__class__.__name__))
+    return compile_path(string).get_value(parent_object)
 
 def parse_error_wrong_type(operator, type_name, var_name):
     """Call when a line uses an invalid operator"""
@@ -478,18 +851,47 @@ def parse_as_number(operator, string):
             "operator %s must be used with a numeric value (not %s)"
             % (operator, string))
 
+def get_type_name(value):
+    """Returns the name of the type of a value, where
+    any kind of list counts as a list"""
+    if isinstance(value, list):
+        return TYPE_LIST
+    return value.__class__.__name__
+
+class SelmaVarHolder:
+    """
+    A base class for objects with __slots__, which lets statements
+    reach the slots like the keys of a dict. Objects without slots
+    hold their variables in their __dict__ instead.
+    """
+
+    __slots__ = ()
+
+    def __getitem__(self, name):
+        if not name in self.__slots__:
+            raise KeyError(name)
+        return getattr(self, name)
+
+    def __setitem__(self, name, value):
+        if not name in self.__slots__:
+            raise KeyError(name)
+        setattr(self, name, value)
+
+    def __contains__(self, name):
+        return name in self.__slots__
+
 def get_var_holder(obj):
     """Returns whichever object holds child variables."""
 
-    obj_type = obj.__class__.__name__
-
-    if obj_type == "dict":
+    if isinstance(obj, (dict, SelmaVarHolder)):
         return obj
-    elif obj.__dict__:
-        return obj.__dict__
-    else:
-        raise SelmaParseException(
-            "Object of type %s can't hold variables!" % obj_type)
+
+    var_holder = getattr(obj, "__dict__", None)
+    if var_holder:
+        return var_holder
+
+    raise SelmaParseException(
+        "Object of type %s can't hold variables!" % obj.__class__.__name__)
 
 def add_variable_to_dict(dictionary,
                          dictionary_name,
@@ -497,28 +899,36 @@ def add_variable_to_dict(dictionary,
                          default_value):
     """Adds a new entry into a variable holding dict"""
 
+    check_variable_name(variable_name)
+    check_variable_dict(dictionary, variable_name)
+
+    if dictionary_name != "var":
+        raise SelmaParseException(
+            """You can only create custom variables /
+            in the 'var' dictionaries (You tried %s)"""
+            % dictionary_name)
+
+    dictionary[variable_name] = default_value
+
+def check_variable_name(variable_name):
+    """Raises an exception if 'variable_name' can't be the name of a variable"""
+
     if not variable_name:
         raise SelmaParseException("Name of variable must be longer than 0!")
 
     is_allowed_variable_name(variable_name)
 
+    if variable_name.__class__.__name__ != TYPE_STRING:
+        raise SelmaParseException("Name of variable must be a string!")
+
+def check_variable_dict(dictionary, variable_name):
+    """Raises an exception if variables can't be created in 'dictionary'"""
     if dictionary.__class__.__name__ != "dict":
         raise SelmaParseException(
             """Can only create variables on dict type /
             objects but %s is of type '%s'"""
             % (variable_name, dictionary.__class__.__name__))
 
-    if variable_name.__class__.__name__ != TYPE_STRING:
-        raise SelmaParseException("Name of variable must be a string!")
-
-    if dictionary_name != "var":
-        raise SelmaParseException(
-            """You can only create custom variables /
-            in the 'var' dictionaries (You tried %s)"""
-            % dictionary_name)
-
-    dictionary[variable_name] = default_value
-
 
 def is_allowed_variable_name(name):
     """Returns whether name is an allowed name of a variable"""
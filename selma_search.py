@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python
+
+"""
+This is a module of 'Selma'
+by Oskar Lundqvist / Abrovinsch (c) 2017
+
+This module searches for good stories, by trying several cards at
+every step of a simulation and only continuing the most promising
+stories, instead of running the simulation blindly
+"""
+
+import selma
+import selma_parser as parser
+
+def get_causal_density(simulation, first_event_id=0):
+    """Returns how many causing events each event since
+    'first_event_id' has on average"""
+    log = simulation.past_events
+    event_count = len(log) - first_event_id
+    if event_count <= 0:
+        return 0.0
+    log.find_causes()
+    links = log.cause_offsets[len(log)] - log.cause_offsets[first_event_id]
+    return links / event_count
+
+def get_importance(simulation, first_event_id=0):
+    """Returns how important the events since 'first_event_id' are to
+    each other, which is the total weight with which they caused one
+    another, plus any importance which has been set on them"""
+    log = simulation.past_events
+    log.find_causes()
+    importance = sum(log.importance[first_event_id:])
+    for index in range(log.cause_offsets[first_event_id], len(log.cause_events)):
+        if log.cause_events[index] >= first_event_id:
+            importance += log.cause_weights[index]
+    return importance
+
+class SelmaStoryScore:
+    """
+    A scoring function for SelmaStorySearch, which rewards stories
+    where the events cause each other, and where the world ends up
+    the way the 'goals' say.
+
+    Goals are conditions on the simulation, like 'var.tension > 5'. A goal
+    which can't be evaluated, like one about a variable which doesn't
+    exist yet, counts as not reached.
+    """
+
+    def __init__(self,
+                 goals=(),
+                 goal_weight=10.0,
+                 density_weight=1.0,
+                 importance_weight=1.0):
+        """Compiles the goals, so that any errors in them are found at once"""
+        self.goals = tuple(parser.compile_condition(goal) for goal in goals)
+        self.goal_weight = goal_weight
+        self.density_weight = density_weight
+        self.importance_weight = importance_weight
+
+    def get_goals_reached(self, simulation):
+        """Returns how many of the goals are true in 'simulation'"""
+        reached = 0
+        for goal in self.goals:
+            try:
+                if goal.evaluate(simulation):
+                    reached += 1
+            except parser.SelmaParseException:
+                continue
+        return reached
+
+    def __call__(self, simulation, first_event_id):
+        return (self.goal_weight * self.get_goals_reached(simulation) +
+                self.density_weight *
+                get_causal_density(simulation, first_event_id) +
+                self.importance_weight *
+                get_importance(simulation, first_event_id))
+
+
+class SelmaStorySearch:
+    """
+    A beam search over the stories a simulation can tell.
+
+    At every step, each of the 'beam_width' best stories so far is
+    continued with up to 'expansions' different cards which could be
+    picked next, and every continuation is scored. If 'rollouts' is set,
+    each continuation is also played on at random for 'rollout_steps'
+    steps that many times, and scored by the best story reached, which
+    makes the search look further ahead than a single step.
+
+    A story is the list of the cards picked since the search started.
+    Since the simulation makes the same choices when it is in the same
+    state, replaying a story gives the same events every time. The
+    stories are expanded in sorted order, so that stories which start
+    the same way share the steps they have in common, and snapshots
+    are used to go back to where they part.
+    """
+
+    def __init__(self,
+                 simulation,
+                 score_function=None,
+                 beam_width=8,
+                 expansions=4,
+                 rollouts=0,
+                 rollout_steps=5,
+                 seed=None):
+        """
+        Initializes a search from the current state of 'simulation'.
+
+        'score_function' is called with the simulation and the id of the
+        first event of the search, and returns how good the story is,
+        where higher is better. A SelmaStoryScore is used by default.
+        'seed' seeds the choice of which cards to try.
+        """
+
+        self.simulation = simulation
+        self.score_function = score_function or SelmaStoryScore()
+        self.beam_width = beam_width
+        self.expansions = expansions
+        self.rollouts = rollouts
+        self.rollout_steps = rollout_steps
+
+        # Kept apart from the random generator of the simulation,
+        # which is part of the state that is rolled back
+        self.random = selma.SelmaRandom(seed)
+
+        self.first_event_id = len(simulation.past_events)
+        self.simulated_steps = 0
+
+        # The story the simulation is at, and a snapshot from
+        # before each of its steps and after the last one
+        self.path = []
+        self.snapshots = [simulation.snapshot()]
+
+    def run(self, steps, stop_score=None):
+        """
+        Searches for the best story of 'steps' steps, or stops as soon as
+        the score of a story itself is at least 'stop_score'. The simulation
+        is left at the end of the best story found.
+
+        Returns the (score, story score, cards) of the stories in the final
+        beam, best first. The score is what the stories are ranked by, which
+        is the best score reached by the rollouts from a story if there are
+        any, and the story score is the score of the story itself. When
+        'stop_score' is given, the stories whose own score reached it come
+        first.
+        """
+
+        score = self.score()
+        beam = [(score, score, ())]
+        for _ in range(steps):
+            if stop_score is not None and \
+                    any(branch[1] >= stop_score for branch in beam):
+                break
+
+            continuations = []
+            for _, _, path in sorted(beam, key=lambda branch: branch[2]):
+                continuations.extend(self.expand(path))
+            if not continuations:
+                break
+
+            continuations.sort(key=lambda branch: -branch[0])
+            beam = continuations[:self.beam_width]
+
+        # A story with a better rollout may not have reached the score itself
+        if stop_score is not None:
+            beam.sort(key=lambda branch: branch[1] < stop_score)
+
+        self.go_to(beam[0][2])
+        return beam
+
+    def expand(self, path):
+        """Returns the (score, story score, cards) of every story which
+        continues 'path' with one of the cards that could be picked after it"""
+
+        simulation = self.simulation
+        self.go_to(path)
+        snapshot = self.snapshots[-1]
+
+        continuations = []
+        for card_name in self.get_candidate_cards():
+            simulation.restore(snapshot)
+            if not simulation.play_card(card_name):
+                continue
+            self.simulated_steps += 1
+            continuations.append(self.score_with_rollouts() +
+                                 (path + (card_name,),))
+
+        simulation.restore(snapshot)
+        return continuations
+
+    def get_candidate_cards(self):
+        """Returns up to 'expansions' different cards which could be
+        picked next, starting with the ones in the draw deck"""
+
+        simulation = self.simulation
+        simulation.run_start_card()
+
+        cards = []
+        for card_name in simulation.draw_deck:
+            if len(cards) >= self.expansions:
+                return cards
+            if card_name != "#" and not card_name in cards and \
+                    simulation.eligibility.is_eligible(card_name):
+                cards.append(card_name)
+
+        # The rest are drawn from the whole deck, weighted like in a step
+        simulation.eligibility.refresh()
+        while len(cards) < self.expansions:
+            card_name = simulation.card_table.draw(self.random.random(), cards)
+            if card_name is None:
+                break
+            cards.append(card_name)
+        return cards
+
+    def score(self):
+        """Returns the score of the story the simulation is at"""
+        return self.score_function(self.simulation, self.first_event_id)
+
+    def score_with_rollouts(self):
+        """Returns the best score of the story the simulation is at and of
+        the stories reached by playing on at random from it, and the score
+        of the story itself"""
+
+        story_score = self.score()
+        best_score = story_score
+        if not self.rollouts:
+            return best_score, story_score
+
+        simulation = self.simulation
+        snapshot = simulation.snapshot()
+        for _ in range(self.rollouts):
+            simulation.random.seed(self.random.getrandbits(64))
+            try:
+                for _ in range(self.rollout_steps):
+                    simulation.sim_step()
+                    self.simulated_steps += 1
+            except selma.SelmaException:
+                # The story can't go on, so it is scored as it is
+                pass
+            best_score = max(best_score, self.score())
+            simulation.restore(snapshot)
+        return best_score, story_score
+
+    def go_to(self, path):
+        """Puts the simulation at the end of the story 'path', by going back
+        to where it parts from the current story and replaying the rest"""
+
+        simulation = self.simulation
+        common = 0
+        while (common < len(self.path) and common < len(path) and
+               self.path[common] == path[common]):
+            common += 1
+
+        simulation.restore(self.snapshots[common])
+        del self.snapshots[common + 1:]
+        del self.path[common:]
+
+        for card_name in path[common:]:
+            if not simulation.play_card(card_name):
+                raise selma.SelmaException(
+                    "The story %s can't be replayed" % (path,))
+            self.simulated_steps += 1
+            self.path.append(card_name)
+            self.snapshots.append(simulation.snapshot())
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+
+"""Makes the modules of 'Selma' importable from the tests, and
+holds the fixtures which the tests share"""
+
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import selma
+
+@pytest.fixture
+def load_simulation(tmp_path):
+    """Returns a function which writes a deck to a file and returns
+    a quiet simulation loaded from it, without the deck cache"""
+
+    def load(text, seed=1):
+        path = tmp_path / "deck.selma"
+        path.write_text(text)
+        simulation = selma.SelmaStorySimulation(debug_mode=False,
+                                                allow_output=False,
+                                                seed=seed)
+        simulation.load_from_file(str(path), use_cache=False)
+        return simulation
+
+    return load
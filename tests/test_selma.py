@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+
+"""Tests of the simulation in selma.py"""
+
+import pytest
+import selma
+
+# 'nxt' and 'other' can always be drawn, the 18 'filler' cards never can
+DRAW_DECK = """
+card "start" {
+    effects (
+        var create-num "x"
+    )
+}
+card "nxt" {
+}
+card "other" {
+}
+""" + "".join("""
+card "filler%d" {
+    conditions (
+        var.x > 100
+    )
+}
+""" % number for number in range(18))
+
+def test_draw_deck_slots_are_weighted_like_repeated_draws(load_simulation):
+    simulation = load_simulation(DRAW_DECK)
+    simulation.run_start_card()
+    for card_name in ("nxt", "#", "#", "#", "#"):
+        simulation.draw_deck.append(card_name)
+    snapshot = simulation.snapshot()
+
+    # Drawing slots until a card can be picked favours 'nxt' with
+    # 20 / 28 for its slot and half of 8 / 28 for the wildcards
+    trials = 3000
+    picked = 0
+    for seed in range(trials):
+        simulation.restore(snapshot)
+        simulation.random.seed(seed)
+        simulation.sim_step()
+        if simulation.past_events[-1].event_name == "nxt":
+            picked += 1
+    assert abs(picked / trials - 24 / 28) < 0.03
+
+def test_empty_draw_deck_is_an_error(load_simulation):
+    simulation = load_simulation(DRAW_DECK)
+    simulation.draw_deck_size = 0
+    with pytest.raises(selma.SelmaException):
+        simulation.sim_step()
+
+WORLD_DECK = """
+card "start" {
+    effects (
+        var create-num "danger"
+    )
+}
+card "rise" {
+    effects (
+        var.danger += 1
+    )
+}
+card "flee" {
+    role "r" (
+        world.var.danger > 2
+    )
+    effects (
+        var.danger -= 3
+    )
+}
+char "Anna" {
+}
+"""
+
+def test_role_reading_the_world_is_tested_again(load_simulation):
+    # Testing every card before every draw, like the simulation did
+    # before it tracked what the cards read, must give the same stories
+    counts = {}
+    tracked_counts = {}
+    for seed in range(20):
+        simulation = load_simulation(WORLD_DECK, seed)
+        tracked = load_simulation(WORLD_DECK, seed)
+        for _ in range(25):
+            simulation.eligibility.mark_all_dirty()
+            simulation.sim_step()
+            tracked.sim_step()
+        for event in simulation.past_events:
+            counts[event.event_name] = counts.get(event.event_name, 0) + 1
+        for event in tracked.past_events:
+            tracked_counts[event.event_name] = \
+                tracked_counts.get(event.event_name, 0) + 1
+
+    assert counts["flee"] > 50
+    assert tracked_counts == counts
+
+def test_number_variable_can_be_given_another_type(load_simulation):
+    simulation = load_simulation("""
+char "Anna" {
+    init (
+        var create-num "x"
+        var.x = 1.5
+        var.x = "tired"
+    )
+}
+card "start" {
+    effects (
+        var create-num "y"
+        var.y = 2
+        var.y = "high"
+    )
+}
+card "rest" {
+    effects (
+        roles.a.var.x = 1
+        var.y = 3
+    )
+    role "a" (
+        var.x = "tired"
+    )
+}
+""")
+    assert simulation.cast["Anna"].var["x"] == "tired"
+
+    simulation.sim_step()
+    assert simulation.var["y"] == 3
+    assert simulation.past_events[-1].values_modified == {
+        "cast.Anna.var.x": 1.0, "var.y": 1.0}
+
+def test_token_list_holds_items_which_cant_be_hashed(load_simulation):
+    simulation = load_simulation("""
+char "Bob" {
+    init (
+        var create-list "bag"
+    )
+    attributes (
+%s
+    )
+}
+""" % "\n".join("        %s" % item for item in "abcdefghi"))
+    bob = simulation.cast["Bob"]
+    assert "i" in bob.attributes
+
+    simulation.execute_effect("cast.Bob.attributes add cast.Bob.var.bag")
+    assert bob.attributes[-1] is bob.var["bag"]
+    assert [] in bob.attributes
+    assert "a" in bob.attributes and not "z" in bob.attributes
+
+    bob.attributes.remove([])
+    bob.attributes.append("z")
+    assert "z" in bob.attributes
+
+def test_token_list_counts_follow_changes():
+    items = selma.SelmaTokenList("abcdefghij")
+    assert "j" in items
+    items.append("k")
+    items.insert(0, "k")
+    items.remove("a")
+    items.pop()
+    del items[0]
+    assert [item in items for item in "abjkz"] == \
+        [item in list(items) for item in "abjkz"]
+    assert not "a" in items and "j" in items and not "k" in items
+
+CAST_DECK = """
+card "start" {
+    effects (
+        cast create-num-all "happiness"
+        cast create-string-all "mood"
+    )
+}
+card "happy" {
+    role "a" (
+        var.happiness >= 3
+    )
+}
+""" + "".join("""
+char "c%d" {
+    init (
+        var create-num "luck"
+        var.luck = %d
+    )
+}
+""" % (number, number % 4) for number in range(40))
+
+def get_role_candidates(simulation, card_name):
+    """Returns the names of the characters the cast index finds for the
+    only role of a card, after testing the remaining conditions"""
+    _, conditions = simulation.event_cards[card_name].compiled_roles[0]
+    candidates, remaining = simulation.cast_index.get_candidates(conditions)
+    return [character.name for character in candidates
+            if all(condition.evaluate(character) for condition in remaining)]
+
+def test_cast_variable_is_updated_in_one_batch(load_simulation):
+    simulation = load_simulation(CAST_DECK)
+    simulation.run_start_card()
+    assert get_role_candidates(simulation, "happy") == []
+
+    snapshot = simulation.snapshot()
+    simulation.update_cast_variable("happiness", "+=", 2)
+    simulation.update_cast_variable("happiness", "+=", 1.5,
+                                    ["c%d" % number for number in range(0, 40, 3)])
+    expected = ["c%d" % number for number in range(0, 40, 3)]
+    assert get_role_candidates(simulation, "happy") == expected
+    assert simulation.eligibility.is_eligible("happy")
+
+    simulation.update_cast_variable("luck", "*=", 2)
+    assert [simulation.cast["c%d" % number].var["luck"]
+            for number in range(5)] == [0, 2, 4, 6, 0]
+
+    simulation.restore(snapshot)
+    assert get_role_candidates(simulation, "happy") == []
+    assert not simulation.eligibility.is_eligible("happy")
+    assert simulation.cast["c3"].var == {"luck": 3, "happiness": 0, "mood": ""}
+
+def test_cast_variable_update_changes_nothing_on_errors(load_simulation):
+    simulation = load_simulation(CAST_DECK)
+    simulation.run_start_card()
+    for arguments in (("mood", "+=", 1), ("luck", "/=", 0),
+                      ("luck", "has", 1), ("luck", "+=", "1")):
+        with pytest.raises(selma.SelmaException):
+            simulation.update_cast_variable(*arguments)
+    assert all(character.var["luck"] == number % 4 for number, character
+               in enumerate(simulation.cast.values()))
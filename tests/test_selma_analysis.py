@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+"""Tests of the analysis of decks in selma_analysis.py, and
+of the goals which the simulation aims for with it"""
+
+import pytest
+import selma
+
+DECK = """
+card "start" {
+    effects (
+        var create-num "a"
+        var create-num "b"
+        var create-num "danger"
+    )
+}
+card "one" {
+    effects (
+        var.a += 1
+    )
+}
+card "two" {
+    conditions (
+        var.a > 0
+    )
+    effects (
+        var.b += 1
+    )
+}
+card "goal" {
+    conditions (
+        var.b > 0
+    )
+}
+card "lead" {
+    next (
+        "goal"
+    )
+}
+card "rise" {
+    effects (
+        var.danger += 1
+    )
+}
+card "flee" {
+    role "r" (
+        world.var.danger > 2
+    )
+}
+card "idle" {
+}
+char "Anna" {
+}
+"""
+
+def get_biases(simulation):
+    """Returns the bias of every card in the card table"""
+    card_table = simulation.card_table
+    return {card_name: card_table.biases[card_table.ids[card_name]]
+            for card_name in simulation.event_cards}
+
+def test_distances_to_a_card_and_to_conditions(load_simulation):
+    analysis = load_simulation(DECK).analysis
+
+    assert analysis.get_distances("goal") == {
+        "goal": 0, "two": 1, "lead": 1, "start": 1, "one": 2}
+    assert analysis.get_distances(conditions=["var.b > 0"]) == {
+        "two": 1, "start": 1, "one": 2}
+
+    # A role reads the variables of the simulation through 'world'
+    assert analysis.get_distances("flee") == {
+        "flee": 0, "rise": 1, "start": 1}
+
+def test_goal_biases_the_cards_leading_to_it(load_simulation):
+    simulation = load_simulation(DECK)
+
+    simulation.set_goal("goal", strength=2)
+    biases = get_biases(simulation)
+    assert biases["goal"] == 2 ** 17
+    assert biases["two"] == biases["lead"] == 2 ** 16
+    assert biases["one"] == 2 ** 15
+    assert biases["idle"] == biases["rise"] == biases["flee"] == 1
+    assert simulation.card_table.deck_total == sum(biases.values())
+
+    simulation.clear_goal()
+    assert set(get_biases(simulation).values()) == {1}
+    assert simulation.card_table.deck_total == len(simulation.event_cards)
+
+@pytest.mark.parametrize("strength", [1.5, 0, -2, True, "2"])
+def test_goal_strength_must_be_a_whole_number(load_simulation, strength):
+    simulation = load_simulation(DECK)
+    with pytest.raises(selma.SelmaException):
+        simulation.set_goal("goal", strength=strength)
+    assert set(get_biases(simulation).values()) == {1}
+
+def test_goal_must_be_a_card_in_the_deck(load_simulation):
+    simulation = load_simulation(DECK)
+    with pytest.raises(selma.SelmaException):
+        simulation.set_goal("nothing")
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+
+"""Tests of running batches of simulations in selma_batch.py"""
+
+from selma_batch import get_story, run_batch
+
+DECK = """
+card "start" {
+    effects (
+        var create-num "tension"
+        cast create-num-all "happiness"
+    )
+}
+card "meet" {
+    role "a" (
+        var.happiness >= 0
+    )
+    effects (
+        roles.a.var.happiness += 1
+        var.tension += 1
+    )
+}
+card "fight" {
+    conditions (
+        var.tension > 1
+    )
+    role "x" (
+        var.happiness > 1
+    )
+    effects (
+        roles.x.var.happiness -= 2
+        var.tension -= 2
+    )
+}
+card "rest" {
+}
+char "Anna" {
+}
+char "Bob" {
+}
+char "Cleo" {
+}
+"""
+
+def test_batch_is_the_same_every_time_and_runs_can_be_replayed(
+        load_simulation, tmp_path, monkeypatch):
+    monkeypatch.setenv("SELMA_CACHE_DIR", str(tmp_path / "cache"))
+    path = tmp_path / "deck.selma"
+    path.write_text(DECK)
+
+    first = sorted(run_batch(str(path), runs=6, steps=20, seed=7, processes=2))
+    second = sorted(run_batch(str(path), runs=6, steps=20, seed=7, processes=3))
+    assert [run_index for run_index, _, _ in first] == list(range(6))
+    assert first == second
+    assert len(set(run_seed for _, run_seed, _ in first)) == 6
+    assert len(set(tuple(story) for _, _, story in first)) > 1
+
+    # A run is replayed by a simulation seeded with its run_seed
+    _, run_seed, story = first[4]
+    assert len(story) == 20
+    simulation = load_simulation(DECK, run_seed)
+    for _ in range(20):
+        simulation.sim_step()
+    assert get_story(simulation) == story
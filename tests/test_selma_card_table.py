@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+"""Tests of the Fenwick tree of card weights in selma_card_table.py"""
+
+import random
+from selma_card_table import SelmaCardTable
+
+def draw_by_scan(weights, enabled, biases, random_float, excluded=()):
+    """Draws a card by adding up the weights one card at a time"""
+    drawable = [(card_name, weights[card_name] * biases[card_name])
+                for card_name in weights
+                if enabled[card_name] and card_name not in excluded]
+    total = sum(weight for _, weight in drawable)
+    if total <= 0:
+        return None
+    target = random_float * total
+    for card_name, weight in drawable:
+        if target < weight:
+            return card_name
+        target -= weight
+
+def test_table_draws_like_a_scan_of_the_weights():
+    rng = random.Random(5)
+    table = SelmaCardTable()
+    weights, enabled, biases = {}, {}, {}
+
+    for _ in range(3000):
+        operation = rng.random()
+        card_name = "card%d" % rng.randrange(40)
+        if operation < 0.3:
+            amount = rng.randrange(5)
+            table.add(card_name, amount)
+            weights[card_name] = amount
+            enabled.setdefault(card_name, False)
+            biases.setdefault(card_name, 1)
+        elif card_name not in weights:
+            continue
+        elif operation < 0.5:
+            if weights[card_name]:
+                table.remove(card_name)
+                weights[card_name] -= 1
+        elif operation < 0.75:
+            table.set_enabled(card_name, not enabled[card_name])
+            enabled[card_name] = not enabled[card_name]
+        else:
+            bias = rng.randrange(1, 4)
+            table.set_bias(card_name, bias)
+            biases[card_name] = bias
+
+        excluded = rng.sample(sorted(weights), min(len(weights), 3))
+        random_float = rng.random()
+        assert table.draw(random_float) == \
+            draw_by_scan(weights, enabled, biases, random_float)
+        assert table.draw(random_float, excluded) == \
+            draw_by_scan(weights, enabled, biases, random_float, excluded)
+
+        assert table.deck_total == \
+            sum(weights[name] * biases[name] for name in weights)
+        assert table.get_drawable_total(excluded) == \
+            sum(weights[name] * biases[name] for name in weights
+                if enabled[name] and name not in excluded)
+        assert table.total == table.get_drawable_total()
+
+    # Every whole target lands on the edge between two cards
+    total = table.get_drawable_total()
+    for target in range(total):
+        assert table.draw(target / total) == \
+            draw_by_scan(weights, enabled, biases, target / total)
+
+    assert sorted(table.get_all_names()) == \
+        sorted(name for name in weights for _ in range(weights[name]))
+    for card_name in weights:
+        assert table.get_weight(card_name) == weights[card_name]
+        assert (card_name in table) == (weights[card_name] > 0)
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+"""Tests of the cast index in selma_cast_index.py"""
+
+import random
+import selma_parser as parser
+from selma_cast_index import HAS_NUMPY, SelmaCastIndex
+
+ATTRIBUTES = ("brave", "kind", "sly", "old")
+MOODS = ("sad", "glad", "calm")
+
+def make_deck(rng, size):
+    """Returns the text of a deck with a random cast"""
+    text = ""
+    for number in range(size):
+        text += """
+char "c%d" {
+    init (
+        var create-num "happiness"
+        var.happiness = %s
+        var create-string "mood"
+        var.mood = "%s"
+    )
+    attributes (
+%s
+    )
+}
+""" % (number, rng.choice((0, 1, 2.5, 3, 7, -1)), rng.choice(MOODS),
+       "\n".join(rng.sample(ATTRIBUTES, rng.randint(0, 3))))
+    return text
+
+def random_condition(rng):
+    """Returns a random role condition"""
+    kind = rng.randrange(3)
+    if kind == 0:
+        return "var.happiness %s %s" % (
+            rng.choice(("=", "!=", ">", "<", ">=", "<=")),
+            rng.choice((0, 1, 2.5, 3, 5)))
+    if kind == 1:
+        return 'var.mood %s "%s"' % (rng.choice(("=", "!=")), rng.choice(MOODS))
+    return 'attributes %s "%s"' % (rng.choice(("has", "has-not")),
+                                   rng.choice(ATTRIBUTES))
+
+def get_names(index, conditions):
+    """Returns the names of the characters fullfilling 'conditions',
+    found with 'index'"""
+    candidates, remaining = index.get_candidates(conditions)
+    return [character.name for character in candidates
+            if all(condition.evaluate(character) for condition in remaining)]
+
+def test_numpy_and_set_index_find_the_same_candidates(load_simulation):
+    rng = random.Random(0)
+    simulation = load_simulation(make_deck(rng, 60))
+
+    for _ in range(5):
+        indexes = [simulation.cast_index,
+                   SelmaCastIndex(simulation.cast, use_numpy=False)]
+        if HAS_NUMPY:
+            indexes.append(SelmaCastIndex(simulation.cast, use_numpy=True))
+        for index in indexes[1:]:
+            index.rebuild()
+
+        for _ in range(200):
+            conditions = [parser.compile_condition(random_condition(rng))
+                          for _ in range(rng.randint(1, 3))]
+            expected = [name for name, character in simulation.cast.items()
+                        if all(condition.evaluate(character)
+                               for condition in conditions)]
+            for index in indexes:
+                assert get_names(index, conditions) == expected, \
+                    [condition.line for condition in conditions]
+
+        # The index of the simulation follows changes made by effects
+        simulation.update_cast_variable("happiness", rng.choice(("+=", "*=")),
+                                        rng.choice((1, -1, 0.5)),
+                                        rng.sample(list(simulation.cast), 20))
+        for name in rng.sample(list(simulation.cast), 10):
+            simulation.execute_effect("cast.%s.var.happiness += %s"
+                                      % (name, rng.choice((1, -2, 0.5))))
+            simulation.execute_effect('cast.%s.attributes add "%s"'
+                                      % (name, rng.choice(ATTRIBUTES)))
+
+def test_index_leaves_operators_which_were_replaced_to_the_handlers(
+        load_simulation, monkeypatch):
+    monkeypatch.setattr(parser.CONDITIONS, "handlers",
+                        parser.CONDITIONS.handlers.copy())
+    monkeypatch.setattr(parser.SelmaOperatorRegistry, "generation",
+                        parser.SelmaOperatorRegistry.generation)
+    simulation = load_simulation(make_deck(random.Random(1), 20))
+
+    indexes = [simulation.cast_index,
+               SelmaCastIndex(simulation.cast, use_numpy=False)]
+    if HAS_NUMPY:
+        indexes.append(SelmaCastIndex(simulation.cast, use_numpy=True))
+    for index in indexes[1:]:
+        index.rebuild()
+
+    lines = ("var.happiness > 100", 'var.mood = "angry"',
+             'attributes has "young"')
+    for line in lines:
+        assert get_names(indexes[0], [parser.compile_condition(line)]) == []
+
+    parser.register_condition_operator(">", lambda statement: True)
+    parser.register_condition_operator("=", lambda statement: True)
+    parser.register_condition_operator("has", lambda statement: True,
+                                       parser.TYPE_LIST)
+    for line in lines:
+        condition = parser.compile_condition(line)
+        for index in indexes:
+            assert get_names(index, [condition]) == list(simulation.cast)
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+"""Tests of the cache of loaded decks in selma_deck_cache.py"""
+
+import os
+import pickle
+import pytest
+import selma
+import selma_deck_cache
+
+DECK = """
+card "start" {
+    effects (
+        var create-num "tension"
+    )
+}
+card "rise" {
+    effects (
+        var.tension += 1
+    )
+}
+"""
+
+class SelmaPayload:
+    """Creates a file when it is unpickled"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def __reduce__(self):
+        return open, (self.path, "w")
+
+@pytest.fixture
+def deck_path(tmp_path, monkeypatch):
+    monkeypatch.setenv("SELMA_CACHE_DIR", str(tmp_path / "cache"))
+    path = tmp_path / "deck.selma"
+    path.write_text(DECK)
+    return str(path)
+
+def new_simulation():
+    return selma.SelmaStorySimulation(debug_mode=False, allow_output=False)
+
+def test_cache_is_written_to_the_cache_directory(deck_path, tmp_path):
+    new_simulation().load_from_file(deck_path)
+
+    cache_path = selma_deck_cache.get_cache_path(deck_path)
+    assert os.path.dirname(cache_path) == str(tmp_path / "cache")
+    assert os.path.exists(cache_path)
+    assert not os.path.exists(os.path.splitext(deck_path)[0] + ".selmac")
+
+    simulation = new_simulation()
+    assert selma_deck_cache.load_cache(simulation, deck_path)
+    assert set(simulation.event_cards) == {"start", "rise"}
+
+def test_cache_next_to_the_deck_is_never_loaded(deck_path, tmp_path):
+    marker = tmp_path / "unpickled"
+    with open(os.path.splitext(deck_path)[0] + ".selmac", "wb") as cache_file:
+        pickle.dump(SelmaPayload(str(marker)), cache_file)
+
+    new_simulation().load_from_file(deck_path)
+    assert not marker.exists()
+
+def test_cache_which_is_not_signed_is_not_loaded(deck_path, tmp_path):
+    new_simulation().load_from_file(deck_path)
+    cache_path = selma_deck_cache.get_cache_path(deck_path)
+    with open(cache_path, "rb") as cache_file:
+        digest = cache_file.read(selma_deck_cache.DIGEST_SIZE)
+
+    # A cache file with the signature of another file is rejected
+    marker = tmp_path / "unpickled"
+    with open(cache_path, "wb") as cache_file:
+        cache_file.write(digest)
+        pickle.dump(SelmaPayload(str(marker)), cache_file)
+
+    simulation = new_simulation()
+    assert not selma_deck_cache.load_cache(simulation, deck_path)
+    assert not marker.exists()
+
+    simulation.load_from_file(deck_path)
+    assert set(simulation.event_cards) == {"start", "rise"}
+    assert selma_deck_cache.load_cache(new_simulation(), deck_path)
+
+def test_key_is_only_readable_by_the_user(deck_path, tmp_path):
+    new_simulation().load_from_file(deck_path)
+    key_path = tmp_path / "cache" / selma_deck_cache.KEY_NAME
+    assert len(key_path.read_bytes()) == selma_deck_cache.KEY_SIZE
+    assert os.stat(key_path).st_mode & 0o077 == 0
+
+def test_cached_load_keeps_the_settings_of_the_caller(deck_path, monkeypatch):
+    new_simulation().load_from_file(deck_path)
+
+    # The file itself must not be read again
+    def fail(*_):
+        raise AssertionError("The cache was not used")
+    monkeypatch.setattr(selma.selma_file_reader, "load_selma_file", fail)
+
+    simulation = new_simulation()
+    simulation.draw_deck_size = 2
+    simulation.attributes.append("night")
+    simulation.load_from_file(deck_path)
+    assert simulation.draw_deck_size == 2
+    assert simulation.attributes == ["night"]
+    assert set(simulation.event_cards) == {"start", "rise"}
+
+    simulation.sim_step()
+    assert len(simulation.draw_deck) <= 2
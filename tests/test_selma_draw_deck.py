@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+
+"""Tests of the draw deck in selma_draw_deck.py"""
+
+import random
+import pytest
+from selma_draw_deck import SelmaDrawDeck
+
+def assert_same_cards(deck, cards):
+    """Asserts that 'deck' holds the cards of the list 'cards'"""
+    assert list(deck) == cards
+    assert len(deck) == len(cards)
+    assert sorted(deck[index] for index in range(len(deck))) == sorted(cards)
+    for card_name in ("#", "a", "b", "c", "d", "e"):
+        assert (card_name in deck) == (card_name in cards)
+
+def test_deck_works_like_a_list():
+    rng = random.Random(3)
+    deck = SelmaDrawDeck()
+    cards = []
+    copies = []
+
+    for _ in range(5000):
+        operation = rng.random()
+        card_name = rng.choice(("#", "a", "b", "c", "d", "e"))
+        if operation < 0.5:
+            deck.append(card_name)
+            cards.append(card_name)
+        elif operation < 0.75:
+            if card_name in cards:
+                deck.remove(card_name)
+                cards.remove(card_name)
+            else:
+                with pytest.raises(ValueError):
+                    deck.remove(card_name)
+        elif operation < 0.95:
+            if cards:
+                deck.remove_oldest()
+                del cards[0]
+        else:
+            copies.append((deck.copy(), list(cards)))
+        assert_same_cards(deck, cards)
+
+    # A copy keeps its cards while the deck it was copied from changes
+    for copied_deck, copied_cards in copies:
+        assert_same_cards(copied_deck, copied_cards)
+        copied_deck.append("a")
+        copied_deck.remove_oldest()
+        assert_same_cards(copied_deck, (copied_cards + ["a"])[1:])
+    assert_same_cards(deck, cards)
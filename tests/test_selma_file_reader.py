@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+
+"""Tests of the .selma file parser in selma_file_reader.py"""
+
+import io
+import os
+import pytest
+import selma
+import selma_file_reader
+from selma_file_reader import SelmaFileParser
+from selma_parser import SelmaParseException
+
+DECK = """// A deck with a bit of everything
+include "other.selma"
+
+/* a block comment
+   over several lines */
+card "start" {
+    effects (
+        var create-num "tension"   // a comment after a line
+        var create-string "weather"
+        var.weather = "very  sunny  day"
+    )
+    next (
+        "meet"
+    )
+}
+
+card "meet" {
+    conditions (
+        var.tension >= 0
+    )
+    role "a" (
+        attributes has "brave"
+    )
+    role "b" (
+        var.happiness   >   2
+    )
+    effects (
+        roles.a.var.happiness += 2
+        var.tension += 1
+    )
+}
+
+char "Anna" {
+    init (
+        var create-num "happiness"
+    )
+    attributes (
+        brave
+        /* not an attribute */ kind
+    )
+    inventory (
+        sword
+    )
+}
+"""
+
+def parse(text, chunk_size):
+    parser = SelmaFileParser(io.StringIO(text), "deck.selma", chunk_size)
+    return list(parser.definitions())
+
+def test_every_chunk_size_gives_the_same_definitions():
+    expected = parse(DECK, 1 << 20)
+    assert [definition[1] for definition in expected] == \
+        ["other.selma", "start", "meet", "Anna"]
+    for chunk_size in range(1, 41):
+        assert parse(DECK, chunk_size) == expected, chunk_size
+
+def test_every_chunk_size_reports_the_same_error_location():
+    text = DECK + '\ncard "broken" {\n    effects (\n        var.x += 1\n'
+    for chunk_size in (1, 2, 3, 7, 16, 40, 1 << 20):
+        with pytest.raises(SelmaParseException) as error:
+            parse(text, chunk_size)
+        assert str(error.value).startswith("deck.selma, line 47, column 13"), \
+            (chunk_size, str(error.value))
+
+def write_files(directory, files):
+    """Writes every file in the dict 'files' of file name -> text"""
+    for file_name, text in files.items():
+        (directory / file_name).write_text(text)
+
+def load(path):
+    """Returns a quiet simulation of the deck at 'path', and the
+    files that were read when it was loaded"""
+    simulation = selma.SelmaStorySimulation(debug_mode=False,
+                                            allow_output=False)
+    return simulation, selma_file_reader.load_selma_file(simulation, str(path))
+
+def test_circular_include_is_an_error(tmp_path):
+    write_files(tmp_path, {
+        "main.selma": 'include "a.selma"\n',
+        "a.selma": 'include "b.selma"\ncard "a" {\n}\n',
+        "b.selma": 'card "b" {\n}\ninclude "a.selma"\n'})
+    with pytest.raises(SelmaParseException) as error:
+        load(tmp_path / "main.selma")
+    assert "Circular include of 'a.selma'" in str(error.value)
+    assert str(error.value).startswith(str(tmp_path / "b.selma"))
+
+    # A file including itself is circular too
+    write_files(tmp_path, {"self.selma": 'include "self.selma"\n'})
+    with pytest.raises(SelmaParseException):
+        load(tmp_path / "self.selma")
+
+def test_file_included_twice_is_loaded_once(tmp_path):
+    write_files(tmp_path, {
+        "main.selma": 'include "a.selma"\ninclude "b.selma"\n',
+        "a.selma": 'include "common.selma"\ncard "a" {\n}\n',
+        "b.selma": 'include "./common.selma"\ncard "b" {\n}\n',
+        "common.selma": 'char "Anna" {\n}\n'})
+    simulation, files_read = load(tmp_path / "main.selma")
+
+    assert [os.path.basename(path) for path, _, _ in files_read] == \
+        ["main.selma", "a.selma", "common.selma", "b.selma"]
+    assert set(simulation.event_cards) == {"a", "b"}
+    assert list(simulation.cast) == ["Anna"]
+    assert len(simulation.cast_index.characters) == 1
+
+def test_included_file_is_parsed_again_once_it_changes(tmp_path):
+    write_files(tmp_path, {
+        "main.selma": 'include "cards.selma"\n',
+        "cards.selma": 'card "old" {\n}\n'})
+    cards_path = str(tmp_path / "cards.selma")
+
+    simulation, _ = load(tmp_path / "main.selma")
+    assert set(simulation.event_cards) == {"old"}
+    definitions = selma_file_reader.parsed_files[cards_path][0]
+
+    # An unchanged file is not parsed again
+    simulation, _ = load(tmp_path / "main.selma")
+    assert selma_file_reader.parsed_files[cards_path][0] is definitions
+
+    # A file of the same size is parsed again when its mtime changes
+    write_files(tmp_path, {"cards.selma": 'card "new" {\n}\n'})
+    stat = os.stat(cards_path)
+    os.utime(cards_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    simulation, _ = load(tmp_path / "main.selma")
+    assert set(simulation.event_cards) == {"new"}
+    assert selma_file_reader.parsed_files[cards_path][0] is not definitions
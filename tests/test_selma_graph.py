@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+"""Tests of the causal graph of the events in selma_graph.py"""
+
+import pytest
+from selma_graph import SelmaCausalGraph
+
+DECK = """
+card "start" {
+    effects (
+        var create-num "tension"
+    )
+}
+card "rise" {
+    effects (
+        var.tension += 1
+    )
+}
+card "fight" {
+    conditions (
+        var.tension > 1
+    )
+    effects (
+        var.tension -= 2
+    )
+}
+card "rest" {
+}
+"""
+
+def get_importance(events):
+    """Returns the importance of every event, worked out from the
+    causes of each event by following every chain of events it caused"""
+    caused = [[] for _ in events]
+    for event_id, event in enumerate(events):
+        for cause, weight in event.causing_events:
+            caused[cause.event_id].append((event_id, weight))
+
+    importance = {}
+    def get(event_id):
+        if not event_id in importance:
+            importance[event_id] = 1.0 + sum(weight * get(caused_id)
+                                             for caused_id, weight
+                                             in caused[event_id])
+        return importance[event_id]
+    return [get(event_id) for event_id in range(len(events))]
+
+def test_importance_pruning_and_edges_of_a_seeded_run(load_simulation, tmp_path):
+    simulation = load_simulation(DECK, seed=3)
+    for _ in range(40):
+        simulation.sim_step()
+    events = simulation.past_events
+    graph = SelmaCausalGraph(events)
+
+    edges = [(cause.event_id, event_id, weight)
+             for event_id, event in enumerate(events)
+             for cause, weight in event.causing_events]
+    importance = get_importance(events)
+    assert len(graph) == 40
+    assert len(edges) > 10
+    assert max(importance) > 2
+    assert list(events.importance) == pytest.approx(importance)
+
+    # The most important events, with ties kept in the order they happened
+    by_importance = sorted(range(len(events)),
+                           key=lambda event_id: -importance[event_id])
+    kept = graph.prune(count=5)
+    assert list(kept) == sorted(by_importance[:5])
+    threshold = sorted(importance)[-10]
+    assert list(graph.prune(threshold=threshold)) == \
+        [event_id for event_id in range(len(events))
+         if importance[event_id] >= threshold]
+
+    path = tmp_path / "edges.txt"
+    assert graph.export_edges(str(path)) == len(edges)
+    assert [line.split() for line in path.read_text().splitlines()] == \
+        [["%d" % cause_id, "%d" % event_id, "%.6g" % weight]
+         for cause_id, event_id, weight in edges]
+    assert list(graph.get_edges(kept)) == \
+        [edge for edge in edges if edge[0] in kept and edge[1] in kept]
+
+    # New events make the events which caused them more important
+    for _ in range(10):
+        simulation.sim_step()
+    graph.update()
+    assert len(graph) == 50
+    assert list(events.importance) == \
+        pytest.approx(get_importance(simulation.past_events))
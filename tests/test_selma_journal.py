@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+
+"""Tests of snapshots and the undo journal in selma_journal.py"""
+
+import copy
+import pytest
+import selma
+
+DECK = """
+card "start" {
+    effects (
+        var create-num "tension"
+        var create-string "weather"
+        var create-list "places"
+        cast create-num-all "happiness"
+        cast create-list-all "friends"
+        var.weather = "sunny"
+    )
+    next (
+        "meet"
+    )
+}
+
+card "meet" {
+    role "a" (
+        var.happiness >= 0
+    )
+    role "b" (
+        attributes has "brave"
+    )
+    effects (
+        roles.a.var.happiness += 2
+        roles.b.var.happiness += 1
+        var.tension += 1
+        var.places add "park"
+    )
+    next (
+        "fight"
+    )
+}
+
+card "fight" {
+    conditions (
+        var.tension > 1
+    )
+    role "x" (
+        var.happiness > 1
+    )
+    role "y" (
+        inventory has "sword"
+    )
+    effects (
+        roles.x.var.happiness -= 3
+        var.tension -= 2
+        var.weather = "rainy"
+        roles.y.attributes add "brave"
+    )
+}
+
+card "calm" {
+    conditions (
+        var.weather = "rainy"
+        var.places has "park"
+    )
+    effects (
+        var.tension += 0.5
+        var.weather = "sunny"
+    )
+}
+
+char "Anna" {
+    init (
+        var create-num "strength"
+        var.strength = 5
+    )
+    attributes (
+        brave
+    )
+    inventory (
+        sword
+    )
+}
+
+char "Bob" {
+    attributes (
+        shy
+    )
+    inventory (
+        sword
+    )
+}
+
+char "Cleo" {
+    attributes (
+        brave
+        smart
+    )
+}
+"""
+
+def get_state(simulation):
+    """Returns everything a step can change, in a form which can be compared"""
+    events = [(event.event_name,
+               event.roles,
+               event.values_modified,
+               event.values_affecting,
+               [(cause.event_id, weight) for cause, weight in event.causing_events])
+              for event in simulation.past_events]
+    cast = {name: (dict(character.var),
+                   list(character.attributes),
+                   list(character.inventory))
+            for name, character in simulation.cast.items()}
+    eligible = [card_name for card_name in simulation.event_cards
+                if simulation.eligibility.is_eligible(card_name)]
+    return (events,
+            cast,
+            copy.deepcopy(simulation.var),
+            list(simulation.attributes),
+            list(simulation.draw_deck),
+            simulation.steps_count,
+            simulation.card_table.get_all_names(),
+            eligible,
+            simulation.random.getstate())
+
+def run(simulation, steps):
+    for _ in range(steps):
+        simulation.sim_step()
+
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_restoring_and_running_again_gives_the_same_story(load_simulation, seed):
+    reference = load_simulation(DECK, seed)
+    run(reference, 30)
+    state_30 = get_state(reference)
+    run(reference, 30)
+    state_60 = get_state(reference)
+    run(reference, 40)
+    state_100 = get_state(reference)
+
+    simulation = load_simulation(DECK, seed)
+    snapshot_0 = simulation.snapshot()
+    run(simulation, 30)
+    snapshot_30 = simulation.snapshot()
+    run(simulation, 30)
+    assert get_state(simulation) == state_60
+
+    simulation.restore(snapshot_30)
+    assert get_state(simulation) == state_30
+    for _ in range(3):
+        run(simulation, 30)
+        assert get_state(simulation) == state_60
+        snapshot_60 = simulation.snapshot()
+        run(simulation, 40)
+        assert get_state(simulation) == state_100
+        simulation.restore(snapshot_60)
+        run(simulation, 40)
+        assert get_state(simulation) == state_100
+        simulation.restore(snapshot_30)
+        assert get_state(simulation) == state_30
+
+    simulation.restore(snapshot_0)
+    run(simulation, 30)
+    assert get_state(simulation) == state_30
+
+    # The steps after snapshot_30 which snapshot_60 was taken after are gone
+    with pytest.raises(selma.SelmaException):
+        simulation.restore(snapshot_60)
+
+def test_restoring_before_causes_were_found(load_simulation):
+    reference = load_simulation(DECK, 4)
+    run(reference, 60)
+    state_60 = get_state(reference)
+
+    # The causes are found up to a later event than the snapshot, and are
+    # then found again for the events which replace the ones rolled back
+    simulation = load_simulation(DECK, 4)
+    run(simulation, 20)
+    snapshot = simulation.snapshot()
+    run(simulation, 30)
+    assert simulation.past_events[45].causing_events is not None
+    simulation.restore(snapshot)
+    run(simulation, 40)
+    assert get_state(simulation) == state_60
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+
+"""Tests of the story search in selma_search.py"""
+
+from selma_search import SelmaStoryScore, SelmaStorySearch
+
+DECK = """
+card "start" {
+    effects (
+        var create-num "tension"
+    )
+}
+card "rise" {
+    effects (
+        var.tension += 1
+    )
+}
+card "wait" {
+}
+"""
+
+def test_stop_score_is_reached_by_the_story_itself(load_simulation):
+    simulation = load_simulation(DECK)
+
+    score = SelmaStoryScore(goals=["var.tension >= 9"],
+                            density_weight=0,
+                            importance_weight=0)
+    search = SelmaStorySearch(simulation, score, beam_width=4, expansions=2,
+                              rollouts=4, rollout_steps=12, seed=1)
+    beam = search.run(20, stop_score=10)
+
+    # The rollouts reach the goal long before any story does
+    _, story_score, cards = beam[0]
+    assert story_score == 10
+    assert simulation.var["tension"] >= 9
+    assert cards.count("rise") == simulation.var["tension"]
+    assert score(simulation, 0) == story_score